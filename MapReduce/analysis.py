@@ -1,23 +1,143 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import sys
+import re
+import glob
 
 # --- Configuration ---
 RESULTS_CSV_FILE = 'scalability_results.csv'
 TIME_TABLE_FILE = 'performance_table.md'
 SPEEDUP_PLOT_FILE = 'speedup_plot.png'
 EFFICIENCY_PLOT_FILE = 'efficiency_plot.png'
+# Timing traces written by run_mapreduce.sh with TRACE=1 (see timing.py)
+TRACE_FILES = 'output_*_cores/trace.jsonl'
+PHASE_TABLE_FILE = 'phase_table.md'
+PHASE_SPEEDUP_PLOT_FILE = 'phase_speedup_plot.png'
 
 def time_to_seconds(time_str):
-    """Converts SLURM's elapsed time format (e.g., 00:05:12) to seconds."""
-    parts = list(map(int, time_str.split(':')))
+    """
+    Converts SLURM's elapsed time format (e.g., 00:05:12) to seconds. Plain
+    seconds, as written by benchmark.py (e.g., 12.345), are also accepted.
+    """
+    parts = list(map(float, str(time_str).split(':')))
     seconds = 0
     if len(parts) == 3: # HH:MM:SS
         seconds = parts[0] * 3600 + parts[1] * 60 + parts[2]
     elif len(parts) == 2: # MM:SS
         seconds = parts[0] * 60 + parts[1]
+    elif len(parts) == 1: # Seconds
+        seconds = parts[0]
     return seconds
 
+def scaling_summary(df):
+    """
+    Averages the repeated runs of every series and core count and computes
+    speedup and efficiency against the series' 1-core time. Results from
+    collect_results.sh have no Series column and form one strong-scaling
+    series. For weak scaling (N grows with the cores) efficiency is T_1 / T_p
+    and speedup is the scaled speedup P * T_1 / T_p. Series without a 1-core
+    run are dropped.
+    """
+    if 'Series' not in df:
+        df['Series'] = 'strong'
+    if 'Scaling' not in df:
+        df['Scaling'] = 'strong'
+    summary = df.groupby(['Series', 'Scaling', 'Cores'], sort=False)['TimeSeconds'].agg(
+        TimeSeconds='mean', StdSeconds='std', Runs='count').reset_index()
+
+    baseline = summary[summary['Cores'] == 1].set_index('Series')['TimeSeconds']
+    for series in summary['Series'].unique():
+        if series not in baseline:
+            print(f"Warning: no 1-core run for series '{series}'; it is left out.")
+    summary = summary[summary['Series'].isin(baseline.index)].sort_values(['Series', 'Cores'])
+
+    ratio = summary['Series'].map(baseline) / summary['TimeSeconds']
+    weak = summary['Scaling'] == 'weak'
+    summary['Speedup'] = ratio.where(~weak, ratio * summary['Cores'])
+    summary['Efficiency'] = (ratio / summary['Cores']).where(~weak, ratio)
+    return summary
+
+def load_traces(pattern=TRACE_FILES):
+    """Reads every trace file matching pattern into one DataFrame with a Cores column."""
+    frames = []
+    for path in glob.glob(pattern):
+        match = re.search(r'output_(\d+)_cores', path)
+        if match is None:
+            continue
+        trace = pd.read_json(path, lines=True)
+        trace['Cores'] = int(match.group(1))
+        frames.append(trace)
+    if not frames:
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+def phase_times(trace):
+    """
+    Time spent in each phase per core count. Per-task phases (map, combine,
+    reduce, assign) count the slowest task of every iteration, since that is
+    what the driver waits for; driver phases (map_step, shuffle, ...) are
+    summed as recorded. CPU time, records and bytes are summed over tasks.
+    Imbalance is the mean over iterations of slowest / average task time.
+    """
+    tasks = trace[trace['task'].notna()]
+    per_iteration = tasks.groupby(['Cores', 'phase', 'iteration'], dropna=False)['wall_s'].agg(['max', 'mean'])
+    per_iteration['Imbalance'] = per_iteration['max'] / per_iteration['mean']
+    task_phases = per_iteration.groupby(['Cores', 'phase']).agg(WallSeconds=('max', 'sum'), Imbalance=('Imbalance', 'mean'))
+
+    driver = trace[trace['task'].isna()]
+    driver_phases = driver.groupby(['Cores', 'phase']).agg(WallSeconds=('wall_s', 'sum'))
+
+    totals = trace.groupby(['Cores', 'phase'])[['cpu_s', 'records_in', 'bytes_in', 'bytes_out']].sum(min_count=1)
+    phases = pd.concat([task_phases, driver_phases]).join(totals)
+    return phases.rename(columns={'cpu_s': 'CPUSeconds', 'records_in': 'RecordsIn',
+                                  'bytes_in': 'BytesIn', 'bytes_out': 'BytesOut'}).reset_index()
+
+def analyze_phases():
+    """Breaks speedup and efficiency down per phase when timing traces are available."""
+    trace = load_traces()
+    if trace is None:
+        print(f"\nNo timing traces matching '{TRACE_FILES}' found; run with TRACE=1 for a per-phase breakdown.")
+        return
+    phases = phase_times(trace)
+
+    # Speedup of every phase against its own 1-core time
+    baseline = phases[phases['Cores'] == 1].set_index('phase')['WallSeconds']
+    if baseline.empty:
+        print("\nNo 1-core trace found; the per-phase breakdown needs a 1-core run for its baseline.")
+        return
+    phases['Speedup'] = phases['phase'].map(baseline) / phases['WallSeconds']
+    phases['Efficiency'] = phases['Speedup'] / phases['Cores']
+    phases = phases.sort_values(['phase', 'Cores'])
+
+    report_df = phases.round({'WallSeconds': 3, 'CPUSeconds': 3, 'Imbalance': 2, 'Speedup': 2, 'Efficiency': 3})
+    report_df = report_df[['phase', 'Cores', 'WallSeconds', 'CPUSeconds', 'Imbalance', 'RecordsIn',
+                           'BytesIn', 'BytesOut', 'Speedup', 'Efficiency']]
+    # Driver phases have no counters; keep the others as integers
+    for column in ('RecordsIn', 'BytesIn', 'BytesOut'):
+        report_df[column] = report_df[column].round().astype('Int64')
+    report_df = report_df.rename(columns={'phase': 'Phase', 'WallSeconds': 'Wall (s)', 'CPUSeconds': 'CPU (s)'})
+
+    print("\n--- Per-Phase Performance Breakdown ---")
+    table = report_df.to_markdown(index=False)
+    print(table)
+    with open(PHASE_TABLE_FILE, 'w') as f:
+        f.write(table)
+    print(f"\n-> Phase table saved to '{PHASE_TABLE_FILE}'")
+
+    plt.figure(figsize=(10, 6))
+    for phase, rows in phases.groupby('phase'):
+        plt.plot(rows['Cores'], rows['Speedup'], 'o-', label=phase, markersize=6)
+    cores = sorted(phases['Cores'].unique())
+    plt.plot(cores, cores, 'r--', label='Ideal (Linear) Speedup')
+    plt.title('K-Means Speedup per Phase', fontsize=16)
+    plt.xlabel('Number of Cores (P)', fontsize=12)
+    plt.ylabel('Speedup (T_1 / T_p)', fontsize=12)
+    plt.legend(fontsize=10)
+    plt.grid(True)
+    plt.xticks(cores)
+    plt.savefig(PHASE_SPEEDUP_PLOT_FILE)
+    print(f"-> Phase speedup plot saved to '{PHASE_SPEEDUP_PLOT_FILE}'")
+
 def main():
     """Reads raw timing data, calculates metrics, and generates outputs."""
     try:
@@ -31,27 +151,22 @@ def main():
     # --- Data Processing ---
     # Convert the time string to total seconds for easier calculation
     df['TimeSeconds'] = df['ExecutionTime'].apply(time_to_seconds)
-    
-    # The baseline time is the time it took to run on a single core
-    try:
-        baseline_time = df[df['Cores'] == 1]['TimeSeconds'].iloc[0]
-    except IndexError:
+
+    # Average repeated runs and calculate Speedup and Efficiency against
+    # each series' single-core baseline
+    df = scaling_summary(df)
+    if df.empty:
         print("Error: Baseline time for 1 core not found in the results file.")
         print("A 1-core run is required to calculate speedup and efficiency.")
         sys.exit(1)
 
-    # Calculate Speedup and Efficiency
-    df['Speedup'] = baseline_time / df['TimeSeconds']
-    df['Efficiency'] = df['Speedup'] / df['Cores']
-    df['IdealSpeedup'] = df['Cores']
-
     # --- Generate Markdown Table for Report ---
     # Round the values for cleaner presentation
-    report_df = df.round({'TimeSeconds': 2, 'Speedup': 2, 'Efficiency': 3})
-    
+    report_df = df.round({'TimeSeconds': 2, 'StdSeconds': 2, 'Speedup': 2, 'Efficiency': 3})
+
     # Select and rename columns for the final report table
-    report_df = report_df[['Cores', 'ExecutionTime', 'TimeSeconds', 'Speedup', 'Efficiency']]
-    report_df.rename(columns={'TimeSeconds': 'Time (s)'}, inplace=True)
+    report_df = report_df[['Series', 'Cores', 'Runs', 'TimeSeconds', 'StdSeconds', 'Speedup', 'Efficiency']]
+    report_df.rename(columns={'TimeSeconds': 'Time (s)', 'StdSeconds': 'Std (s)'}, inplace=True)
 
     print("--- Performance Analysis Results ---")
     table = report_df.to_markdown(index=False)
@@ -65,34 +180,40 @@ def main():
 
     # --- Generate Plots ---
     plt.style.use('seaborn-v0_8-whitegrid')
+    cores = sorted(df['Cores'].unique())
 
     # 1. Speedup Plot
     plt.figure(figsize=(10, 6))
-    plt.plot(df['Cores'], df['Speedup'], 'o-', label='Actual Speedup', markersize=8)
-    plt.plot(df['Cores'], df['IdealSpeedup'], 'r--', label='Ideal (Linear) Speedup')
-    plt.title('K-Means Strong Scaling Speedup', fontsize=16)
+    for series, rows in df.groupby('Series', sort=False):
+        plt.plot(rows['Cores'], rows['Speedup'], 'o-', label=series, markersize=8)
+    plt.plot(cores, cores, 'r--', label='Ideal (Linear) Speedup')
+    plt.title('K-Means Scaling Speedup', fontsize=16)
     plt.xlabel('Number of Cores (P)', fontsize=12)
     plt.ylabel('Speedup (T_1 / T_p)', fontsize=12)
     plt.legend(fontsize=10)
     plt.grid(True)
-    plt.xticks(df['Cores'])
+    plt.xticks(cores)
     plt.savefig(SPEEDUP_PLOT_FILE)
     print(f"-> Speedup plot saved to '{SPEEDUP_PLOT_FILE}'")
 
     # 2. Efficiency Plot
     plt.figure(figsize=(10, 6))
-    plt.plot(df['Cores'], df['Efficiency'] * 100, 'o-', label='Actual Efficiency', color='green', markersize=8)
+    for series, rows in df.groupby('Series', sort=False):
+        plt.plot(rows['Cores'], rows['Efficiency'] * 100, 'o-', label=series, markersize=8)
     plt.axhline(y=100, color='r', linestyle='--', label='Ideal Efficiency (100%)')
-    plt.title('K-Means Strong Scaling Efficiency', fontsize=16)
+    plt.title('K-Means Scaling Efficiency', fontsize=16)
     plt.xlabel('Number of Cores (P)', fontsize=12)
     plt.ylabel('Efficiency (Speedup / P) %', fontsize=12)
     plt.ylim(0, 110) # Set y-axis from 0% to 110%
     plt.legend(fontsize=10)
     plt.grid(True)
-    plt.xticks(df['Cores'])
+    plt.xticks(cores)
     plt.savefig(EFFICIENCY_PLOT_FILE)
     print(f"-> Efficiency plot saved to '{EFFICIENCY_PLOT_FILE}'")
 
+    # 3. Per-phase breakdown from the timing traces, if the runs were traced
+    analyze_phases()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Local scalability benchmark for the K-Means job; needs no SLURM.
+
+Sweeps the number of points (N), dimensions (D), clusters (K) and workers on
+the current machine with run_local.py, repeats every configuration and
+writes one row per run to scalability_results.csv, which analysis.py reads
+directly:
+
+    Series,Scaling,Points,Dims,K,Cores,Repeat,Iterations,ExecutionTime
+
+ExecutionTime is the wall time of the whole job in seconds, from loading the
+points to the final assignment, like the SLURM job time collect_results.sh
+reports. Runs with the same Series share a 1-worker baseline:
+
+    strong   N stays fixed while the worker count grows
+    weak     N = points per worker * workers (--weak)
+
+Datasets are generated once per (N, D, K) as binary point stores in the work
+directory with generate_large_script.py's seeded block generator, so a sweep
+is reproducible and later sweeps reuse them.
+
+Usage:
+    python3 benchmark.py --points 1000000 --dims 2 8 --k 8 50 --workers 1 2 4 8 --repeats 3
+    python3 benchmark.py --points 0 --weak 250000 --workers 1 2 4 8
+"""
+import os
+import sys
+import csv
+import time
+import shutil
+import argparse
+import contextlib
+
+import numpy as np
+
+import point_store
+from generate_large_script import CLUSTER_STD_DEV, generate_rows, write_to_csv
+from run_local import DEFAULT_BLOCK_SIZE, run_kmeans
+
+RESULTS_CSV_FILE = 'scalability_results.csv'
+RESULT_FIELDS = ['Series', 'Scaling', 'Points', 'Dims', 'K', 'Cores', 'Repeat', 'Iterations', 'ExecutionTime']
+
+# --- Datasets ---
+
+def dataset_paths(work_dir, n_points, n_dim, k, seed):
+    """Returns the (point store, initial centers) paths of one benchmark dataset."""
+    name = f"n{n_points}_d{n_dim}_k{k}_s{seed}"
+    return os.path.join(work_dir, f"points_{name}.bin"), os.path.join(work_dir, f"centers_{name}.csv")
+
+def ensure_dataset(work_dir, n_points, n_dim, k, seed):
+    """
+    Generates the dataset for (n_points, n_dim, k) unless it already exists.
+    The true and initial centers only depend on (seed, n_dim, k), so every N
+    of a weak-scaling series clusters the same way.
+    """
+    points_path, centers_path = dataset_paths(work_dir, n_points, n_dim, k, seed)
+    if os.path.exists(points_path) and os.path.exists(centers_path):
+        return points_path, centers_path
+    rng = np.random.default_rng([seed, n_dim, k])
+    true_centers = rng.uniform(-50, 50, size=(k, n_dim))
+    initial_centers = rng.uniform(-50, 50, size=(k, n_dim))
+    block_seed = int(rng.integers(1 << 63))
+
+    print(f"Generating {n_points} points (D={n_dim}, K={k})...")
+    tmp_path = f"{points_path}.tmp"
+    with point_store.PointStoreWriter(tmp_path, n_dim) as writer:
+        for points in generate_rows(0, n_points, block_seed, CLUSTER_STD_DEV, true_centers):
+            writer.append(points)
+    os.replace(tmp_path, points_path)
+    write_to_csv(centers_path, initial_centers)
+    return points_path, centers_path
+
+def benchmark_plan(args):
+    """Lists every (series, scaling, N, D, K, workers) configuration of the sweep, baselines first."""
+    plan = []
+    for n_dim in args.dims:
+        for k in args.k:
+            for n_points in args.points:
+                series = f"strong N={n_points} D={n_dim} K={k}"
+                plan += [(series, 'strong', n_points, n_dim, k, w) for w in args.workers]
+            if args.weak:
+                series = f"weak N={args.weak}/worker D={n_dim} K={k}"
+                plan += [(series, 'weak', args.weak * w, n_dim, k, w) for w in args.workers]
+    return plan
+
+# --- Runs ---
+
+def time_run(points_path, centers_path, k, max_iter, num_workers, output_dir, args):
+    """Runs one local K-Means job and returns (wall seconds, iterations)."""
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        iterations = run_kmeans(k, points_path, centers_path, max_iter, output_dir, num_workers,
+                                args.block_size, final_assignment=not args.no_final_assignment)
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(output_dir, ignore_errors=True)
+    return elapsed, iterations
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep N, D, K and worker count locally and write scalability_results.csv.")
+    parser.add_argument("--points", type=int, nargs="+", default=[1000000],
+                        help="Dataset sizes for strong scaling (0 to skip strong scaling).")
+    parser.add_argument("--dims", type=int, nargs="+", default=[2])
+    parser.add_argument("--k", type=int, nargs="+", default=[8])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="Worker counts to run; include 1, which analysis.py uses as the baseline.")
+    parser.add_argument("--weak", type=int, metavar="POINTS_PER_WORKER",
+                        help="Also run a weak-scaling series with this many points per worker.")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per configuration.")
+    parser.add_argument("--max-iter", type=int, default=10)
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument("--no-final-assignment", action="store_true",
+                        help="Only time the iterations, not the final assignment pass.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated datasets.")
+    parser.add_argument("--work-dir", default="benchmark_data",
+                        help="Where datasets are generated and kept between sweeps.")
+    parser.add_argument("--output", default=RESULTS_CSV_FILE)
+    args = parser.parse_args()
+    args.points = [n for n in args.points if n > 0]
+    if not args.points and not args.weak:
+        parser.error("nothing to run: give --points N or --weak POINTS_PER_WORKER")
+    if min(args.workers) < 1 or args.repeats < 1 or args.max_iter < 1:
+        parser.error("--workers, --repeats and --max-iter must be positive")
+    if 1 not in args.workers:
+        print("Warning: no 1-worker runs; analysis.py needs them as the speedup baseline.", file=sys.stderr)
+    if max(args.workers) > os.cpu_count():
+        print(f"Warning: this machine has {os.cpu_count()} cores; runs with more workers are oversubscribed.",
+              file=sys.stderr)
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    plan = benchmark_plan(args)
+    output_dir = os.path.join(args.work_dir, 'run_output')
+    with open(args.output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        for n, (series, scaling, n_points, n_dim, k, workers) in enumerate(plan, 1):
+            points_path, centers_path = ensure_dataset(args.work_dir, n_points, n_dim, k, args.seed)
+            for repeat in range(1, args.repeats + 1):
+                elapsed, iterations = time_run(points_path, centers_path, k, args.max_iter, workers, output_dir, args)
+                writer.writerow({'Series': series, 'Scaling': scaling, 'Points': n_points, 'Dims': n_dim, 'K': k,
+                                 'Cores': workers, 'Repeat': repeat, 'Iterations': iterations,
+                                 'ExecutionTime': f"{elapsed:.3f}"})
+                f.flush() # Keep finished runs if the sweep is interrupted
+                print(f"[{n}/{len(plan)}] {series}, {workers} worker(s), run {repeat}: "
+                      f"{elapsed:.3f} s, {iterations} iterations")
+    print(f"-> Results saved to '{args.output}'; run 'python3 analysis.py' for the tables and plots.")
+
+if __name__ == "__main__":
+    main()
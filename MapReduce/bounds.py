@@ -0,0 +1,156 @@
+"""
+Hamerly-style bound pruning for the K-Means assignment step.
+
+For every point we keep its current label, an upper bound on the distance to
+its own centroid and a lower bound on the distance to the second-closest one.
+When the centroids move, the bounds are loosened by the centroid shifts; a
+point whose upper bound is still below both its lower bound and half the gap
+from its centroid to the nearest other centroid cannot have changed cluster,
+so none of its K distances need to be computed.
+
+The state (labels, upper, lower and the centroids the bounds refer to) lives
+next to a task's partition between iterations: in memory for worker.py, in
+shared memory for run_local.py, and in a small .npz file for mapper.py.
+"""
+import os
+
+import numpy as np
+
+class HamerlyAssigner:
+    """Bound-based nearest-centroid search over one partition."""
+
+    def __init__(self, labels, upper, lower, centroids=None):
+        # Rows with a negative label have no bounds yet and get a full search
+        self.labels = labels
+        self.upper = upper
+        self.lower = lower
+        self.centroids = centroids
+        self.index = None
+        self.distance_evaluations = 0
+
+    @classmethod
+    def empty(cls, n_points=0):
+        """Creates state for n_points rows that all need a full search."""
+        return cls(np.full(n_points, -1, dtype=np.int64), np.zeros(n_points), np.zeros(n_points))
+
+    @classmethod
+    def load(cls, file_path):
+        """Loads state saved by save(), or returns empty state if the file does not exist."""
+        if not os.path.exists(file_path):
+            return cls.empty()
+        with np.load(file_path) as state:
+            return cls(state['labels'].astype(np.int64), state['upper'], state['lower'], state['centroids'])
+
+    def save(self, file_path):
+        """Writes the state atomically so a crashed task never leaves a half-written file."""
+        tmp_path = f"{file_path}.tmp.npz"
+        np.savez(tmp_path, labels=self.labels, upper=self.upper, lower=self.lower, centroids=self.centroids)
+        os.replace(tmp_path, file_path)
+
+    def set_centroids(self, centroids, index=None):
+        """
+        Installs this iteration's centroids and precomputes the per-cluster
+        quantities the bound tests need: how far each centroid moved since the
+        bounds were computed, and half the distance to its nearest neighbour.
+        An optional CentroidIndex is used for the remaining full searches.
+        """
+        k = len(centroids)
+        self.index = index
+        if self.centroids is None or self.centroids.shape != centroids.shape:
+            # No usable history: every row falls back to a full search
+            self.labels[:] = -1
+            shift = np.zeros(k)
+        else:
+            shift = np.sqrt(((centroids - self.centroids) ** 2).sum(axis=1))
+        self.centroids = centroids
+
+        # Lower bounds drop by the largest shift among the *other* centroids
+        order = np.argsort(shift)[::-1]
+        self._shift = shift
+        self._other_shift = np.full(k, shift[order[0]])
+        if k > 1:
+            self._other_shift[order[0]] = shift[order[1]]
+        else:
+            self._other_shift[:] = 0.0
+
+        if k > 1 and index is not None:
+            # The nearest other centroid is the second hit when querying the centroids themselves
+            gaps, _ = index.query(centroids, 2)
+            self._half_gap = 0.5 * gaps[:, 1]
+        elif k > 1:
+            gaps = np.sqrt(np.maximum(pairwise_squared_distances(centroids, centroids), 0.0))
+            np.fill_diagonal(gaps, np.inf)
+            self._half_gap = 0.5 * gaps.min(axis=1)
+        else:
+            self._half_gap = np.full(k, np.inf)
+
+    def _reserve(self, n_points):
+        """Grows the state arrays when a partition is seen for the first time."""
+        missing = n_points - len(self.labels)
+        if missing > 0:
+            self.labels = np.concatenate([self.labels, np.full(missing, -1, dtype=np.int64)])
+            self.upper = np.concatenate([self.upper, np.zeros(missing)])
+            self.lower = np.concatenate([self.lower, np.zeros(missing)])
+
+    def assign_block(self, points, start):
+        """Returns the labels of partition rows [start, start + len(points)), updating their bounds."""
+        stop = start + len(points)
+        self._reserve(stop)
+        labels = self.labels[start:stop]
+        upper = self.upper[start:stop]
+        lower = self.lower[start:stop]
+        centroids = self.centroids
+
+        # 1. Loosen the bounds by how far the centroids moved
+        known = labels >= 0
+        own = np.where(known, labels, 0)
+        upper += np.where(known, self._shift[own], 0.0)
+        lower -= np.where(known, self._other_shift[own], 0.0)
+
+        # 2. Rows whose upper bound beats both tests keep their label untouched
+        bound = np.maximum(self._half_gap[own], lower)
+        check = np.nonzero(~known | (upper > bound))[0]
+
+        # 3. Tighten the upper bound with one exact distance and test again
+        tighten = check[known[check]]
+        if len(tighten):
+            diff = points[tighten] - centroids[labels[tighten]]
+            upper[tighten] = np.sqrt((diff ** 2).sum(axis=1))
+            self.distance_evaluations += len(tighten)
+        full = check[~known[check] | (upper[check] > bound[check])]
+
+        # 4. Full search only for the rows that are still ambiguous
+        if len(full) and self.index is not None and len(centroids) > 1:
+            dist, nearest = self.index.query(points[full], 2)
+            # Counted as a full scan; the tree usually evaluates far fewer
+            self.distance_evaluations += len(full) * len(centroids)
+            labels[full] = nearest[:, 0]
+            upper[full] = dist[:, 0]
+            lower[full] = dist[:, 1]
+        elif len(full):
+            dist = np.sqrt(np.maximum(pairwise_squared_distances(points[full], centroids), 0.0))
+            self.distance_evaluations += dist.size
+            nearest = dist.argmin(axis=1)
+            labels[full] = nearest
+            upper[full] = dist[np.arange(len(full)), nearest]
+            if dist.shape[1] > 1:
+                dist[np.arange(len(full)), nearest] = np.inf
+                lower[full] = dist.min(axis=1)
+            else:
+                lower[full] = np.inf
+        return labels
+
+def pairwise_squared_distances(a, b):
+    """
+    Squared Euclidean distances between every row of a and every row of b,
+    in float64. Both sides are shifted by the mean of b first so that the
+    |a|^2 - 2ab + |b|^2 expansion does not cancel for data far from the origin.
+    """
+    reference = np.mean(b, axis=0, dtype=np.float64)
+    a = np.asarray(a, dtype=np.float64) - reference
+    b = np.asarray(b, dtype=np.float64) - reference
+    result = a @ b.T
+    result *= -2.0
+    result += (a ** 2).sum(axis=1)[:, np.newaxis]
+    result += (b ** 2).sum(axis=1)
+    return result
@@ -0,0 +1,60 @@
+"""
+Spatial index over the centroid set for large-K nearest-centroid search.
+
+The index is rebuilt once per iteration from that iteration's centroids and
+queried a whole block of points at a time. A KD-tree only pays off when there
+are many centroids in few dimensions; otherwise build_centroid_index() returns
+None and callers fall back to the brute-force matrix product in mapper.py.
+
+The KD-tree comes from SciPy, which is optional. Without it, 'auto' silently
+uses brute force.
+"""
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# KD-tree pruning degrades towards a full scan as the dimension grows
+MAX_INDEX_DIMENSIONS = 16
+# Below this many centroids one matrix product per block is faster than a tree
+MIN_INDEX_CENTROIDS = 64
+
+INDEX_MODES = ('auto', 'kdtree', 'brute')
+
+class CentroidIndex:
+    """KD-tree over the centroids of one iteration."""
+
+    def __init__(self, centroids):
+        self.k = len(centroids)
+        self.tree = cKDTree(centroids)
+
+    def query(self, points, n_nearest=1):
+        """Returns (distances, indices) of the n_nearest closest centroids of every point."""
+        distances, indices = self.tree.query(points, k=n_nearest)
+        return distances, indices
+
+    def nearest(self, points):
+        """Returns the index of the closest centroid of every point."""
+        _, indices = self.tree.query(points, k=1)
+        return indices
+
+def use_index(k, n_dim, mode='auto'):
+    """Decides whether a KD-tree should be used for K centroids in n_dim dimensions."""
+    if mode == 'brute':
+        return False
+    if mode == 'kdtree':
+        if cKDTree is None:
+            raise ImportError("The 'kdtree' centroid index requires SciPy (pip install scipy)")
+        return True
+    return cKDTree is not None and n_dim <= MAX_INDEX_DIMENSIONS and k >= MIN_INDEX_CENTROIDS
+
+def build_centroid_index(centroids, mode='auto'):
+    """Builds a CentroidIndex for this iteration, or returns None when brute force is the better choice."""
+    if mode not in INDEX_MODES:
+        raise ValueError(f"Unknown centroid index mode '{mode}', expected one of {INDEX_MODES}")
+    k, n_dim = centroids.shape
+    if not use_index(k, n_dim, mode):
+        return None
+    return CentroidIndex(np.asarray(centroids, dtype=np.float64))
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import sys
 
+import timing
+from summation import neumaier_add
+
 def main():
     """
     Reads sorted (key, value) pairs from a single mapper, where the key is a
@@ -20,6 +23,7 @@ def main():
     """
     current_cluster_id = None
     point_sum = None
+    compensation = None # Lost low-order bits of point_sum (see summation.py)
     point_count = 0
     
     # Read from standard input
@@ -35,24 +39,27 @@ def main():
         if cluster_id == current_cluster_id:
             if point_sum is None:
                 point_sum = [0.0] * len(point)
+                compensation = [0.0] * len(point)
             for i in range(len(point)):
-                point_sum[i] += point[i]
+                point_sum[i], compensation[i] = neumaier_add(point_sum[i], compensation[i], point[i])
             point_count += 1
         else:
             # The cluster ID has changed, so we output the aggregated result
             # for the previous cluster.
-            sum_str = ",".join(map(str, point_sum))
+            sum_str = ",".join(str(s + c) for s, c in zip(point_sum, compensation))
             print(f"{current_cluster_id}\t{sum_str}\t{point_count}")
             
             # Reset for the new cluster
             current_cluster_id = cluster_id
             point_sum = point
+            compensation = [0.0] * len(point)
             point_count = 1
             
     # Output the last aggregated cluster after the loop finishes
     if current_cluster_id is not None:
-        sum_str = ",".join(map(str, point_sum))
+        sum_str = ",".join(str(s + c) for s, c in zip(point_sum, compensation))
         print(f"{current_cluster_id}\t{sum_str}\t{point_count}")
 
 if __name__ == "__main__":
-    main()
+    with timing.Phase('combine', stdio=True):
+        main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Block-compressed CSV input for the K-Means job.
+
+A frame store is a CSV points file cut into frames of whole lines, each
+compressed on its own, plus a small offset index next to it:
+
+    points.csv.gz       the frames back to back (gzip members, or zstd frames
+                        for *.zst), so gunzip/zcat still read it as one file
+    points.csv.gz.idx   text index:
+                            KMFRAMES <codec> <D>
+                            <byte offset> <compressed bytes> <rows>   (one line per frame)
+
+Because every frame starts a new compression stream at a known offset, a
+mapper seeks straight to its own frames and decompresses them as a stream,
+a piece at a time, in parallel with every other task. Nothing is copied to
+uncompressed chunk files. Frames are handed out to tasks in contiguous
+ranges, so tasks read their points in input order.
+
+gzip uses the standard library; zstd needs the optional 'zstandard' package.
+
+Usage (one-time compression of an existing CSV):
+    python3 frame_store.py <points.csv> <points.csv.gz|points.csv.zst> [--frame-rows N]
+"""
+import os
+import glob
+import zlib
+import argparse
+from itertools import islice
+
+import numpy as np
+
+import point_store
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_MAGIC = "KMFRAMES"
+INDEX_SUFFIX = ".idx"
+CODECS = {'.gz': 'gzip', '.zst': 'zstd'}
+FRAME_ROWS = 100000 # Rows per frame: the unit of parallelism and of random access
+COMPRESS_LEVEL = {'gzip': 6, 'zstd': 3}
+READ_BYTES = 1 << 20 # Compressed bytes decompressed per step while streaming a frame
+
+def codec_of(file_path):
+    """Returns the codec implied by the file extension ('gzip' or 'zstd'), or None."""
+    return CODECS.get(os.path.splitext(file_path)[1])
+
+def index_path(file_path):
+    return file_path + INDEX_SUFFIX
+
+def is_frame_store(file_path):
+    """True for a *.gz or *.zst file that has a frame index next to it."""
+    return codec_of(file_path) is not None and os.path.isfile(index_path(file_path))
+
+def check_codec(codec):
+    if codec == 'zstd' and zstandard is None:
+        raise ImportError("zstd frame stores require the 'zstandard' package (pip install zstandard)")
+
+# --- Frames ---
+
+def compress_frame(data, codec):
+    """Compresses one frame of CSV bytes as a self-contained gzip member or zstd frame."""
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=COMPRESS_LEVEL['zstd']).compress(data)
+    compressor = zlib.compressobj(COMPRESS_LEVEL['gzip'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def decompressor(codec):
+    """Returns a streaming decompressor for one frame."""
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+def write_index(file_path, codec, n_dim, frames):
+    """Writes the index of a frame store atomically; frames holds (offset, compressed bytes, rows) tuples."""
+    tmp_path = index_path(file_path) + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(f"{INDEX_MAGIC} {codec} {n_dim}\n")
+        f.write("".join(f"{offset} {size} {rows}\n" for offset, size, rows in frames))
+    os.replace(tmp_path, index_path(file_path))
+
+def read_index(file_path):
+    """Returns (codec, D, frames) of a frame store, frames as an (n, 3) array of offset, compressed bytes, rows."""
+    with open(index_path(file_path), 'r') as f:
+        magic, codec, n_dim = f.readline().split()
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"'{index_path(file_path)}' is not a frame index")
+        frames = np.loadtxt(f, dtype=np.int64, ndmin=2).reshape(-1, 3)
+    return codec, int(n_dim), frames
+
+def read_header(file_path):
+    """Returns (N, D) of a frame store from its index, like point_store.read_header."""
+    _, n_dim, frames = read_index(file_path)
+    return int(frames[:, 2].sum()), n_dim
+
+class FrameWriter:
+    """
+    Streams text lines or blocks of points into a new frame store, one
+    compressed frame per frame_rows rows. With index=False no index is
+    written, so separately written parts can be concatenated and indexed
+    once (see generate_large_script.py); frames lists every frame written.
+    """
+
+    def __init__(self, file_path, n_dim, codec=None, frame_rows=FRAME_ROWS, index=True):
+        self.file_path = file_path
+        self.n_dim = n_dim
+        self.codec = codec or codec_of(file_path)
+        if self.codec is None:
+            raise ValueError(f"'{file_path}' needs a .gz or .zst extension")
+        check_codec(self.codec)
+        self.frame_rows = frame_rows
+        self.index = index
+        self.frames = []
+        self.pending = []
+        self.offset = 0
+        self.f = open(file_path, 'wb')
+
+    def write_lines(self, lines):
+        """Appends CSV lines (str, each ending with a newline)."""
+        for line in lines:
+            self.pending.append(line)
+            if len(self.pending) == self.frame_rows:
+                self._flush()
+
+    def append(self, points):
+        """Appends a (rows, D) block of points."""
+        self.write_lines(",".join(map(str, point)) + "\n" for point in np.asarray(points).tolist())
+
+    def _flush(self):
+        if not self.pending:
+            return
+        frame = compress_frame("".join(self.pending).encode(), self.codec)
+        self.f.write(frame)
+        self.frames.append((self.offset, len(frame), len(self.pending)))
+        self.offset += len(frame)
+        self.pending = []
+
+    def close(self):
+        self._flush()
+        self.f.close()
+        if self.index:
+            write_index(self.file_path, self.codec, self.n_dim, self.frames)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        # A failed write leaves no store behind, so it is never mistaken for a complete one
+        self.f.close()
+        os.remove(self.file_path)
+        if self.index and os.path.exists(index_path(self.file_path)):
+            os.remove(index_path(self.file_path))
+
+# --- Reading ---
+
+def iter_frame_lines(file_path, codec, frames):
+    """
+    Decompresses the given frames in order and yields their lines. Each frame
+    is streamed READ_BYTES of compressed data at a time, so memory does not
+    depend on the frame size.
+    """
+    check_codec(codec)
+    with open(file_path, 'rb') as f:
+        for offset, size, _ in frames.tolist():
+            f.seek(offset)
+            decoder = decompressor(codec)
+            tail = b""
+            remaining = size
+            while remaining > 0:
+                data = f.read(min(READ_BYTES, remaining))
+                if not data:
+                    raise ValueError(f"'{file_path}' is shorter than its index says")
+                remaining -= len(data)
+                text = tail + decoder.decompress(data)
+                cut = text.rfind(b"\n") + 1
+                yield from text[:cut].decode().splitlines(True)
+                tail = text[cut:]
+            if tail:
+                yield tail.decode()
+
+def task_frames(file_path, task_id, num_tasks):
+    """Returns (codec, D, frames) for the contiguous range of frames owned by one of num_tasks tasks."""
+    codec, n_dim, frames = read_index(file_path)
+    start, stop = point_store.task_row_range(len(frames), task_id, num_tasks)
+    return codec, n_dim, frames[start:stop]
+
+def read_partition_blocks(file_path, task_id, num_tasks, block_size, dtype=np.float64):
+    """Streams one task's frames and yields their points in blocks of at most block_size rows."""
+    codec, n_dim, frames = task_frames(file_path, task_id, num_tasks)
+    yield from point_store.read_point_blocks(iter_frame_lines(file_path, codec, frames), block_size, n_dim, dtype)
+
+def pick_random_point(points_file, rng):
+    """
+    Draws one input point at random, without reading the whole input (the
+    first k-means|| candidate, see kmeans_init.py, and the random sweep
+    starts of sweep.py). A point store row is picked uniformly; for CSV
+    input (a file or a directory of chunk_XX.txt shards) the first full line
+    after a random byte offset is used, which avoids scanning the data at the
+    cost of favouring points after long lines. A block-compressed CSV only
+    decompresses one frame, picked by its row count.
+    """
+    if point_store.is_point_store(points_file):
+        n_points, _, _ = point_store.read_header(points_file)
+        row = int(rng.integers(n_points))
+        return np.asarray(point_store.open_points(points_file, row, row + 1)[0], dtype=np.float64)
+    if is_frame_store(points_file):
+        codec, _, frames = read_index(points_file)
+        frame = rng.choice(len(frames), p=frames[:, 2] / frames[:, 2].sum())
+        row = int(rng.integers(frames[frame, 2]))
+        line = next(islice(iter_frame_lines(points_file, codec, frames[frame:frame + 1]), row, None))
+        return np.array(line.strip().split(','), dtype=np.float64)
+    if os.path.isdir(points_file):
+        chunks = sorted(glob.glob(os.path.join(points_file, "chunk_*.txt")))
+        sizes = np.array([os.path.getsize(chunk) for chunk in chunks], dtype=np.float64)
+        points_file = chunks[rng.choice(len(chunks), p=sizes / sizes.sum())]
+    with open(points_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(int(rng.integers(f.tell())))
+        f.readline()
+        line = f.readline().strip()
+        if not line:
+            f.seek(0)
+            line = f.readline().strip()
+    return np.array(line.decode().split(','), dtype=np.float64)
+
+def compress_csv(csv_path, store_path, frame_rows=FRAME_ROWS):
+    """Compresses a points CSV into a frame store without parsing the points. Returns N."""
+    with open(csv_path, 'r') as f:
+        first_line = f.readline()
+        if not first_line.strip():
+            raise ValueError(f"'{csv_path}' is empty")
+        n_dim = len(first_line.strip().split(','))
+        f.seek(0)
+        with FrameWriter(store_path, n_dim, frame_rows=frame_rows) as writer:
+            while True:
+                lines = [line if line.endswith("\n") else line + "\n" for line in islice(f, frame_rows) if line.strip()]
+                if not lines:
+                    break
+                writer.write_lines(lines)
+    return sum(rows for _, _, rows in writer.frames)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress a points CSV into independently decompressible frames.")
+    parser.add_argument("csv_path")
+    parser.add_argument("store_path", help="Output file, *.gz (gzip) or *.zst (zstd); the index is written to <store_path>.idx.")
+    parser.add_argument("--frame-rows", type=int, default=FRAME_ROWS, help="Points per compressed frame.")
+    args = parser.parse_args()
+    if codec_of(args.store_path) is None:
+        parser.error("the output file must end in .gz or .zst")
+    if args.frame_rows < 1:
+        parser.error("--frame-rows must be positive")
+    n_points = compress_csv(args.csv_path, args.store_path, args.frame_rows)
+    print(f"-> Compressed {n_points} points from '{args.csv_path}' to '{args.store_path}' "
+          f"({os.path.getsize(args.store_path)} bytes, index in '{index_path(args.store_path)}')")
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,131 @@
 import numpy as np
 import csv
-import random
 import os
-import sys
+import argparse
+from multiprocessing import Pool
+
+import frame_store
+import point_store
 
 # --- Configuration ---
 # All parameters are now taken from the command line.
 CLUSTER_STD_DEV = 2.5 
 
 # --- File Names ---
-os.makedirs('data', exist_ok=True) # Use a new directory
 POINTS_FILE = 'data/points.csv'
+POINTS_STORE_FILE = 'data/points.bin'
+COMPRESSED_EXTENSIONS = {'gz': '.gz', 'zst': '.zst'} # Block-compressed CSV, see frame_store.py
+SHARDS_DIR = 'data/shards'
 INITIAL_CENTERS_FILE = 'data/initial_centers.csv'
+# Points are generated in blocks of this many rows. Every block has its own
+# random stream seeded with (seed, block index), so the dataset only depends
+# on the seed, not on the number of shards or worker processes.
+GENERATE_BLOCK = 100000
+
+def generate_rows(start, stop, seed, std_dev, true_centers):
+    """Yields the points of global rows [start, stop) in blocks, vectorized per block."""
+    k, n_dim = true_centers.shape
+    if stop <= start:
+        return
+    for block in range(start // GENERATE_BLOCK, (stop - 1) // GENERATE_BLOCK + 1):
+        rng = np.random.default_rng([seed, block])
+        block_start = block * GENERATE_BLOCK
+        # Pick a random true center for every point, then add normal noise around it
+        centers = true_centers[rng.integers(k, size=GENERATE_BLOCK)]
+        points = rng.normal(loc=centers, scale=std_dev)
+        yield points[max(start - block_start, 0):min(stop - block_start, GENERATE_BLOCK)]
 
-def generate_and_write_points(n_points, n_dim, k, std_dev, true_centers):
+def write_rows(task):
     """
-    Generates points one by one and writes them directly to a CSV file
-    to avoid using large amounts of memory.
+    Pool task: writes global rows [start, stop) either as a CSV file, as
+    compressed CSV frames (returning their (offset, bytes, rows) list), a
+    point store of its own (of dtype), or into its slice of a pre-allocated point store.
     """
-    with open(POINTS_FILE, 'w', newline='') as f:
-        writer = csv.writer(f)
-        for i in range(n_points):            
-            # Pick a random true center
-            center = random.choice(true_centers)
-            # Create a point using a normal distribution around the center
-            point = np.random.normal(loc=center, scale=std_dev)
-            writer.writerow(point)
+    path, output_format, start, stop, offset, seed, std_dev, true_centers, dtype, frame_rows = task
+    blocks = generate_rows(start, stop, seed, std_dev, true_centers)
+    if output_format in COMPRESSED_EXTENSIONS:
+        with frame_store.FrameWriter(path, true_centers.shape[1], frame_rows=frame_rows, index=False) as writer:
+            for points in blocks:
+                writer.append(points)
+        return writer.frames
+    if output_format == 'csv':
+        with open(path, 'w') as f:
+            for points in blocks:
+                f.write("".join(",".join(map(str, point)) + "\n" for point in points.tolist()))
+    elif offset is None:
+        with point_store.PointStoreWriter(path, true_centers.shape[1], dtype) as writer:
+            for points in blocks:
+                writer.append(points)
+    else:
+        rows = point_store.open_points(path, offset, offset + stop - start, mode='r+')
+        row = 0
+        for points in blocks:
+            rows[row:row + len(points)] = points
+            row += len(points)
+        rows.flush()
+
+def generate_sharded(n_points, num_shards, output_format, seed, std_dev, true_centers, num_workers,
+                     dtype='float64'):
+    """
+    Writes one file per mapper task into SHARDS_DIR: chunk_XX.txt (CSV) or
+    points_XX.bin (point store). Shard XX holds the rows the driver would
+    have given task XX, so run_mapreduce.sh can skip the split step.
+    """
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+    for name in os.listdir(SHARDS_DIR):
+        # Stale shards from an earlier run would be read as part of this dataset
+        if name.startswith(('chunk_', 'points_')):
+            os.remove(os.path.join(SHARDS_DIR, name))
+    name = "chunk_{:02d}.txt" if output_format == 'csv' else point_store.SHARD_NAME
+    tasks = []
+    for shard in range(num_shards):
+        start, stop = point_store.task_row_range(n_points, shard, num_shards)
+        tasks.append((os.path.join(SHARDS_DIR, name.format(shard)), output_format, start, stop, None,
+                      seed, std_dev, true_centers, dtype, None))
+    with Pool(num_workers) as pool:
+        pool.map(write_rows, tasks)
+    return SHARDS_DIR
+
+def generate_single_file(n_points, output_format, seed, std_dev, true_centers, num_workers,
+                         dtype='float64', frame_rows=frame_store.FRAME_ROWS):
+    """
+    Writes every point to POINTS_FILE, POINTS_STORE_FILE or a block-compressed
+    POINTS_FILE.gz/.zst. Workers fill disjoint row ranges: in place for a
+    point store, or as CSV or compressed parts that are concatenated in order
+    afterwards. Compressed parts are whole frames, so the frame index of the
+    result is the parts' indexes with shifted offsets.
+    """
+    n_dim = true_centers.shape[1]
+    ranges = [point_store.task_row_range(n_points, w, num_workers) for w in range(num_workers)]
+    if output_format == 'bin':
+        point_store.allocate(POINTS_STORE_FILE, n_points, n_dim, dtype)
+        tasks = [(POINTS_STORE_FILE, 'bin', start, stop, start, seed, std_dev, true_centers, dtype, None)
+                 for start, stop in ranges]
+        with Pool(num_workers) as pool:
+            pool.map(write_rows, tasks)
+        return POINTS_STORE_FILE
+
+    output_path = POINTS_FILE + COMPRESSED_EXTENSIONS.get(output_format, '')
+    # Parts keep the output's extension, which selects the codec of their frames
+    tasks = [(f"{POINTS_FILE}.part_{w:02d}{COMPRESSED_EXTENSIONS.get(output_format, '')}", output_format,
+              start, stop, None, seed, std_dev, true_centers, dtype, frame_rows)
+             for w, (start, stop) in enumerate(ranges)]
+    with Pool(num_workers) as pool:
+        part_frames = pool.map(write_rows, tasks)
+    frames = []
+    with open(output_path, 'wb') as out:
+        for task, task_frames in zip(tasks, part_frames):
+            frames += [(out.tell() + offset, size, rows) for offset, size, rows in task_frames or []]
+            with open(task[0], 'rb') as part:
+                while True:
+                    data = part.read(1 << 20)
+                    if not data:
+                        break
+                    out.write(data)
+            os.remove(task[0])
+    if output_format in COMPRESSED_EXTENSIONS:
+        frame_store.write_index(output_path, frame_store.codec_of(output_path), n_dim, frames)
+    return output_path
 
 def write_to_csv(filepath, data):
     """Writes a list of lists or numpy array to a CSV file."""
@@ -37,31 +137,69 @@ def write_to_csv(filepath, data):
 def main():
     """
     Main function to generate a large dataset without holding it in memory.
-    This script ONLY generates points.csv and initial_centers.csv.
+    This script ONLY generates the points and initial_centers.csv.
     It DOES NOT run a sequential K-Means, as the data is too large.
     """
-    if len(sys.argv) != 4:
-        print("Usage: python3 generate_large_data.py <num_points> <num_dimensions> <K>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Generate a large clustered dataset for the K-Means job.")
+    parser.add_argument("num_points", type=int)
+    parser.add_argument("num_dimensions", type=int)
+    parser.add_argument("k", type=int)
+    parser.add_argument("format", nargs="?", choices=('csv', 'bin', 'gz', 'zst'), default='csv',
+                        help="csv writes text points, bin writes binary point stores (see point_store.py), "
+                             "gz and zst write block-compressed CSV with a frame index (see frame_store.py).")
+    parser.add_argument("--shards", type=int, default=0,
+                        help=f"Write this many pre-split files (one per mapper task) into {SHARDS_DIR}/ "
+                             "instead of a single points file.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of generator processes (default: number of local cores).")
+    parser.add_argument("--dtype", choices=point_store.DTYPES, default='float64',
+                        help="Coordinate type of bin output; float32 halves the size of the point store.")
+    parser.add_argument("--frame-rows", type=int, default=frame_store.FRAME_ROWS,
+                        help="Points per independently compressed frame of gz/zst output, the smallest unit "
+                             "a mapper task can be given.")
+    parser.add_argument("--seed", type=int,
+                        help="Seed for a reproducible dataset (default: a fresh random seed, which is printed).")
+    args = parser.parse_args()
+    if args.shards < 0 or args.workers < 1 or args.frame_rows < 1:
+        parser.error("--shards must be >= 0, and --workers and --frame-rows >= 1")
+    if args.dtype != 'float64' and args.format != 'bin':
+        parser.error("--dtype only applies to bin output")
+    if args.shards and args.format in COMPRESSED_EXTENSIONS:
+        parser.error("compressed output is always one file; mappers already read only their own frames")
+    if args.format == 'zst':
+        frame_store.check_codec('zstd')
 
-    NUM_POINTS = int(sys.argv[1])
-    NUM_DIMENSIONS = int(sys.argv[2])
-    K = int(sys.argv[3])
+    NUM_POINTS = args.num_points
+    NUM_DIMENSIONS = args.num_dimensions
+    K = args.k
+    seed = args.seed if args.seed is not None else int(np.random.SeedSequence().entropy % (1 << 63))
+    print(f"Generating {NUM_POINTS} points with seed {seed} on {args.workers} worker(s)...")
+    rng = np.random.default_rng(seed)
     
     # --- 1. Generate True Centers and Initial Centers ---
     # We still need the "true" centers around which to generate data.
-    true_centers = np.random.uniform(-50, 50, size=(K, NUM_DIMENSIONS))
+    true_centers = rng.uniform(-50, 50, size=(K, NUM_DIMENSIONS))
     
     # We can't pick initial centers from the dataset, as we never hold it all.
     # A simple and effective strategy is to just generate another K random points.
-    initial_centers = np.random.uniform(-50, 50, size=(K, NUM_DIMENSIONS))
+    # (run_kmeans_init.sh can replace them with k-means|| centers.)
+    initial_centers = rng.uniform(-50, 50, size=(K, NUM_DIMENSIONS))
     
     # --- 2. Write Initial Centers File ---
+    os.makedirs('data', exist_ok=True) # Use a new directory
     write_to_csv(INITIAL_CENTERS_FILE, initial_centers)
     print(f"-> Successfully created '{INITIAL_CENTERS_FILE}'")
 
-    # --- 3. Generate and Stream Points File ---
-    generate_and_write_points(NUM_POINTS, NUM_DIMENSIONS, K, CLUSTER_STD_DEV, true_centers)
+    # --- 3. Generate and Stream Points ---
+    # Blocks are seeded from a different stream than the centers above
+    block_seed = int(rng.integers(1 << 63))
+    if args.shards:
+        output = generate_sharded(NUM_POINTS, args.shards, args.format, block_seed,
+                                  CLUSTER_STD_DEV, true_centers, min(args.workers, args.shards), args.dtype)
+    else:
+        output = generate_single_file(NUM_POINTS, args.format, block_seed,
+                                      CLUSTER_STD_DEV, true_centers, args.workers, args.dtype, args.frame_rows)
+    print(f"-> Successfully created '{output}'")
     
     print(f"{NUM_POINTS} points generated!")
 
@@ -1,8 +1,9 @@
 import numpy as np
 import csv
-import random
 import os
-import sys
+import argparse
+
+import point_store
 
 # --- Configuration ---
 # NUM_POINTS = 10000  # Number of data points to generate
@@ -10,17 +11,26 @@ import sys
 # K = 15                # Number of clusters
 # MAX_ITERATIONS = 50   # Max iterations for the naive K-Means
 CLUSTER_STD_DEV = 2.5 # Standard deviation for clusters (how spread out they are)
+# Floats in the per-block (rows x K x D) difference array of naive_kmeans;
+# 2^22 float64 values keep it around 32 MB whatever N is.
+BLOCK_ELEMENTS = 1 << 22
+GENERATE_BLOCK = 100000 # Points generated and written per block
 
 # --- File Names ---
 os.makedirs('data', exist_ok=True)
 POINTS_FILE = 'data/points.csv'
+# Binary copy of the points (see point_store.py) that naive_kmeans streams
+# from disk; run_mapreduce.sh can also read it directly.
+POINTS_STORE_FILE = 'data/points.bin'
 INITIAL_CENTERS_FILE = 'data/initial_centers.csv'
 EXPECTED_CENTERS_FILE = 'data/expected_centers.csv'
 EXPECTED_ASSIGNMENTS_FILE = 'data/expected_assignments.csv'
 
 def generate_clustered_data(n_points, n_dim, k, std_dev):
     """
-    Generates realistic data points grouped around K centers.
+    Generates realistic data points grouped around K centers and writes them
+    to POINTS_FILE and POINTS_STORE_FILE, one block at a time. Returns the
+    points as a read-only memory map of the point store.
     """
     print(f"Generating {n_points} data points in {n_dim} dimensions for {k} clusters...")
     
@@ -28,15 +38,16 @@ def generate_clustered_data(n_points, n_dim, k, std_dev):
     true_centers = np.random.uniform(-50, 50, size=(k, n_dim))
     
     # 2. Generate points around these true centers
-    points = []
-    for i in range(n_points):
-        # Pick a random true center
-        center = random.choice(true_centers)
-        # Create a point using a normal distribution around the center
-        point = np.random.normal(loc=center, scale=std_dev)
-        points.append(point)
+    with open(POINTS_FILE, 'w') as f, point_store.PointStoreWriter(POINTS_STORE_FILE, n_dim) as store:
+        for start in range(0, n_points, GENERATE_BLOCK):
+            n = min(GENERATE_BLOCK, n_points - start)
+            # Pick a random true center per point, then a normal distribution around it
+            centers = true_centers[np.random.randint(k, size=n)]
+            points = np.random.normal(loc=centers, scale=std_dev)
+            f.write("".join(",".join(map(str, point)) + "\n" for point in points.tolist()))
+            store.append(points)
         
-    return np.array(points)
+    return point_store.open_points(POINTS_STORE_FILE)
 
 def write_to_csv(filepath, data):
     """
@@ -47,34 +58,54 @@ def write_to_csv(filepath, data):
         for row in data:
             writer.writerow(row)
 
+def block_rows(k, n_dim):
+    """Points per block so that the rows x K x D difference array stays within BLOCK_ELEMENTS."""
+    return max(1, BLOCK_ELEMENTS // (k * n_dim))
+
+def assign_block(points, centroids):
+    """Index of the closest centroid (exact Euclidean distance) for every row of a block."""
+    distances = np.sqrt(((points[:, np.newaxis] - centroids) ** 2).sum(axis=2))
+    return np.argmin(distances, axis=1)
+
 def naive_kmeans(points, initial_centroids, max_iter):
     """
     A simple, non-distributed implementation of K-Means.
     This serves as the ground truth to verify the MapReduce output.
+
+    points may be a memory map: they are processed in blocks of block_rows()
+    rows, so memory stays bounded by the block and the K x D sums, plus one
+    label per point.
     """
     centroids = np.copy(initial_centroids)
+    k, n_dim = centroids.shape
+    step = block_rows(k, n_dim)
+    assignments = np.empty(len(points), dtype=np.int64)
     
     for i in range(max_iter):
         print(f"  -> Naive K-Means Iteration {i+1}/{max_iter}")
+        sums = np.zeros((k, n_dim))
+        counts = np.zeros(k, dtype=np.int64)
+
+        for start in range(0, len(points), step):
+            block = np.asarray(points[start:start + step], dtype=np.float64)
+
+            # 1. Assignment Step
+            # For each point, find the index of the closest centroid
+            labels = assign_block(block, centroids)
+            assignments[start:start + len(block)] = labels
+
+            # 2. Accumulate per-cluster sums and counts with a scatter-add
+            counts += np.bincount(labels, minlength=k)
+            for d in range(n_dim):
+                sums[:, d] += np.bincount(labels, weights=block[:, d], minlength=k)
         
-        # 1. Assignment Step
-        # For each point, find the index of the closest centroid
-        distances = np.sqrt(((points - centroids[:, np.newaxis])**2).sum(axis=2))
-        assignments = np.argmin(distances, axis=0)
-        
-        # 2. Update Step
-        new_centroids = np.zeros_like(centroids)
-        # Using a for loop for clarity, but this can be vectorized
-        for cluster_id in range(len(centroids)):
-            # Get all points assigned to this cluster
-            points_in_cluster = points[assignments == cluster_id]
-            # If a cluster has no points, we don't move its centroid
-            if len(points_in_cluster) > 0:
-                new_centroids[cluster_id] = points_in_cluster.mean(axis=0)
-            else:
-                new_centroids[cluster_id] = centroids[cluster_id]
-
-        # 3. Convergence Check
+        # 3. Update Step
+        # If a cluster has no points, we don't move its centroid
+        new_centroids = np.copy(centroids)
+        filled = counts > 0
+        new_centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+
+        # 4. Convergence Check
         if np.allclose(centroids, new_centroids):
             print("  -> Naive K-Means converged.")
             break
@@ -87,25 +118,27 @@ def main():
     """
     Main function to generate data, run naive K-Means, and write all files.
     """
-    if len(sys.argv) != 5:
-        print("Usage: python3 generate_script.py <num_points> <num_dimensions> <K> <max_iterations>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Generate a dataset and its ground-truth K-Means result.")
+    parser.add_argument("num_points", type=int)
+    parser.add_argument("num_dimensions", type=int)
+    parser.add_argument("k", type=int)
+    parser.add_argument("max_iterations", type=int)
+    args = parser.parse_args()
 
-    NUM_POINTS = int(sys.argv[1])
-    NUM_DIMENSIONS = int(sys.argv[2])
-    K = int(sys.argv[3])
-    MAX_ITERATIONS = int(sys.argv[4])
+    NUM_POINTS = args.num_points
+    NUM_DIMENSIONS = args.num_dimensions
+    K = args.k
+    MAX_ITERATIONS = args.max_iterations
 
     # --- 1. Generate Data and Initial Centers ---
     points = generate_clustered_data(NUM_POINTS, NUM_DIMENSIONS, K, CLUSTER_STD_DEV)
     
     # Select K random unique points from the dataset as initial centers
     initial_center_indices = np.random.choice(len(points), size=K, replace=False)
-    initial_centers = points[initial_center_indices]
+    initial_centers = np.asarray(points[initial_center_indices], dtype=np.float64)
     
     # --- 2. Write Input Files for MapReduce ---
-    write_to_csv(POINTS_FILE, points)
-    print(f"-> Successfully created '{POINTS_FILE}'")
+    print(f"-> Successfully created '{POINTS_FILE}' and '{POINTS_STORE_FILE}'")
     write_to_csv(INITIAL_CENTERS_FILE, initial_centers)
     print(f"-> Successfully created '{INITIAL_CENTERS_FILE}'")
 
@@ -120,10 +153,13 @@ def main():
     
     # Write the final assignments in the "key\tvalue" format like MapReduce
     with open(EXPECTED_ASSIGNMENTS_FILE, 'w') as f:
-        for i, point in enumerate(points):
-            cluster_id = final_assignments[i]
-            point_str = ",".join(map(str, point))
-            f.write(f"{cluster_id}\t{point_str}\n")
+        for start in range(0, len(points), GENERATE_BLOCK):
+            block = np.asarray(points[start:start + GENERATE_BLOCK], dtype=np.float64)
+            labels = final_assignments[start:start + len(block)]
+            f.write("".join(
+                f"{cluster_id}\t{','.join(map(str, point))}\n"
+                for cluster_id, point in zip(labels.tolist(), block.tolist())
+            ))
     print(f"-> Successfully created '{EXPECTED_ASSIGNMENTS_FILE}'")
 
 if __name__ == "__main__":
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Scalable k-means|| seeding (Bahmani et al.) for the K-Means MapReduce job.
+
+Instead of drawing the initial centers uniformly from the bounding box, a few
+oversampling rounds are run over the same per-task partitions the mappers
+use, and the resulting few hundred candidates are reduced to K centers by a
+weighted k-means++ on one node. run_kmeans_init.sh drives the rounds:
+
+    pick      <points_file> <output>            draws the first candidate
+    cost      <candidates> --start N ...        per task: updates every point's
+                                                squared distance to its nearest
+                                                candidate with candidates[N:]
+                                                and prints the partial cost
+    sample    <candidates> --cost PHI ...       per task: keeps every point with
+                                                probability min(1, l * d^2 / PHI)
+                                                and prints the sampled points
+    finalize  <candidates> <K> <output> STATE.. weights every candidate by the
+                                                points closest to it and runs a
+                                                weighted k-means++ / Lloyd's
+
+Each task keeps its points' current distance and nearest candidate in a small
+.npz file between steps, so every cost pass only scans the new candidates.
+"""
+import os
+import sys
+import argparse
+
+import numpy as np
+
+import frame_store
+import point_store
+from bounds import pairwise_squared_distances
+from centroid_index import INDEX_MODES, build_centroid_index
+from mapper import read_centroids, read_store_blocks
+from point_store import read_point_blocks
+
+FINAL_LLOYD_ITERATIONS = 20 # Weighted Lloyd's iterations run on the candidates
+
+# --- Per-task state ---
+
+def load_cost_state(file_path):
+    """Returns (cost, nearest) saved by save_cost_state, or empty arrays if there is no state yet."""
+    if not os.path.exists(file_path):
+        return np.empty(0), np.empty(0, dtype=np.int64)
+    with np.load(file_path) as state:
+        return state['cost'], state['nearest']
+
+def save_cost_state(file_path, cost, nearest):
+    """Writes the state atomically so a crashed task never leaves a half-written file."""
+    tmp_path = f"{file_path}.tmp.npz"
+    np.savez(tmp_path, cost=cost, nearest=nearest)
+    os.replace(tmp_path, file_path)
+
+def task_blocks(args, n_dim):
+    """Yields this task's points in blocks, from --points or from the chunk on stdin."""
+    if args.points:
+        return read_store_blocks(args.points, args.task_id, args.num_tasks, args.block_size)
+    return read_point_blocks(sys.stdin, args.block_size, n_dim)
+
+# --- Map steps ---
+
+def update_costs(blocks, new_candidates, first_id, cost, nearest, index_mode='auto'):
+    """
+    Lowers every point's squared distance to its nearest candidate using only
+    the candidates added since the last pass (numbered from first_id). cost
+    and nearest grow when the partition is seen for the first time. Returns
+    (partial cost, cost, nearest).
+    """
+    if len(new_candidates) == 0:
+        # The last round sampled nothing (the total cost was 0): no point can get closer
+        return float(cost.sum()), cost, nearest
+    index = build_centroid_index(new_candidates, index_mode)
+    row = 0
+    for points in blocks:
+        stop = row + len(points)
+        if stop > len(cost):
+            cost = np.concatenate([cost, np.full(stop - len(cost), np.inf)])
+            nearest = np.concatenate([nearest, np.full(stop - len(nearest), -1, dtype=np.int64)])
+        if index is not None:
+            dist, closest = index.query(points, 1)
+            dist = dist ** 2
+        else:
+            distances = pairwise_squared_distances(points, new_candidates)
+            closest = distances.argmin(axis=1)
+            dist = np.maximum(distances[np.arange(len(points)), closest], 0.0)
+        better = dist < cost[row:stop]
+        cost[row:stop][better] = dist[better]
+        nearest[row:stop][better] = closest[better] + first_id
+        row = stop
+    return float(cost.sum()), cost, nearest
+
+def sample_candidates(blocks, cost, total_cost, oversampling, rng):
+    """Yields the points of every block kept with probability min(1, oversampling * d^2 / total_cost)."""
+    row = 0
+    for points in blocks:
+        stop = row + len(points)
+        keep = rng.random(len(points)) * total_cost < oversampling * cost[row:stop]
+        if keep.any():
+            yield points[keep]
+        row = stop
+
+def format_points(points):
+    """Formats a block of points as comma-separated lines."""
+    return "".join(",".join(map(str, point)) + "\n" for point in points.tolist())
+
+# --- Local reduction of the candidates ---
+
+def candidate_weights(state_files, n_candidates):
+    """Counts, over every task's saved state, how many points are closest to each candidate."""
+    weights = np.zeros(n_candidates)
+    for file_path in state_files:
+        _, nearest = load_cost_state(file_path)
+        weights += np.bincount(nearest[nearest >= 0], minlength=n_candidates)
+    return weights
+
+def weighted_kmeans_pp(points, weights, k, rng):
+    """Picks k of the weighted points with k-means++ seeding, sampling by weight * d^2."""
+    centers = [rng.choice(len(points), p=weights / weights.sum())]
+    cost = ((points - points[centers[0]]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        scores = weights * cost
+        if scores.sum() <= 0:
+            # Fewer distinct candidates than K: fall back to any weighted point
+            scores = weights.copy()
+            scores[centers] = 0.0
+        chosen = rng.choice(len(points), p=scores / scores.sum())
+        centers.append(chosen)
+        cost = np.minimum(cost, ((points - points[chosen]) ** 2).sum(axis=1))
+    return points[centers].copy()
+
+def weighted_lloyd(points, weights, centers, max_iter=FINAL_LLOYD_ITERATIONS):
+    """Refines centers with Lloyd's iterations on the weighted candidates; empty clusters keep their center."""
+    k = len(centers)
+    for _ in range(max_iter):
+        labels = pairwise_squared_distances(points, centers).argmin(axis=1)
+        totals = np.bincount(labels, weights=weights, minlength=k)
+        new_centers = centers.copy()
+        filled = totals > 0
+        for d in range(points.shape[1]):
+            sums = np.bincount(labels, weights=weights * points[:, d], minlength=k)
+            new_centers[filled, d] = sums[filled] / totals[filled]
+        if np.array_equal(new_centers, centers):
+            break
+        centers = new_centers
+    return centers
+
+def finalize(candidates, weights, k, rng):
+    """Reduces the weighted candidates to k initial centers."""
+    used = weights > 0
+    points, weights = candidates[used], weights[used]
+    if len(points) < k:
+        raise ValueError(f"Only {len(points)} candidates hold points, cannot pick K={k} centers")
+    return weighted_lloyd(points, weights, weighted_kmeans_pp(points, weights, k, rng))
+
+# --- Command line ---
+
+def add_task_arguments(parser):
+    """Input options shared by the per-task steps; they mirror mapper.py."""
+    parser.add_argument("candidates_file")
+    parser.add_argument("--state", required=True, metavar="STATE.npz",
+                        help="This task's per-point distance and nearest candidate, kept between steps.")
+    parser.add_argument("--block-size", type=int, default=100000)
+    parser.add_argument("--points", metavar="STORE",
+                        help="Read this task's rows from a binary point store or block-compressed CSV instead of stdin.")
+    parser.add_argument("--task-id", type=int, default=0)
+    parser.add_argument("--num-tasks", type=int, default=1)
+
+def main():
+    parser = argparse.ArgumentParser(description="k-means|| seeding steps driven by run_kmeans_init.sh.")
+    steps = parser.add_subparsers(dest="step", required=True)
+
+    pick = steps.add_parser("pick", help="Draw the first candidate.")
+    pick.add_argument("points_file")
+    pick.add_argument("output")
+    pick.add_argument("--seed", type=int, default=0)
+
+    cost = steps.add_parser("cost", help="Update this task's distances with the newest candidates.")
+    add_task_arguments(cost)
+    cost.add_argument("--start", type=int, default=0, help="Index of the first candidate not yet seen by this task.")
+    cost.add_argument("--index", choices=INDEX_MODES, default='auto')
+
+    sample = steps.add_parser("sample", help="Oversample this task's points by their distance.")
+    add_task_arguments(sample)
+    sample.add_argument("--cost", type=float, required=True, help="Total cost over all tasks.")
+    sample.add_argument("--oversampling", type=float, required=True, help="Expected number of points per round (l).")
+    sample.add_argument("--seed", type=int, default=0)
+    sample.add_argument("--round", type=int, default=0)
+
+    final = steps.add_parser("finalize", help="Reduce the weighted candidates to K centers.")
+    final.add_argument("candidates_file")
+    final.add_argument("k", type=int)
+    final.add_argument("output")
+    final.add_argument("state_files", nargs="+")
+    final.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if getattr(args, "block_size", 1) <= 0:
+        parser.error("--block-size must be positive")
+
+    if args.step == "pick":
+        first = frame_store.pick_random_point(args.points_file, np.random.default_rng(args.seed))
+        with open(args.output, 'w') as f:
+            f.write(format_points(first[np.newaxis]))
+        return
+
+    candidates = np.array(read_centroids(args.candidates_file), dtype=np.float64)
+    if args.step == "finalize":
+        weights = candidate_weights(args.state_files, len(candidates))
+        centers = finalize(candidates, weights, args.k, np.random.default_rng(args.seed))
+        tmp_path = f"{args.output}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(format_points(centers))
+        os.replace(tmp_path, args.output)
+        return
+
+    blocks = task_blocks(args, candidates.shape[1])
+    cost_state, nearest = load_cost_state(args.state)
+    if args.step == "cost":
+        partial, cost_state, nearest = update_costs(blocks, candidates[args.start:], args.start,
+                                                    cost_state, nearest, args.index)
+        save_cost_state(args.state, cost_state, nearest)
+        print(repr(partial))
+    else:
+        rng = np.random.default_rng([args.seed, args.round, args.task_id])
+        for points in sample_candidates(blocks, cost_state, args.cost, args.oversampling, rng):
+            sys.stdout.write(format_points(points))
+
+if __name__ == "__main__":
+    main()
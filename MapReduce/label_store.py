@@ -0,0 +1,90 @@
+"""
+Compact per-point assignment files.
+
+The final assignment stores one cluster label per input row, in input order,
+instead of repeating every point's coordinates next to its cluster id:
+
+    *.labels   raw little-endian int32, the label of row i at byte offset 4 * i
+    other      plain text, one label per line (row i on line i + 1)
+
+Neither format has a header, so the per-task files of a run are simply
+concatenated in task order. read_labels also accepts the classic
+'<cluster_id>\t<point>' lines of expected_assignments.csv (and of
+ASSIGNMENT_FORMAT=points runs), keeping only the labels in file order.
+"""
+from itertools import islice
+
+import numpy as np
+
+LABEL_DTYPE = np.dtype('<i4')
+READ_BLOCK_ROWS = 1 << 20 # Rows per block when streaming an assignment file
+ASSIGNMENT_FORMATS = ('labels', 'text', 'points')
+
+def assignment_suffix(assignment_format):
+    """File extension of an assignment format: '.labels' for binary labels, '.txt' otherwise."""
+    return '.labels' if assignment_format == 'labels' else '.txt'
+
+def is_binary(file_path):
+    """True for a binary *.labels file."""
+    return file_path.endswith('.labels')
+
+class LabelWriter:
+    """Appends blocks of labels to a file, binary or one per line depending on its extension."""
+
+    def __init__(self, file_path):
+        self.binary = is_binary(file_path)
+        self.file = open(file_path, 'wb')
+        self.count = 0
+        self.bytes = 0
+
+    def write(self, labels):
+        if self.binary:
+            data = np.asarray(labels, dtype=LABEL_DTYPE).tobytes()
+        elif len(labels):
+            data = ("\n".join(map(str, labels.tolist())) + "\n").encode()
+        else:
+            data = b""
+        self.file.write(data)
+        self.count += len(labels)
+        self.bytes += len(data)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def iter_assignment_blocks(file_path, block_rows=READ_BLOCK_ROWS):
+    """
+    Streams an assignment file of any of the formats above in blocks of
+    block_rows rows (the last one may be shorter). Yields (labels, points)
+    pairs: labels is an int32 array, and points holds the coordinates of
+    '<cluster_id>\t<point>' lines as an (n, D) array, or None for the
+    label-only formats. Only one block is held in memory at a time.
+    """
+    if is_binary(file_path):
+        with open(file_path, 'rb') as f:
+            while True:
+                data = f.read(block_rows * LABEL_DTYPE.itemsize)
+                if not data:
+                    return
+                yield np.frombuffer(data, dtype=LABEL_DTYPE), None
+    with open(file_path, 'r') as f:
+        lines = (line for line in f if line.strip()) # Blank lines, e.g. a trailing one, hold no row
+        while True:
+            fields = [line.rstrip('\n').split('\t', 1) for line in islice(lines, block_rows)]
+            if not fields:
+                return
+            labels = np.fromiter((int(row[0]) for row in fields), dtype=LABEL_DTYPE, count=len(fields))
+            points = None
+            if len(fields[0]) == 2:
+                points = np.fromstring(",".join(row[1] for row in fields), sep=',').reshape(len(fields), -1)
+            yield labels, points
+
+def read_labels(file_path):
+    """Reads a whole assignment file of any of the formats above into an int32 array in row order."""
+    blocks = [labels for labels, _ in iter_assignment_blocks(file_path)]
+    return np.concatenate(blocks) if blocks else np.empty(0, dtype=LABEL_DTYPE)
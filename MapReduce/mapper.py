@@ -1,6 +1,19 @@
 #!/usr/bin/env python3
+import os
 import sys
 import math
+import argparse
+
+import numpy as np
+
+import frame_store
+import point_store
+import timing
+from bounds import HamerlyAssigner
+from centroid_index import INDEX_MODES, build_centroid_index
+from label_store import LabelWriter
+from summation import CompensatedSum
+from sweep import format_sweep_partials, read_sweep_centers
 
 def read_centroids(file_path):
     """Reads centroids from a file into a list of tuples."""
@@ -18,31 +31,353 @@ def euclidean_distance(point1, point2):
         distance += (point1[i] - point2[i]) ** 2
     return math.sqrt(distance)
 
-def main():
-    # The path to the centroids file is passed as a command-line argument
-    centroid_file = sys.argv[1]
-    centroids = read_centroids(centroid_file)
-    
+def read_store_blocks(store_path, task_id, num_tasks, block_size, dtype=np.float64):
+    """
+    Memory-maps this task's row range of a binary point store and yields it in
+    blocks of at most block_size rows. Nothing is parsed; pages are read on
+    demand, and a float32 store read as float32 is not copied at all. A
+    block-compressed CSV (see frame_store.py) is streamed from this task's
+    frames instead.
+    """
+    if frame_store.is_frame_store(store_path):
+        yield from frame_store.read_partition_blocks(store_path, task_id, num_tasks, block_size, dtype)
+        return
+    points = point_store.open_partition(store_path, task_id, num_tasks)
+    for start in range(0, len(points), block_size):
+        yield np.asarray(points[start:start + block_size], dtype=dtype)
+
+def sample_blocks(blocks, fraction, rng):
+    """Keeps each point of every block independently with probability fraction (mini-batch mode)."""
+    for points in blocks:
+        sample = points[rng.random(len(points)) < fraction]
+        if len(sample):
+            yield sample
+
+def centroid_scores(points, centroids):
+    """
+    Scores every row of points against every centroid; the lowest score is
+    the closest centroid.
+
+    Squared distances are expanded as |p|^2 - 2 p.c + |c|^2. The |p|^2 term
+    is the same for every centroid, so it is dropped and the whole block is
+    scored with a single matrix product, without any square roots. The
+    product runs in the points' precision, so float32 points halve its cost.
+    In float32 the expansion cancels badly when the data sits far from the
+    origin, so both sides are first shifted by the centroid mean, which
+    leaves the distances unchanged but keeps the terms small.
+    """
+    if points.dtype != np.float64:
+        reference = centroids.mean(axis=0).astype(points.dtype) # Both sides shift by exactly the same vector
+        points = points - reference
+        centroids = centroids - reference
+    centroids = centroids.astype(points.dtype, copy=False)
+    scores = points @ centroids.T
+    scores *= -2.0
+    scores += (centroids ** 2).sum(axis=1)
+    return scores
+
+def nearest_centroids(points, centroids):
+    """Returns the index of the closest centroid for every row of points."""
+    return centroid_scores(points, centroids).argmin(axis=1)
+
+def assign_blocks(centroids, blocks, assigner=None, index=None, on_labels=None):
+    """
+    Yields (points, labels) for every block. With a HamerlyAssigner, its
+    bounds are used to skip distance computations; rows are numbered from 0
+    across all blocks so they line up with the saved bounds. Otherwise the
+    centroid index is queried if there is one, or every centroid is scanned.
+    on_labels, if given, is called with every block's labels (side output of
+    the final assignment).
+    """
+    row = 0
+    for points in blocks:
+        if assigner is None and index is not None:
+            labels = index.nearest(points)
+        elif assigner is None:
+            labels = nearest_centroids(points, centroids)
+        else:
+            labels = assigner.assign_block(points, row)
+        row += len(points)
+        if on_labels is not None:
+            on_labels(labels)
+        yield points, labels
+
+def format_assignments(points, labels):
+    """Formats a block of points as '<cluster_id>\t<x,y,...>' lines."""
+    return "".join(
+        f"{label}\t{','.join(map(str, point))}\n"
+        for label, point in zip(labels.tolist(), points.tolist())
+    )
+
+def partial_sums(points, labels, k):
+    """Returns the per-cluster coordinate sums (k x D) and point counts (k) of a block."""
+    counts = np.bincount(labels, minlength=k)
+    sums = np.empty((k, points.shape[1]))
+    for d in range(points.shape[1]):
+        sums[:, d] = np.bincount(labels, weights=points[:, d], minlength=k)
+    return sums, counts
+
+def format_partial_sums(sums, counts, keep=None):
+    """
+    Formats clusters as combiner records: '<cluster_id>\t<sum_x,...>\t<count>'.
+    Only non-empty clusters are written unless a boolean keep mask is given.
+    """
+    if keep is None:
+        keep = counts > 0
+    return "".join(
+        f"{cid}\t{','.join(map(str, point_sum))}\t{count}\n"
+        for cid, (point_sum, count, kept) in enumerate(zip(sums.tolist(), counts.tolist(), keep.tolist()))
+        if kept
+    )
+
+def run_scalar(centroids):
+    """Original line-by-line mapper: one distance computation per point/centroid pair."""
     # Read data points from standard input
     for line in sys.stdin:
         # Assuming points are comma-separated, e.g., "x,y,z"
         point_str = line.strip().split(',')
         point = tuple(map(float, point_str))
-        
+
         min_dist = float('inf')
         closest_centroid_id = -1
-        
+
         # Find the closest centroid
         for i, centroid in enumerate(centroids):
             dist = euclidean_distance(point, centroid)
             if dist < min_dist:
                 min_dist = dist
                 closest_centroid_id = i
-        
+
         # Output: key=centroid_id, value=point_coordinates
         # The point coordinates are joined back into a string
         point_output_str = ",".join(map(str, point))
         print(f"{closest_centroid_id}\t{point_output_str}")
 
+def run_batched(centroids, blocks, assigner=None, index=None, on_labels=None):
+    """Vectorized mapper: assigns a whole block of points per matrix operation."""
+    for points, labels in assign_blocks(centroids, blocks, assigner, index, on_labels):
+        sys.stdout.write(format_assignments(points, labels))
+
+def aggregate_blocks(centroids, blocks, assigner=None, index=None, on_labels=None):
+    """
+    Assigns every block and returns the per-cluster sums (k x D) and counts
+    (k). Block sums are added up with compensated summation (see summation.py).
+    """
+    k, n_dim = centroids.shape
+    total_sums = CompensatedSum((k, n_dim))
+    total_counts = np.zeros(k, dtype=np.int64)
+    for points, labels in assign_blocks(centroids, blocks, assigner, index, on_labels):
+        sums, counts = partial_sums(points, labels, k)
+        total_sums.add(sums)
+        total_counts += counts
+    return total_sums.total, total_counts
+
+def aggregate_delta_blocks(centroids, blocks, previous, assigner=None, index=None, on_labels=None):
+    """
+    Delta version of aggregate_blocks. previous holds every row's label from
+    the last iteration (-1 if it was never assigned) and is updated in place,
+    growing if the partition is seen for the first time. Only rows whose label
+    changed contribute: the point is added to its new cluster and subtracted
+    from its old one. Returns the signed sums and counts, a mask of the
+    clusters that changed, and the (possibly grown) previous labels.
+    """
+    k, n_dim = centroids.shape
+    delta_sums = CompensatedSum((k, n_dim))
+    delta_counts = np.zeros(k, dtype=np.int64)
+    touched = np.zeros(k, dtype=bool)
+    row = 0
+    for points, labels in assign_blocks(centroids, blocks, assigner, index, on_labels):
+        stop = row + len(points)
+        if stop > len(previous):
+            previous = np.concatenate([previous, np.full(stop - len(previous), -1, dtype=previous.dtype)])
+        old = previous[row:stop]
+        moved = np.nonzero(old != labels)[0]
+        if len(moved):
+            moved_points = points[moved]
+            new_labels, old_labels = labels[moved], old[moved]
+            sums, counts = partial_sums(moved_points, new_labels, k)
+            delta_sums.add(sums)
+            delta_counts += counts
+            touched[new_labels] = True
+            left = old_labels >= 0
+            sums, counts = partial_sums(moved_points[left], old_labels[left], k)
+            delta_sums.add(-sums)
+            delta_counts -= counts
+            touched[old_labels[left]] = True
+            old[moved] = new_labels
+        row = stop
+    return delta_sums.total, delta_counts, touched, previous
+
+def aggregate_sweep_blocks(centroids, runs, blocks, index_mode='auto'):
+    """
+    Sweep version of aggregate_blocks: assigns every block to each run's
+    centers (the (run_id, start, stop) row ranges of centroids) and returns,
+    per run, the per-cluster sums, counts and sums of squared distances.
+    Runs without a centroid index share one matrix product per block against
+    all their centers, so every block is read once for the whole sweep.
+    """
+    n_dim = centroids.shape[1]
+    indexes = [build_centroid_index(centroids[start:stop], index_mode) for _, start, stop in runs]
+    totals = [(CompensatedSum((stop - start, n_dim)), np.zeros(stop - start, dtype=np.int64),
+               CompensatedSum(stop - start)) for _, start, stop in runs]
+    for points in blocks:
+        scores = None
+        for (_, start, stop), index, (total_sums, total_counts, total_sse) in zip(runs, indexes, totals):
+            if index is not None:
+                labels = index.nearest(points)
+            else:
+                if scores is None:
+                    scores = centroid_scores(points, centroids)
+                labels = scores[:, start:stop].argmin(axis=1)
+            sums, counts = partial_sums(points, labels, stop - start)
+            distances = ((points - centroids[start:stop][labels]) ** 2).sum(axis=1)
+            total_sums.add(sums)
+            total_counts += counts
+            total_sse.add(np.bincount(labels, weights=distances, minlength=stop - start))
+    return [(total_sums.total, total_counts, total_sse.total) for total_sums, total_counts, total_sse in totals]
+
+def run_sweep(centroids, runs, blocks, index_mode='auto'):
+    """
+    In-mapper aggregation for a multi-run sweep (see sweep.py): writes one
+    '<run_id>\t<cluster_id>\t<sums>\t<count>\t<sse>' record per non-empty
+    cluster of every run.
+    """
+    for (run_id, _, _), (sums, counts, sse) in zip(runs, aggregate_sweep_blocks(centroids, runs, blocks, index_mode)):
+        sys.stdout.write(format_sweep_partials(run_id, sums, counts, sse))
+
+def read_label_state(file_path):
+    """Reads the labels saved by write_label_state, or an empty array if there are none yet."""
+    if not os.path.exists(file_path):
+        return np.empty(0, dtype=np.int32)
+    return np.load(file_path)
+
+def write_label_state(file_path, labels):
+    """Saves a partition's labels atomically as a .npy file."""
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, labels)
+    os.replace(tmp_path, file_path)
+
+def run_aggregated(centroids, blocks, assigner=None, index=None, on_labels=None):
+    """
+    Vectorized mapper with in-mapper combining: keeps running per-cluster sums
+    and counts for the whole chunk and writes them once at the end, in the same
+    format combiner.py produces. No per-point records are emitted.
+    """
+    total_sums, total_counts = aggregate_blocks(centroids, blocks, assigner, index, on_labels)
+    sys.stdout.write(format_partial_sums(total_sums, total_counts))
+
+def run_delta(centroids, blocks, label_file, assigner=None, index=None, on_labels=None):
+    """
+    In-mapper aggregation of only the points whose cluster changed since the
+    previous iteration, as signed combiner records for 'reducer.py --delta'.
+    The chunk's labels are kept in label_file between iterations.
+    """
+    previous = read_label_state(label_file)
+    sums, counts, touched, previous = aggregate_delta_blocks(centroids, blocks, previous, assigner, index, on_labels)
+    sys.stdout.write(format_partial_sums(sums, counts, touched))
+    write_label_state(label_file, previous)
+
+def main():
+    parser = argparse.ArgumentParser(description="K-Means mapper: assigns each point on stdin to its closest centroid.")
+    # The path to the centroids file is passed as a command-line argument
+    parser.add_argument("centroid_file")
+    parser.add_argument("--block-size", type=int, default=0,
+                        help="Process points in vectorized blocks of this many lines (0 = line-by-line).")
+    parser.add_argument("--aggregate", action="store_true",
+                        help="Emit per-cluster partial sums and counts (combiner format) instead of per-point records.")
+    parser.add_argument("--points", metavar="STORE",
+                        help="Read this task's rows from a binary point store (see point_store.py) or a "
+                             "block-compressed CSV (see frame_store.py) instead of stdin.")
+    parser.add_argument("--task-id", type=int, default=0,
+                        help="Index of this mapper task (selects its rows with --points, and its sample stream).")
+    parser.add_argument("--num-tasks", type=int, default=1,
+                        help="Total number of mapper tasks when reading from --points.")
+    parser.add_argument("--bounds", metavar="STATE",
+                        help="Keep Hamerly distance bounds for this task's points in this .npz file between iterations.")
+    parser.add_argument("--index", choices=INDEX_MODES, default='auto',
+                        help="Nearest-centroid search: a KD-tree over the centroids, brute force, or auto (KD-tree for large K and low D).")
+    parser.add_argument("--delta", metavar="LABELS",
+                        help="With --aggregate, emit only the changes caused by points that switched cluster, "
+                             "keeping this chunk's previous labels in this .npy file.")
+    parser.add_argument("--sample-fraction", type=float, default=1.0,
+                        help="Mini-batch mode: only assign a random sample of this fraction of the points.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for --sample-fraction; combined with --task-id so every task draws its own stream.")
+    parser.add_argument("--dtype", choices=point_store.DTYPES, default='float64',
+                        help="Precision the points are held and compared in; sums are always accumulated in float64.")
+    parser.add_argument("--labels", metavar="FILE",
+                        help="Also write every point's cluster label, in row order, to FILE "
+                             "(binary int32 for *.labels, one per line otherwise; see label_store.py).")
+    parser.add_argument("--sweep", action="store_true",
+                        help="centroid_file is a sweep file of several runs (see sweep.py); with --aggregate, "
+                             "emit per-run partial sums and SSE keyed by (run_id, cluster_id).")
+    parser.add_argument("--phase", default="map",
+                        help="Phase name recorded in the timing trace (see timing.py).")
+    args = parser.parse_args()
+    if not 0.0 < args.sample_fraction <= 1.0:
+        parser.error("--sample-fraction must be in (0, 1]")
+    if args.sample_fraction < 1.0 and (args.block_size <= 0 or args.bounds or args.delta):
+        parser.error("--sample-fraction needs a positive --block-size and cannot be combined with --bounds or --delta")
+    if args.delta and not args.aggregate:
+        parser.error("--delta requires --aggregate")
+    if args.aggregate and args.block_size <= 0:
+        parser.error("--aggregate requires a positive --block-size")
+    if args.points and args.block_size <= 0:
+        parser.error("--points requires a positive --block-size")
+    if args.bounds and args.block_size <= 0:
+        parser.error("--bounds requires a positive --block-size")
+    if args.labels and (args.block_size <= 0 or args.sample_fraction < 1.0):
+        parser.error("--labels requires a positive --block-size and cannot be combined with --sample-fraction")
+    if args.sweep and (not args.aggregate or args.bounds or args.delta or args.labels or args.sample_fraction < 1.0):
+        parser.error("--sweep requires --aggregate and cannot be combined with --bounds, --delta, --labels or --sample-fraction")
+
+    with timing.Phase(args.phase, task=args.task_id, stdio=True) as phase:
+        run_mapper(args, phase)
+
+def run_mapper(args, phase):
+    """Runs the mapper mode selected by the parsed command line."""
+    if args.sweep:
+        centroids, runs = read_sweep_centers(args.centroid_file)
+    else:
+        centroids = read_centroids(args.centroid_file)
+        if args.block_size <= 0:
+            run_scalar(centroids)
+            return
+        centroids = np.array(centroids, dtype=np.float64)
+    if args.points:
+        blocks = phase.count_blocks(read_store_blocks(args.points, args.task_id, args.num_tasks,
+                                                      args.block_size, args.dtype))
+    else:
+        blocks = point_store.read_point_blocks(sys.stdin, args.block_size, centroids.shape[1], args.dtype)
+
+    if args.sample_fraction < 1.0:
+        blocks = sample_blocks(blocks, args.sample_fraction, np.random.default_rng([args.seed, args.task_id]))
+
+    if args.sweep:
+        run_sweep(centroids, runs, blocks, args.index)
+        return
+
+    # Built once per iteration, then queried once per block
+    index = build_centroid_index(centroids, args.index)
+    assigner = None
+    if args.bounds:
+        assigner = HamerlyAssigner.load(args.bounds)
+        assigner.set_centroids(centroids, index)
+
+    labels_out = LabelWriter(args.labels) if args.labels else None
+    on_labels = labels_out.write if labels_out is not None else None
+    if args.delta:
+        run_delta(centroids, blocks, args.delta, assigner, index, on_labels)
+    elif args.aggregate:
+        run_aggregated(centroids, blocks, assigner, index, on_labels)
+    else:
+        run_batched(centroids, blocks, assigner, index, on_labels)
+    if labels_out is not None:
+        labels_out.close()
+
+    if assigner is not None:
+        assigner.save(args.bounds)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
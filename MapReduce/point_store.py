@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Binary point store for K-Means input data.
+
+Layout (little-endian):
+    bytes  0-7   magic b"KMPOINTS"
+    bytes  8-15  N, the number of points (uint64)
+    bytes 16-23  D, the number of dimensions (uint64)
+    bytes 24-31  itemsize of each coordinate in bytes (uint64, 8 = float64)
+    bytes 32-    N x D coordinates, row-major
+
+Because every row has a fixed width, a mapper can memory-map exactly its own
+row range by byte offset, with no parsing and no temporary chunk files.
+
+A directory of point stores named points_00.bin, points_01.bin, ... (as
+written by generate_large_script.py --shards) is read as one logical store,
+with rows numbered shard after shard. When it has one shard per mapper task,
+every task maps exactly its own shard.
+
+Coordinates are float64 by default; a float32 store (itemsize 4) halves the
+file size and the bytes every mapper reads per iteration.
+
+Usage (one-time conversion):
+    python3 point_store.py <points.csv> <points.bin> [float64|float32]
+"""
+import os
+import sys
+import glob
+import struct
+from itertools import islice
+
+import numpy as np
+
+MAGIC = b"KMPOINTS"
+HEADER_FORMAT = "<8sQQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+CONVERT_BLOCK_SIZE = 100000
+SHARD_NAME = "points_{:02d}.bin"
+DTYPES = ('float64', 'float32') # Supported coordinate types
+
+def shard_paths(directory):
+    """Lists the shards of a sharded point store directory in row order."""
+    return sorted(glob.glob(os.path.join(directory, "points_*.bin")))
+
+def is_point_store(path):
+    """True for a *.bin point store or a directory of point store shards."""
+    return path.endswith('.bin') or (os.path.isdir(path) and bool(shard_paths(path)))
+
+def read_header(file_path):
+    """Returns (num_points, num_dimensions, dtype) from a point store header, or summed over a shard directory."""
+    if os.path.isdir(file_path):
+        headers = [read_header(path) for path in shard_paths(file_path)]
+        if not headers:
+            raise ValueError(f"'{file_path}' holds no point store shards")
+        _, n_dim, dtype = headers[0]
+        if any(header[1:] != (n_dim, dtype) for header in headers):
+            raise ValueError(f"The shards in '{file_path}' do not share one shape and dtype")
+        return sum(header[0] for header in headers), n_dim, dtype
+    with open(file_path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) != HEADER_SIZE:
+        raise ValueError(f"'{file_path}' is too short to be a point store")
+    magic, n_points, n_dim, itemsize = struct.unpack(HEADER_FORMAT, header)
+    if magic != MAGIC:
+        raise ValueError(f"'{file_path}' is not a point store (bad magic {magic!r})")
+    return n_points, n_dim, np.dtype(f"<f{itemsize}")
+
+def task_row_range(n_points, task_id, num_tasks):
+    """Returns the [start, stop) rows owned by task_id when N rows are split evenly across num_tasks."""
+    return n_points * task_id // num_tasks, n_points * (task_id + 1) // num_tasks
+
+def open_points(file_path, start=0, stop=None, mode='r'):
+    """
+    Memory-maps rows [start, stop) of a point store as a (rows, D) array,
+    read-only unless mode='r+'. For a shard directory, a range inside one
+    shard is mapped directly and a range spanning shards is copied.
+    """
+    if os.path.isdir(file_path):
+        return _open_shard_rows(file_path, start, stop)
+    n_points, n_dim, dtype = read_header(file_path)
+    stop = n_points if stop is None else min(stop, n_points)
+    start = min(start, stop)
+    if start == stop:
+        return np.empty((0, n_dim), dtype=dtype)
+    offset = HEADER_SIZE + start * n_dim * dtype.itemsize
+    return np.memmap(file_path, dtype=dtype, mode=mode, offset=offset, shape=(stop - start, n_dim))
+
+def _open_shard_rows(directory, start, stop):
+    """Gathers global rows [start, stop) from the shards of a directory."""
+    _, n_dim, dtype = read_header(directory)
+    pieces = []
+    shard_start = 0
+    for path in shard_paths(directory):
+        shard_rows = read_header(path)[0]
+        shard_stop = shard_start + shard_rows
+        if stop is not None and shard_start >= stop:
+            break
+        if shard_stop > start:
+            local_stop = shard_rows if stop is None else min(stop, shard_stop) - shard_start
+            pieces.append(open_points(path, max(start - shard_start, 0), local_stop))
+        shard_start = shard_stop
+    if not pieces:
+        return np.empty((0, n_dim), dtype=dtype)
+    return pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+
+def allocate(file_path, n_points, n_dim, dtype=np.float64):
+    """Creates a point store of n_points rows whose coordinates are filled in later via open_points(mode='r+')."""
+    dtype = np.dtype(dtype).newbyteorder('<')
+    with open(file_path, 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, n_points, n_dim, dtype.itemsize))
+        f.truncate(HEADER_SIZE + n_points * n_dim * dtype.itemsize)
+
+def open_partition(file_path, task_id, num_tasks):
+    """Memory-maps the row range owned by one of num_tasks mapper tasks."""
+    n_points, _, _ = read_header(file_path)
+    start, stop = task_row_range(n_points, task_id, num_tasks)
+    return open_points(file_path, start, stop)
+
+class PointStoreWriter:
+    """
+    Streams blocks of points into a new point store. N is not known up front,
+    so the header is rewritten with the final row count on close().
+    """
+
+    def __init__(self, file_path, n_dim, dtype=np.float64):
+        self.file_path = file_path
+        self.n_dim = n_dim
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.n_points = 0
+        self.f = open(file_path, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        self.f.seek(0)
+        self.f.write(struct.pack(HEADER_FORMAT, MAGIC, self.n_points, self.n_dim, self.dtype.itemsize))
+
+    def append(self, points):
+        """Appends a (rows, D) block of points."""
+        points = np.asarray(points, dtype=self.dtype)
+        if points.ndim != 2 or points.shape[1] != self.n_dim:
+            raise ValueError(f"Expected a block of shape (rows, {self.n_dim}), got {points.shape}")
+        self.f.write(np.ascontiguousarray(points).tobytes())
+        self.n_points += len(points)
+
+    def close(self):
+        self._write_header()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def read_point_blocks(stream, block_size, n_dim, dtype=np.float64):
+    """
+    Reads comma-separated points from a text stream in blocks of at most
+    block_size lines and yields each block as an (n, n_dim) NumPy array of
+    dtype. Only one block is held in memory at a time.
+    """
+    while True:
+        lines = [line.strip() for line in islice(stream, block_size)]
+        lines = [line for line in lines if line]
+        if not lines:
+            return
+        block = np.fromstring(",".join(lines), sep=',')
+        if block.size != len(lines) * n_dim:
+            raise ValueError(f"Expected {n_dim} coordinates per point in block of {len(lines)} lines")
+        yield block.reshape(len(lines), n_dim).astype(dtype, copy=False)
+
+def convert_csv(csv_path, store_path, block_size=CONVERT_BLOCK_SIZE, dtype=np.float64):
+    """Converts a points CSV file into a point store of dtype, streaming it in blocks. Returns N."""
+    with open(csv_path, 'r') as f:
+        first_line = f.readline().strip()
+        if not first_line:
+            raise ValueError(f"'{csv_path}' is empty")
+        n_dim = len(first_line.split(','))
+        f.seek(0)
+        with PointStoreWriter(store_path, n_dim, dtype) as writer:
+            for block in read_point_blocks(f, block_size, n_dim):
+                writer.append(block)
+    return writer.n_points
+
+def main():
+    if len(sys.argv) not in (3, 4) or (len(sys.argv) == 4 and sys.argv[3] not in DTYPES):
+        print("Usage: python3 point_store.py <points.csv> <points.bin> [float64|float32]")
+        sys.exit(1)
+
+    csv_path, store_path = sys.argv[1:3]
+    dtype = sys.argv[3] if len(sys.argv) == 4 else 'float64'
+    n_points = convert_csv(csv_path, store_path, dtype=dtype)
+    print(f"-> Converted {n_points} points from '{csv_path}' to '{store_path}'")
+
+if __name__ == "__main__":
+    main()
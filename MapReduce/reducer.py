@@ -1,65 +1,334 @@
 #!/usr/bin/env python3
+import os
 import sys
+import argparse
+from itertools import chain
 
-def read_old_centroids(file_path):
-    """Reads the previous iteration's centroids into a dictionary."""
+import numpy as np
+
+import point_store
+import timing
+from summation import grouped_sum
+from sweep import format_run_report, format_sweep_centers, parse_sweep_partials, read_sweep_centers
+
+def read_old_centroids(file_path, start=0, stop=None):
+    """
+    Reads the previous iteration's centroids into a dictionary. With a
+    [start, stop) cluster range only that slice is parsed and kept.
+    """
     centroids = {}
     with open(file_path, 'r') as f:
         for i, line in enumerate(f):
+            if i < start:
+                continue
+            if stop is not None and i >= stop:
+                break
             parts = line.strip().split(',')
             centroids[i] = tuple(map(float, parts))
     return centroids
 
+def count_centroids(file_path):
+    """Returns K, the number of centroid lines in file_path."""
+    with open(file_path, 'r') as f:
+        return sum(1 for line in f if line.strip())
+
+def cluster_partition(cluster_id, k, num_reducers):
+    """
+    Returns the reducer that owns cluster_id when K clusters are split into
+    num_reducers contiguous ranges, the inverse of
+    point_store.task_row_range(k, reducer_id, num_reducers).
+    """
+    return ((cluster_id + 1) * num_reducers - 1) // k
+
+def partition_records(lines, k, num_reducers):
+    """Splits partial records by the reducer that owns their cluster_id; returns one list of lines per reducer."""
+    partitions = [[] for _ in range(num_reducers)]
+    for line in lines:
+        if line.strip():
+            partitions[cluster_partition(int(line.split('\t', 1)[0]), k, num_reducers)].append(line)
+    return partitions
+
+def parse_partials(lines):
+    """
+    Parses '<cluster_id>\t<partial_sum>\t<partial_count>' records into
+    (cluster_ids, sums, counts) arrays. The coordinates of all records are
+    converted in one call instead of one float() per value.
+    """
+    records = [line.split('\t') for line in lines if line.strip()]
+    if not records:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0)), np.empty(0, dtype=np.int64)
+    cluster_ids = np.array([int(record[0]) for record in records], dtype=np.int64)
+    counts = np.array([int(record[2]) for record in records], dtype=np.int64)
+    sums = np.fromstring(",".join(record[1] for record in records), sep=',').reshape(len(records), -1)
+    return cluster_ids, sums, counts
+
+def sum_partials(lines):
+    """
+    Sums the '<cluster_id>\t<partial_sum>\t<partial_count>' records in lines
+    and returns the total sums and counts per cluster_id. The records can come
+    in any order, so no sort is needed before the reducer; the sums of each
+    cluster are accumulated in input order with compensated summation.
+    """
+    cluster_ids, sums, counts = parse_partials(lines)
+    ids, slots = np.unique(cluster_ids, return_inverse=True)
+    slot_sums = grouped_sum(slots, sums, len(ids))
+    slot_counts = np.zeros(len(ids), dtype=np.int64)
+    np.add.at(slot_counts, slots, counts)
+
+    # Dictionaries to store the total sums and counts from all combiners
+    total_sums = dict(zip(ids.tolist(), slot_sums.tolist()))
+    total_counts = dict(zip(ids.tolist(), slot_counts.tolist()))
+    return total_sums, total_counts
+
+def read_partial_files(file_paths, phase=None):
+    """Yields the records of every file in turn, counting them as phase input."""
+    for file_path in file_paths:
+        with open(file_path, 'r') as f:
+            for line in f:
+                if phase is not None:
+                    phase.records_in += 1
+                    phase.bytes_in += len(line)
+                yield line
+
+def format_partials(total_sums, total_counts):
+    """
+    Formats totals in the combiner's record format so they can be merged
+    again. Every cluster is kept, including signed delta records whose counts
+    cancel out.
+    """
+    return "".join(
+        f"{cid}\t{','.join(map(str, total_sums[cid]))}\t{total_counts[cid]}\n"
+        for cid in sorted(total_sums)
+    )
+
+def update_centroids(total_sums, total_counts, final_centroids):
+    """Replaces final_centroids[cid] with the mean of every cluster that holds points."""
+    for cid, t_sum in total_sums.items():
+        count = total_counts[cid]
+        if count > 0:
+            new_centroid = [s / count for s in t_sum]
+            final_centroids[cid] = tuple(new_centroid)
+    return final_centroids
+
+def reduce_partials(lines, final_centroids):
+    """
+    Sums the partial records in lines and updates final_centroids (pre-loaded
+    with the old centroids) in place with the new mean of every cluster that
+    received points.
+    """
+    total_sums, total_counts = sum_partials(lines)
+    return update_centroids(total_sums, total_counts, final_centroids)
+
+def read_delta_state(file_path):
+    """Reads the running totals kept by delta mode; a missing file means no points yet."""
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path, 'r') as f:
+        return f.readlines()
+
+def format_delta_state(total_sums, total_counts):
+    """
+    Formats the running totals in the combiner's record format. Clusters that
+    are left with no points are dropped so rounding residue cannot build up.
+    """
+    kept = [cid for cid in total_sums if total_counts[cid] > 0]
+    return format_partials({cid: total_sums[cid] for cid in kept}, {cid: total_counts[cid] for cid in kept})
+
+def write_delta_state(file_path, total_sums, total_counts):
+    """Replaces the delta-mode state file atomically."""
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(format_delta_state(total_sums, total_counts))
+    os.replace(tmp_path, file_path)
+
+def reduce_deltas(lines, final_centroids, state_file):
+    """
+    Delta mode: lines hold signed per-cluster changes (points that joined minus
+    points that left each cluster since the previous iteration). They are added
+    to the running totals in state_file instead of rebuilding every sum.
+    """
+    total_sums, total_counts = sum_partials(chain(read_delta_state(state_file), lines))
+    write_delta_state(state_file, total_sums, total_counts)
+    return update_centroids(total_sums, total_counts, final_centroids)
+
+def read_minibatch_counts(file_path):
+    """Reads how many sampled points each cluster has absorbed so far ('<cluster_id>\t<count>' lines)."""
+    counts = {}
+    if os.path.exists(file_path):
+        with open(file_path, 'r') as f:
+            for line in f:
+                cluster_id_str, count_str = line.strip().split('\t')
+                counts[int(cluster_id_str)] = int(count_str)
+    return counts
+
+def update_minibatch_centroids(total_sums, total_counts, seen, final_centroids):
+    """
+    Moves each centroid towards the mean of its batch points with a per-center
+    learning rate of 1 / (points it has absorbed so far), i.e.
+        c <- c + (batch_sum - batch_count * c) / seen[c]
+    which keeps every centroid the running mean of all points ever assigned
+    to it. seen (cluster_id -> count) is updated in place.
+    """
+    for cid, t_sum in total_sums.items():
+        batch_count = total_counts[cid]
+        if batch_count <= 0:
+            continue
+        seen[cid] = seen.get(cid, 0) + batch_count
+        final_centroids[cid] = tuple(
+            c + (s - batch_count * c) / seen[cid] for c, s in zip(final_centroids[cid], t_sum)
+        )
+    return final_centroids
+
+def reduce_minibatch(lines, final_centroids, state_file):
+    """
+    Mini-batch mode: lines hold the sums and counts of this iteration's sample.
+    The per-center counts are kept in state_file between iterations.
+    """
+    total_sums, total_counts = sum_partials(lines)
+    seen = read_minibatch_counts(state_file)
+    update_minibatch_centroids(total_sums, total_counts, seen, final_centroids)
+
+    tmp_path = f"{state_file}.tmp"
+    with open(tmp_path, 'w') as f:
+        for cid in sorted(seen):
+            f.write(f"{cid}\t{seen[cid]}\n")
+    os.replace(tmp_path, state_file)
+    return final_centroids
+
+def sum_sweep_partials(lines):
+    """
+    Sums sweep records ('<run_id>\t<cluster_id>\t<sums>\t<count>\t<sse>',
+    see sweep.py) per (run_id, cluster_id) in input order. Returns the keys as
+    an (n, 2) array and the matching sums, counts and SSE.
+    """
+    run_ids, cluster_ids, sums, counts, sse = parse_sweep_partials(lines)
+    keys, slots = np.unique(np.column_stack([run_ids, cluster_ids]), axis=0, return_inverse=True)
+    slots = slots.reshape(-1)
+    # The SSE is summed as one more column of the coordinate sums
+    totals = grouped_sum(slots, np.column_stack([sums, sse]), len(keys))
+    slot_counts = np.zeros(len(keys), dtype=np.int64)
+    np.add.at(slot_counts, slots, counts)
+    return keys, totals[:, :-1], slot_counts, totals[:, -1]
+
+def format_sweep_totals(keys, sums, counts, sse):
+    """Formats summed sweep records in the input format so they can be merged again."""
+    return "".join(
+        f"{run_id}\t{cid}\t{','.join(map(str, point_sum))}\t{count}\t{cluster_sse}\n"
+        for (run_id, cid), point_sum, count, cluster_sse in zip(keys.tolist(), sums.tolist(), counts.tolist(), sse.tolist())
+    )
+
+def reduce_sweep(lines, old_centers_file, report_file=None):
+    """
+    Sweep mode: every run of the sweep file old_centers_file is reduced on
+    its own. Returns the next sweep file's lines; clusters that received no
+    points keep their old center. With report_file, every run's point count
+    and total SSE are written there.
+    """
+    centers, runs = read_sweep_centers(old_centers_file)
+    first_row = {run_id: start for run_id, start, _ in runs}
+    keys, sums, counts, sse = sum_sweep_partials(lines)
+    rows = np.array([first_row[run_id] for run_id in keys[:, 0].tolist()], dtype=np.int64) + keys[:, 1]
+    filled = counts > 0
+    if filled.any():
+        centers[rows[filled]] = sums[filled] / counts[filled, None]
+    if report_file is not None:
+        row_points = np.bincount(rows, weights=counts, minlength=len(centers))
+        row_sse = np.bincount(rows, weights=sse, minlength=len(centers))
+        points = [int(row_points[start:stop].sum()) for _, start, stop in runs]
+        run_sse = [float(row_sse[start:stop].sum()) for _, start, stop in runs]
+        with open(report_file, 'w') as f:
+            f.write(format_run_report(runs, points, run_sse))
+    return format_sweep_centers(centers, runs)
+
+def format_centroids(final_centroids):
+    """Formats every centroid (all K, or one reducer's slice) as comma-separated lines, in cluster_id order."""
+    return "".join(",".join(map(str, final_centroids[i])) + "\n" for i in sorted(final_centroids))
+
 def main():
     """
     Reads pre-aggregated data from multiple combiners. For each cluster_id,
     it sums the partial sums and partial counts to get a total sum and count.
     From this, it calculates the new centroid.
-    
+
     It handles empty clusters by pre-loading the old centroids and outputting
     their old position if no new data is received for them.
-    
-    Input: (from stdin, sorted by key)
+
+    Input: (from stdin or the --inputs files, in any order)
         <cluster_id>\t<partial_sum_x,...\t<partial_count>
         ...
-        
+
     Output: (to stdout)
         <x,y,z,...>  (the new centroid)
+
+    With --delta <state_file>, the input records are signed changes since
+    the previous iteration and are added to the totals kept in state_file.
+    With --minibatch <state_file>, the input records come from a sample and
+    centroids take a learning-rate step towards it (see reduce_minibatch).
+    With --merge, the records are only summed and printed in the input format,
+    which makes one node of a reduce tree (see REDUCE_FANIN in run_mapreduce.sh).
+    With --sweep, old_centroids_file is a sweep file of several runs and the
+    records are keyed by (run_id, cluster_id) (see sweep.py).
+    With --reducer-id R --num-reducers N, only the R-th of N contiguous
+    cluster_id ranges is loaded and printed; the input must only hold records
+    of that range, and the driver concatenates the slices in reducer order.
     """
-    old_centroids_file = sys.argv[1]
-    
-    # Pre-load old centroids to handle empty clusters
-    final_centroids = read_old_centroids(old_centroids_file)
+    parser = argparse.ArgumentParser(description="K-Means reducer: computes the new centroids from partial sums on stdin.")
+    parser.add_argument("old_centroids_file", nargs="?")
+    parser.add_argument("--inputs", nargs="+", metavar="PARTIALS",
+                        help="Read the partial records from these files instead of stdin.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--delta", metavar="STATE", help="Input holds signed changes; running totals are kept in STATE.")
+    mode.add_argument("--minibatch", metavar="STATE", help="Input is a sample; per-center counts are kept in STATE.")
+    mode.add_argument("--merge", action="store_true",
+                      help="Only sum the partial records per cluster and print them in the same format.")
+    parser.add_argument("--sweep", action="store_true",
+                        help="Records and centers belong to the runs of a sweep file (see sweep.py).")
+    parser.add_argument("--report", metavar="FILE",
+                        help="With --sweep, write every run's point count and SSE to FILE.")
+    parser.add_argument("--reducer-id", type=int, default=0,
+                        help="Index of this reducer; it owns one contiguous range of cluster_ids.")
+    parser.add_argument("--num-reducers", type=int, default=1,
+                        help="Number of range-partitioned reducers the clusters are split across.")
+    parser.add_argument("--task-id", type=int,
+                        help="Task id in the timing trace (default: --reducer-id); the driver numbers the merge nodes.")
+    args = parser.parse_args()
+    if args.old_centroids_file is None and not args.merge:
+        parser.error("old_centroids_file is required unless --merge is given")
+    if not 0 <= args.reducer_id < args.num_reducers:
+        parser.error("--reducer-id must be in [0, --num-reducers)")
+    if args.sweep and (args.delta or args.minibatch or args.num_reducers > 1):
+        parser.error("--sweep cannot be combined with --delta, --minibatch or --num-reducers > 1")
 
-    # Dictionaries to store the total sums and counts from all combiners
-    total_sums = {}
-    total_counts = {}
-
-    # Read the pre-aggregated data from stdin
-    for line in sys.stdin:
-        cluster_id_str, partial_sum_str, partial_count_str = line.strip().split('\t')
-        cluster_id = int(cluster_id_str)
-        partial_sum = list(map(float, partial_sum_str.split(',')))
-        partial_count = int(partial_count_str)
-        
-        if cluster_id not in total_sums:
-            total_sums[cluster_id] = [0.0] * len(partial_sum)
-            total_counts[cluster_id] = 0
-            
-        for i in range(len(partial_sum)):
-            total_sums[cluster_id][i] += partial_sum[i]
-        total_counts[cluster_id] += partial_count
-
-    # Calculate the new centroids from the total sums and counts
-    for cid, t_sum in total_sums.items():
-        count = total_counts[cid]
-        new_centroid = [s / count for s in t_sum]
-        final_centroids[cid] = tuple(new_centroid)
+    task_id = args.reducer_id if args.task_id is None else args.task_id
+    with timing.Phase('merge' if args.merge else 'reduce', task=task_id, stdio=True, reducer=args.reducer_id) as phase:
+        lines = read_partial_files(args.inputs, phase) if args.inputs else sys.stdin
+        if args.merge and args.sweep:
+            sys.stdout.write(format_sweep_totals(*sum_sweep_partials(lines)))
+            return
+        if args.merge:
+            sys.stdout.write(format_partials(*sum_partials(lines)))
+            return
+        if args.sweep:
+            sys.stdout.write(reduce_sweep(lines, args.old_centroids_file, args.report))
+            return
+
+        # Pre-load this reducer's slice of the old centroids to handle empty clusters
+        start, stop = 0, None
+        if args.num_reducers > 1:
+            k = count_centroids(args.old_centroids_file)
+            start, stop = point_store.task_row_range(k, args.reducer_id, args.num_reducers)
+        final_centroids = read_old_centroids(args.old_centroids_file, start, stop)
+
+        # Read the pre-aggregated data
+        if args.delta:
+            reduce_deltas(lines, final_centroids, args.delta)
+        elif args.minibatch:
+            reduce_minibatch(lines, final_centroids, args.minibatch)
+        else:
+            reduce_partials(lines, final_centroids)
 
-    # Print all K final centroids, preserving old ones if a cluster was empty
-    for i in range(len(final_centroids)):
-        centroid_output = ",".join(map(str, final_centroids[i]))
-        print(centroid_output)
+        # Print the slice's final centroids, preserving old ones if a cluster was empty
+        sys.stdout.write(format_centroids(final_centroids))
 
 
 if __name__ == "__main__":
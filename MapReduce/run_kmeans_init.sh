@@ -0,0 +1,112 @@
+#!/bin/bash
+
+# --- Argument Parsing ---
+if [ "$#" -lt 3 ] || [ "$#" -gt 4 ]; then
+    echo "Usage: ./run_kmeans_init.sh K points.csv|points.bin|points.csv.gz|shard_dir initial_centers.csv [rounds]"
+    exit 1
+fi
+
+K=$1
+POINTS_FILE=$2
+OUTPUT_FILE=$3
+ROUNDS=${4:-5}
+
+# --- SLURM Environment Variable for Number of Tasks ---
+NUM_MAPPERS=${SLURM_NTASKS:-8}
+
+# --- Seeding Configuration ---
+# Expected number of candidates drawn per round (l). Bahmani et al. suggest
+# between 0.5K and 2K; with 5 rounds this leaves roughly 10K candidates.
+OVERSAMPLING=${INIT_OVERSAMPLING:-$((2 * K))}
+SEED=${INIT_SEED:-0}
+BLOCK_SIZE=${MAPPER_BLOCK_SIZE:-100000}
+INDEX=${MAPPER_INDEX:-auto}
+if [ "$BLOCK_SIZE" -le 0 ]; then
+    echo "Error: k-means|| seeding requires MAPPER_BLOCK_SIZE > 0."
+    exit 1
+fi
+
+# --- Setup ---
+# Same partitioning as run_mapreduce.sh: mappers read their row range of a
+# binary point store, or one chunk_XXXX.txt each.
+WORK_DIR="${OUTPUT_FILE}_work"
+# Nothing is reused from an earlier, failed seeding run
+rm -rf "$WORK_DIR"
+mkdir -p "$WORK_DIR"
+POINT_STORE_FILE=""
+if [[ "$POINTS_FILE" == *.bin || "$POINTS_FILE" == *.gz || "$POINTS_FILE" == *.zst ]] || [ -e "$POINTS_FILE/points_00.bin" ]; then
+    # Point stores are memory-mapped and block-compressed CSV (see frame_store.py) is streamed per task
+    POINT_STORE_FILE=$POINTS_FILE
+elif [ -d "$POINTS_FILE" ] && [ "$(find "$POINTS_FILE" -maxdepth 1 -name 'chunk_*.txt' | wc -l)" -eq "$NUM_MAPPERS" ]; then
+    # Pre-sharded CSV input with one chunk per task, linked under four-digit task numbers
+    TASK_NUM=0
+    for CHUNK in "$POINTS_FILE"/chunk_*.txt; do
+        ln -s "$(cd "$(dirname "$CHUNK")" && pwd)/$(basename "$CHUNK")" "$WORK_DIR/chunk_$(printf "%04d" $TASK_NUM).txt"
+        TASK_NUM=$((TASK_NUM + 1))
+    done
+elif [ -d "$POINTS_FILE" ]; then
+    cat "$POINTS_FILE"/chunk_*.txt > "$WORK_DIR/points.csv"
+    split -n l/$NUM_MAPPERS -d -a 4 --additional-suffix=.txt "$WORK_DIR/points.csv" "$WORK_DIR/chunk_" || exit 1
+    rm "$WORK_DIR/points.csv"
+else
+    split -n l/$NUM_MAPPERS -d -a 4 --additional-suffix=.txt "$POINTS_FILE" "$WORK_DIR/chunk_" || exit 1
+fi
+CANDIDATES="$WORK_DIR/candidates.txt"
+echo "Seeding K=$K centers with k-means|| ($ROUNDS rounds, l=$OVERSAMPLING) on $NUM_MAPPERS tasks."
+
+# --- Parallel Seeding Step ---
+# Runs one kmeans_init.py step (cost or sample) on every task; each task
+# writes its output to <step>_XXXX.txt and keeps its distances in
+# state_XXXX.npz. Fails if any task fails.
+run_init_step() {
+    STEP=$1
+    shift
+    srun --ntasks=$NUM_MAPPERS bash -c '
+        TASK_ID=$(printf "%04d" $SLURM_PROCID)
+        WORK_DIR=$1
+        STEP=$2
+        POINT_STORE_FILE=$3
+        NUM_MAPPERS=$4
+        shift 4
+        ARGS=("$@" --task-id "$SLURM_PROCID" --state "$WORK_DIR/state_${TASK_ID}.npz")
+        if [ -n "$POINT_STORE_FILE" ]; then
+            ARGS+=(--points "$POINT_STORE_FILE" --num-tasks "$NUM_MAPPERS")
+            INPUT_CHUNK=/dev/null
+        else
+            INPUT_CHUNK="$WORK_DIR/chunk_${TASK_ID}.txt"
+        fi
+        python3 kmeans_init.py "$STEP" "$WORK_DIR/candidates.txt" "${ARGS[@]}" < "$INPUT_CHUNK" > "$WORK_DIR/${STEP}_${TASK_ID}.txt"
+    ' bash "$WORK_DIR" "$STEP" "$POINT_STORE_FILE" "$NUM_MAPPERS" --block-size "$BLOCK_SIZE" "$@"
+}
+
+# --- Oversampling Rounds ---
+python3 kmeans_init.py pick "$POINTS_FILE" "$CANDIDATES" --seed "$SEED" || exit 1
+SEEN=0
+for r in $(seq 1 $ROUNDS)
+do
+    # Distances to the candidates added in the previous round, summed over all tasks
+    run_init_step cost --start "$SEEN" --index "$INDEX" || exit 1
+    SEEN=$(wc -l < "$CANDIDATES")
+    COST=$(cat "$WORK_DIR/cost_"*.txt | awk '{ total += $1 } END { printf "%.17g", total }')
+    rm "$WORK_DIR/cost_"*.txt
+    if awk -v cost="$COST" 'BEGIN { exit !(cost == 0) }'; then
+        # Every point already is a candidate: later rounds cannot sample anything
+        echo "Round $r: cost 0, $SEEN candidates; stopping early."
+        break
+    fi
+
+    run_init_step sample --cost "$COST" --oversampling "$OVERSAMPLING" --seed "$SEED" --round "$r" || exit 1
+    cat "$WORK_DIR/sample_"*.txt >> "$CANDIDATES"
+    rm "$WORK_DIR/sample_"*.txt
+    echo "Round $r: cost $COST, $(wc -l < "$CANDIDATES") candidates."
+done
+
+# --- Weighted k-means++ on the candidates ---
+# One last cost pass assigns every point to its nearest candidate; the
+# per-task states then give each candidate's weight.
+run_init_step cost --start "$SEEN" --index "$INDEX" || exit 1
+rm "$WORK_DIR/cost_"*.txt
+python3 kmeans_init.py finalize "$CANDIDATES" "$K" "$OUTPUT_FILE" "$WORK_DIR/state_"*.npz --seed "$SEED" || exit 1
+
+echo "Initial centers written to $OUTPUT_FILE"
+rm -rf "$WORK_DIR"
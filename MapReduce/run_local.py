@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Local, single-node K-Means driver that needs no SLURM.
+
+Runs the same map (mapper.py), combine (in-mapper aggregation) and reduce
+(reducer.py) logic as run_mapreduce.sh, but on a process pool sized to the
+local cores. The points are loaded once into shared memory and every worker
+attaches to it and works on its own row range, so no chunk files are written.
+The output directory gets the same centroids_<i>.txt, centroids_final.txt and
+assignments.labels (or assignments.txt) files as run_mapreduce.sh.
+
+Usage:
+    python3 run_local.py K points.csv centers.txt max_iter output_dir [--workers N]
+"""
+import os
+import glob
+import argparse
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+import frame_store
+import point_store
+import timing
+from bounds import HamerlyAssigner
+from centroid_index import INDEX_MODES, build_centroid_index
+from label_store import ASSIGNMENT_FORMATS, LabelWriter, assignment_suffix
+from mapper import (read_centroids, sample_blocks, assign_blocks, aggregate_blocks, aggregate_delta_blocks,
+                    format_partial_sums, format_assignments)
+from point_store import read_point_blocks
+from reducer import (read_old_centroids, reduce_partials, sum_partials, update_centroids,
+                     update_minibatch_centroids, format_delta_state, format_centroids)
+
+DEFAULT_BLOCK_SIZE = 100000
+
+# Set in every pool process by attach_shared_arrays()
+_segments = []
+_points = None
+_bounds = None
+_previous = None
+_labels = None
+
+def count_lines(file_path):
+    """Counts newline-terminated lines without parsing them."""
+    count = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            data = f.read(1 << 24)
+            if not data:
+                break
+            count += data.count(b'\n')
+    return count
+
+def load_points_into_shared_memory(points_file, block_size, dtype=np.float64):
+    """
+    Loads a points CSV, a binary point store, a block-compressed CSV (see
+    frame_store.py) or a directory of shards (see
+    generate_large_script.py --shards) into a new shared memory segment of
+    dtype and returns (segment, shape). The input is streamed in blocks, so only the
+    shared copy of the dataset is ever held in memory.
+    """
+    if point_store.is_point_store(points_file):
+        capacity, n_dim, _ = point_store.read_header(points_file)
+        blocks = (point_store.open_points(points_file, start, start + block_size)
+                  for start in range(0, capacity, block_size))
+        csv_files = []
+    elif frame_store.is_frame_store(points_file):
+        capacity, n_dim = frame_store.read_header(points_file)
+        blocks = frame_store.read_partition_blocks(points_file, 0, 1, block_size)
+    else:
+        # Size the segment from a cheap newline count, then parse straight into it
+        if os.path.isdir(points_file):
+            csv_files = sorted(glob.glob(os.path.join(points_file, "chunk_*.txt")))
+        else:
+            csv_files = [points_file]
+        capacity = sum(count_lines(path) for path in csv_files) + len(csv_files)
+        with open(csv_files[0], 'r') as f:
+            n_dim = len(f.readline().strip().split(','))
+        blocks = (block for path in csv_files for block in read_csv_blocks(path, block_size, n_dim))
+
+    shm, points = create_shared_array((capacity, n_dim), dtype)
+    row = 0
+    for block in blocks:
+        points[row:row + len(block)] = block
+        row += len(block)
+    return shm, (row, n_dim)
+
+def read_csv_blocks(file_path, block_size, n_dim):
+    """Yields the points of one CSV file in blocks, closing it once exhausted."""
+    with open(file_path, 'r') as f:
+        yield from read_point_blocks(f, block_size, n_dim)
+
+def create_shared_array(shape, dtype, fill=None):
+    """Creates a new shared memory segment and returns it with an ndarray view of it."""
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    if fill is not None:
+        array.fill(fill)
+    return shm, array
+
+def attach_shared_arrays(points_spec, bounds_spec, previous_spec, labels_spec):
+    """
+    Pool initializer: maps the shared points array, plus the shared Hamerly
+    bound arrays, previous labels and last map's labels when enabled, into
+    this worker process. Each spec is a (segment name, shape, dtype) tuple.
+    """
+    global _points, _bounds, _previous, _labels
+
+    def attach(name, shape, dtype):
+        shm = shared_memory.SharedMemory(name=name)
+        _segments.append(shm)
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    _points = attach(*points_spec)
+    if bounds_spec is not None:
+        _bounds = tuple(attach(*spec) for spec in bounds_spec)
+    if previous_spec is not None:
+        _previous = attach(*previous_spec)
+    if labels_spec is not None:
+        _labels = attach(*labels_spec)
+
+def partition_blocks(task_id, num_tasks, block_size):
+    """Yields this task's rows of the shared points array in blocks."""
+    start, stop = point_store.task_row_range(len(_points), task_id, num_tasks)
+    for block_start in range(start, stop, block_size):
+        yield _points[block_start:min(block_start + block_size, stop)]
+
+def partition_assigner(task_id, num_tasks, bound_centroids):
+    """
+    Wraps this task's rows of the shared bound arrays in a HamerlyAssigner.
+    bound_centroids are the centroids the stored bounds were computed against.
+    """
+    if _bounds is None:
+        return None
+    start, stop = point_store.task_row_range(len(_points), task_id, num_tasks)
+    labels, upper, lower = (array[start:stop] for array in _bounds)
+    return HamerlyAssigner(labels, upper, lower, bound_centroids)
+
+def label_sink(start):
+    """Returns an on_labels callback that stores consecutive blocks of labels in the shared array from row start."""
+    row = start
+    def store(labels):
+        nonlocal row
+        _labels[row:row + len(labels)] = labels
+        row += len(labels)
+    return store
+
+def map_task(args):
+    """
+    Map + combine for one partition; returns its combiner records. sample is
+    None, or a (fraction, seed) pair that restricts the map to a random
+    sample of the partition (mini-batch mode).
+    """
+    task_id, num_tasks, centroids, bound_centroids, block_size, index_mode, sample, iteration = args
+    with timing.Phase('map', iteration=iteration, task=task_id) as phase:
+        index = build_centroid_index(centroids, index_mode)
+        assigner = partition_assigner(task_id, num_tasks, bound_centroids)
+        if assigner is not None:
+            assigner.set_centroids(centroids, index)
+        blocks = phase.count_blocks(partition_blocks(task_id, num_tasks, block_size))
+        if sample is not None:
+            fraction, seed = sample
+            blocks = sample_blocks(blocks, fraction, np.random.default_rng([seed, task_id]))
+        start, stop = point_store.task_row_range(len(_points), task_id, num_tasks)
+        # Every label is kept, so the last iteration leaves the final assignment behind
+        on_labels = label_sink(start) if _labels is not None and sample is None else None
+        if _previous is not None:
+            # Delta mode: only points that switched cluster are summed
+            sums, counts, touched, _ = aggregate_delta_blocks(centroids, blocks, _previous[start:stop], assigner, index,
+                                                              on_labels)
+            output = format_partial_sums(sums, counts, touched)
+        else:
+            sums, counts = aggregate_blocks(centroids, blocks, assigner, index, on_labels)
+            output = format_partial_sums(sums, counts)
+        phase.records_out, phase.bytes_out = output.count("\n"), len(output)
+    return output
+
+def assign_task(args):
+    """Final assignment pass for one partition, written to assign_XX.labels or assign_XX.txt."""
+    task_id, num_tasks, centroids, block_size, index_mode, output_dir, assignment_format = args
+    with timing.Phase('assign', task=task_id) as phase:
+        index = build_centroid_index(centroids, index_mode)
+        blocks = phase.count_blocks(partition_blocks(task_id, num_tasks, block_size))
+        part_path = os.path.join(output_dir, f"assign_{task_id:02d}{assignment_suffix(assignment_format)}")
+        if assignment_format != 'points':
+            with LabelWriter(part_path) as writer:
+                for _, labels in assign_blocks(centroids, blocks, index=index):
+                    writer.write(labels)
+            phase.records_out, phase.bytes_out = writer.count, writer.bytes
+            return
+        with open(part_path, 'w') as f:
+            for block, labels in assign_blocks(centroids, blocks, index=index):
+                text = format_assignments(block, labels)
+                phase.records_out += len(block)
+                phase.bytes_out += len(text)
+                f.write(text)
+
+def write_final_assignment(pool, num_tasks, centroids_file, block_size, index_mode, output_dir, assignment_format):
+    """
+    Writes the assignment file with a separate pass over the points for the
+    given centroids, and returns its path.
+    """
+    centroids = np.array(read_centroids(centroids_file), dtype=np.float64)
+    pool.map(assign_task, [(t, num_tasks, centroids, block_size, index_mode, output_dir, assignment_format)
+                           for t in range(num_tasks)])
+    suffix = assignment_suffix(assignment_format)
+    assignment_path = os.path.join(output_dir, f"assignments{suffix}")
+    with open(assignment_path, 'wb') as out:
+        for t in range(num_tasks):
+            part_path = os.path.join(output_dir, f"assign_{t:02d}{suffix}")
+            with open(part_path, 'rb') as part:
+                while True:
+                    data = part.read(1 << 20)
+                    if not data:
+                        break
+                    out.write(data)
+            os.remove(part_path)
+    return assignment_path
+
+def write_kept_labels(labels, output_dir, assignment_format):
+    """Writes the labels kept from the last map step as the assignment file and returns its path."""
+    assignment_path = os.path.join(output_dir, f"assignments{assignment_suffix(assignment_format)}")
+    with LabelWriter(assignment_path) as writer:
+        for start in range(0, len(labels), DEFAULT_BLOCK_SIZE):
+            writer.write(labels[start:start + DEFAULT_BLOCK_SIZE])
+    return assignment_path
+
+def count_centers(centers_file):
+    """Number of non-blank lines, i.e. initial centers, in a centers file."""
+    with open(centers_file, 'r') as f:
+        return sum(1 for line in f if line.strip())
+
+def run_kmeans(k, points_file, centers_file, max_iter, output_dir, num_workers,
+               block_size=DEFAULT_BLOCK_SIZE, use_bounds=False, index_mode='auto', use_delta=False,
+               sample_fraction=None, seed=0, final_assignment=True, dtype='float64', assignment_format='labels'):
+    """
+    Runs the full iterative K-Means job locally and returns the number of
+    iterations run. With sample_fraction set, every iteration only maps a
+    fresh random sample of the points and takes a mini-batch step. dtype is
+    the precision the shared points are held and compared in.
+
+    The assignment holds every point's label from the last iteration's
+    assignment step, as in run_mapreduce.sh. Unless assignment_format is
+    'points' or the run is mini-batch, the map steps keep their labels in
+    shared memory and no separate assignment pass is needed.
+    """
+    if sample_fraction is not None and (use_bounds or use_delta):
+        raise ValueError("Mini-batch mode cannot be combined with bounds or delta mode")
+    if max_iter < 1:
+        raise ValueError("max_iter must be at least 1")
+    if count_centers(centers_file) != k:
+        raise ValueError(f"k is {k} but {centers_file} holds {count_centers(centers_file)} centers")
+    os.makedirs(output_dir, exist_ok=True)
+    with open(centers_file, 'r') as src:
+        initial_centers = src.read()
+    with open(os.path.join(output_dir, 'centroids_0.txt'), 'w') as dst:
+        dst.write(initial_centers)
+    print(f"Starting K-Means with {num_workers} local workers.")
+
+    shm, shape = load_points_into_shared_memory(points_file, block_size, dtype)
+    segments = [shm]
+    points_spec = (shm.name, shape, dtype)
+    bounds_spec = None
+    if use_bounds:
+        # Per-point label, upper and lower bound, kept beside the points between iterations
+        bounds_spec = []
+        for dtype, fill in ((np.int64, -1), (np.float64, 0.0), (np.float64, 0.0)):
+            segment, _ = create_shared_array(shape[:1], dtype, fill)
+            segments.append(segment)
+            bounds_spec.append((segment.name, shape[:1], dtype))
+    previous_spec = None
+    if use_delta:
+        # Every point's label from the previous iteration
+        segment, _ = create_shared_array(shape[:1], np.int32, -1)
+        segments.append(segment)
+        previous_spec = (segment.name, shape[:1], np.int32)
+    labels_spec = None
+    kept_labels = None
+    if final_assignment and assignment_format != 'points' and sample_fraction is None:
+        # Labels of the latest map step, written out after the last iteration
+        segment, kept_labels = create_shared_array(shape[:1], np.int32)
+        segments.append(segment)
+        labels_spec = (segment.name, shape[:1], np.int32)
+    bound_centroids = None
+    delta_state = []
+    minibatch_counts = {}
+    try:
+        with Pool(num_workers, initializer=attach_shared_arrays,
+                  initargs=(points_spec, bounds_spec, previous_spec, labels_spec)) as pool:
+            for i in range(1, max_iter + 1):
+                prev_centroids = os.path.join(output_dir, f"centroids_{i - 1}.txt")
+                new_centroids = os.path.join(output_dir, f"centroids_{i}.txt")
+
+                with timing.Phase('iteration', iteration=i):
+                    # --- Parallel Map -> Combine Step ---
+                    with timing.Phase('map_step', iteration=i):
+                        centroids = np.array(read_centroids(prev_centroids), dtype=np.float64)
+                        sample = None if sample_fraction is None else (sample_fraction, seed + i)
+                        partials = pool.map(map_task, [(t, num_workers, centroids, bound_centroids, block_size,
+                                                        index_mode, sample, i) for t in range(num_workers)])
+                        bound_centroids = centroids
+
+                    # --- Reduce Step ---
+                    with timing.Phase('reduce', iteration=i, task=0) as phase:
+                        records = "".join(partials).splitlines()
+                        phase.records_in = len(records)
+                        phase.bytes_in = sum(len(partial) for partial in partials)
+                        if use_delta:
+                            total_sums, total_counts = sum_partials(delta_state + records)
+                            delta_state = format_delta_state(total_sums, total_counts).splitlines()
+                            final_centroids = update_centroids(total_sums, total_counts, read_old_centroids(prev_centroids))
+                        elif sample_fraction is not None:
+                            total_sums, total_counts = sum_partials(records)
+                            final_centroids = update_minibatch_centroids(total_sums, total_counts, minibatch_counts,
+                                                                         read_old_centroids(prev_centroids))
+                        else:
+                            final_centroids = reduce_partials(records, read_old_centroids(prev_centroids))
+                        with open(new_centroids, 'w') as f:
+                            f.write(format_centroids(final_centroids))
+
+                # --- Convergence Check ---
+                with open(prev_centroids, 'r') as f_prev, open(new_centroids, 'r') as f_new:
+                    converged = f_prev.read() == f_new.read()
+                if converged:
+                    print(f"Convergence reached at iteration {i}.")
+                    break
+                if i == max_iter:
+                    print(f"Reached max iterations ({max_iter}) without convergence.")
+
+            with open(new_centroids, 'r') as src, open(os.path.join(output_dir, 'centroids_final.txt'), 'w') as dst:
+                dst.write(src.read())
+            if final_assignment:
+                with timing.Phase('final_assignment', iteration=i):
+                    if kept_labels is not None:
+                        assignment_path = write_kept_labels(kept_labels, output_dir, assignment_format)
+                    else:
+                        assignment_path = write_final_assignment(pool, num_workers, prev_centroids, block_size,
+                                                                 index_mode, output_dir, assignment_format)
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+    if final_assignment:
+        print(f"K-Means finished. Final assignment is in {assignment_path}")
+    else:
+        print(f"K-Means finished. Final centroids are in {os.path.join(output_dir, 'centroids_final.txt')}")
+    return i
+
+def main():
+    parser = argparse.ArgumentParser(description="Run K-Means MapReduce on the local machine without SLURM.")
+    parser.add_argument("k", type=int)
+    parser.add_argument("points_file", help="points.csv, a binary point store (*.bin), a block-compressed CSV (*.gz/*.zst "
+                        "with an index) or a directory of shards.")
+    parser.add_argument("centers_file")
+    parser.add_argument("max_iter", type=int)
+    parser.add_argument("output_dir")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: number of local cores).")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE,
+                        help="Points assigned per vectorized block.")
+    parser.add_argument("--bounds", action="store_true",
+                        help="Use Hamerly bounds (kept in shared memory) to skip most distance computations.")
+    parser.add_argument("--index", choices=INDEX_MODES, default='auto',
+                        help="Nearest-centroid search strategy (see centroid_index.py).")
+    parser.add_argument("--delta", action="store_true",
+                        help="Only re-sum points that switched cluster and update running per-cluster totals.")
+    parser.add_argument("--sample-fraction", type=float,
+                        help="Mini-batch mode: each iteration only assigns a random sample of this fraction of the points.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for --sample-fraction.")
+    parser.add_argument("--no-final-assignment", action="store_true",
+                        help="Skip the full assignment pass and only write centroids_final.txt.")
+    parser.add_argument("--dtype", choices=point_store.DTYPES, default='float64',
+                        help="Precision the shared points are kept and compared in (float32 halves the memory).")
+    parser.add_argument("--assignment-format", choices=ASSIGNMENT_FORMATS, default='labels',
+                        help="assignments.labels (binary int32 labels), assignments.txt with one label per line, "
+                             "or assignments.txt with '<cluster_id>\\t<point>' lines (see label_store.py).")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Write per-phase, per-task timings to this JSON-lines file (see timing.py).")
+    args = parser.parse_args()
+    if args.max_iter < 1:
+        parser.error("max_iter must be at least 1")
+    if count_centers(args.centers_file) != args.k:
+        parser.error(f"k is {args.k} but {args.centers_file} holds {count_centers(args.centers_file)} centers")
+    if args.trace:
+        # Inherited by the pool processes, which append their own phases
+        open(args.trace, 'w').close()
+        os.environ[timing.TRACE_ENV] = args.trace
+    if args.sample_fraction is not None:
+        if not 0.0 < args.sample_fraction <= 1.0:
+            parser.error("--sample-fraction must be in (0, 1]")
+        if args.bounds or args.delta:
+            parser.error("--sample-fraction cannot be combined with --bounds or --delta")
+
+    run_kmeans(args.k, args.points_file, args.centers_file, args.max_iter,
+               args.output_dir, args.workers, args.block_size, args.bounds, args.index, args.delta,
+               args.sample_fraction, args.seed, not args.no_final_assignment, args.dtype, args.assignment_format)
+
+if __name__ == "__main__":
+    main()
@@ -16,71 +16,839 @@ OUTPUT_DIR=$5
 # SLURM provides the number of tasks in the environment. Default to 8 if not in a SLURM job.
 NUM_MAPPERS=${SLURM_NTASKS:-8}
 
+# --- Mapper Configuration ---
+# Number of points each mapper scores per vectorized block. Bounds mapper memory
+# to roughly BLOCK_SIZE * (D + K) floats. Set to 0 for the line-by-line mapper.
+BLOCK_SIZE=${MAPPER_BLOCK_SIZE:-100000}
+# When 1, mappers keep per-cluster sums in memory and write the combiner's
+# output directly, so the per-task sort and combiner.py stage are skipped.
+AGGREGATE=${MAPPER_AGGREGATE:-1}
+if [ "$BLOCK_SIZE" -le 0 ]; then
+    AGGREGATE=0 # In-mapper aggregation needs the vectorized mapper
+fi
+
+# When 1, mappers keep Hamerly distance bounds for their points between
+# iterations (tmp/bounds_XXXX.npz, or in memory for persistent workers) and skip
+# the distance computations that the bounds prove unnecessary.
+BOUNDS=${MAPPER_BOUNDS:-0}
+if [ "$BOUNDS" -eq 1 ] && [ "$BLOCK_SIZE" -le 0 ]; then
+    echo "Error: MAPPER_BOUNDS=1 requires MAPPER_BLOCK_SIZE > 0."
+    exit 1
+fi
+
+# Nearest-centroid search: 'auto' builds a KD-tree over the centroids each
+# iteration when K is large and D is low (needs SciPy), 'kdtree' forces it and
+# 'brute' always scans every centroid.
+INDEX=${MAPPER_INDEX:-auto}
+
+# When 1, each mapper remembers its points' previous labels (tmp/labels_XXXX.npy,
+# or in memory for persistent workers) and only emits the signed changes from
+# points that switched cluster; the reducer keeps running per-cluster totals in
+# tmp/reduce_state.txt. Requires in-mapper aggregation.
+DELTA=${MAPPER_DELTA:-0}
+if [ "$DELTA" -eq 1 ] && [ "$AGGREGATE" -ne 1 ]; then
+    echo "Error: MAPPER_DELTA=1 requires in-mapper aggregation (MAPPER_AGGREGATE=1, MAPPER_BLOCK_SIZE > 0)."
+    exit 1
+fi
+
+# --- Mini-Batch Mode ---
+# When MINIBATCH_FRACTION is set (e.g. 0.05), every mapper only assigns a
+# random sample of that fraction of its points each iteration, and the reducer
+# moves each centroid towards its sample mean with a per-center learning rate
+# instead of recomputing the exact mean. MINIBATCH_SEED makes runs repeatable.
+MINIBATCH_FRACTION=${MINIBATCH_FRACTION:-}
+MINIBATCH_SEED=${MINIBATCH_SEED:-0}
+if [ -n "$MINIBATCH_FRACTION" ] && { [ "$BLOCK_SIZE" -le 0 ] || [ "$BOUNDS" -eq 1 ] || [ "$DELTA" -eq 1 ]; }; then
+    echo "Error: MINIBATCH_FRACTION requires MAPPER_BLOCK_SIZE > 0 and cannot be combined with MAPPER_BOUNDS or MAPPER_DELTA."
+    exit 1
+fi
+
+# --- Multi-Run Sweep ---
+# With SWEEP=1, centers.txt is a sweep file written by 'sweep.py init': the
+# initial centers of several runs (different K values or random restarts),
+# each line prefixed with its run_id, and K is the total number of centers in
+# it. Every mapper scores its points against all runs in the same pass and
+# the reducer keeps the runs apart, keyed by (run_id, cluster_id), so the data
+# is read once per iteration for the whole sweep. Each iteration's per-run
+# SSE is appended to sweep_sse.txt; at the end every run's centers are written
+# to centroids_final_run<r>.txt and the runs are ranked in sweep_report.txt.
+SWEEP=${SWEEP:-0}
+SWEEP_HISTORY="$OUTPUT_DIR/sweep_sse.txt"
+if [ "$SWEEP" -eq 1 ]; then
+    if [ "$AGGREGATE" -ne 1 ] || [ "$BOUNDS" -eq 1 ] || [ "$DELTA" -eq 1 ] || [ -n "$MINIBATCH_FRACTION" ]; then
+        echo "Error: SWEEP=1 requires in-mapper aggregation and cannot be combined with MAPPER_BOUNDS, MAPPER_DELTA or MINIBATCH_FRACTION."
+        exit 1
+    fi
+    if [ "$(grep -c . "$INITIAL_CENTERS_FILE")" -ne "$K" ]; then
+        echo "Error: with SWEEP=1, K must be the total number of centers in $INITIAL_CENTERS_FILE ($(grep -c . "$INITIAL_CENTERS_FILE"))."
+        exit 1
+    fi
+    if [ "${FINAL_ASSIGNMENT:-0}" -eq 1 ]; then
+        echo "Error: a sweep has no single final assignment; rerun the chosen run's centers without SWEEP for one."
+        exit 1
+    fi
+fi
+
+# When 0, the final full-data assignment pass is skipped and only
+# centroids_final.txt is written (useful for mini-batch runs on huge inputs).
+# Sweeps never write one.
+if [ "$SWEEP" -eq 1 ]; then
+    FINAL_ASSIGNMENT=0
+fi
+FINAL_ASSIGNMENT=${FINAL_ASSIGNMENT:-1}
+
+# --- Assignment Output ---
+# ASSIGNMENT_FORMAT=labels writes assignments.labels, one int32 cluster label
+# per input row in input order; 'text' writes the same labels one per line to
+# assignments.txt (see label_store.py). Either way every full map step also
+# writes its labels as a side output, so the last iteration leaves the final
+# assignment behind and no extra pass over the data is needed. 'points' keeps
+# the classic '<cluster_id>\t<point>' assignments.txt, written by a separate
+# pass. The line-by-line mapper (MAPPER_BLOCK_SIZE=0) only supports 'points'.
+if [ "$BLOCK_SIZE" -le 0 ]; then
+    ASSIGNMENT_FORMAT=${ASSIGNMENT_FORMAT:-points}
+else
+    ASSIGNMENT_FORMAT=${ASSIGNMENT_FORMAT:-labels}
+fi
+case "$ASSIGNMENT_FORMAT" in
+    labels) ASSIGNMENT_SUFFIX=.labels ;;
+    text|points) ASSIGNMENT_SUFFIX=.txt ;;
+    *)
+        echo "Error: ASSIGNMENT_FORMAT must be labels, text or points."
+        exit 1
+        ;;
+esac
+if [ "$ASSIGNMENT_FORMAT" != "points" ] && [ "$BLOCK_SIZE" -le 0 ]; then
+    echo "Error: ASSIGNMENT_FORMAT=$ASSIGNMENT_FORMAT requires MAPPER_BLOCK_SIZE > 0."
+    exit 1
+fi
+ASSIGNMENT_FILE="$OUTPUT_DIR/assignments$ASSIGNMENT_SUFFIX"
+# Mini-batch iterations only label a sample, so those runs keep the extra pass
+FUSED_ASSIGNMENT=0
+if [ "$FINAL_ASSIGNMENT" -eq 1 ] && [ "$ASSIGNMENT_FORMAT" != "points" ] && [ -z "$MINIBATCH_FRACTION" ]; then
+    FUSED_ASSIGNMENT=1
+fi
+
+# --- Reduce Tree ---
+# The reducer reads every partition's combined_out_XXXX.txt directly and sums
+# the records per cluster_id in memory, so there is no global sort. With
+# REDUCE_FANIN=F > 1 and more than F partition files, groups of F consecutive
+# files are first merged by 'reducer.py --merge', one background process per
+# group on the driver host, level by level, until at most F files are left
+# for the final reducer; the reduce then takes log_F(partitions) parallel
+# rounds instead of one pass over every partition's output.
+REDUCE_FANIN=${REDUCE_FANIN:-0}
+
+# --- Range-Partitioned Reducers ---
+# With NUM_REDUCERS=R > 1, every task splits its combined output by cluster_id
+# into R contiguous ranges (combined_out_XXXX_rYYYY.txt) and R reducers run in
+# parallel, each loading only its slice of the old centroids and printing its
+# slice of the new ones; the slices are concatenated in order. Meant for very
+# large K x D, where one reducer holding every cluster is the bottleneck.
+NUM_REDUCERS=${NUM_REDUCERS:-1}
+if [ "$NUM_REDUCERS" -lt 1 ]; then
+    echo "Error: NUM_REDUCERS must be at least 1."
+    exit 1
+fi
+if [ "$NUM_REDUCERS" -gt 1 ] && [ "$SWEEP" -eq 1 ]; then
+    echo "Error: NUM_REDUCERS > 1 cannot be combined with SWEEP=1."
+    exit 1
+fi
+
+# --- Point Precision ---
+# With POINT_DTYPE=float32, mappers hold and compare the points in single
+# precision, which halves their memory and, with a float32 point store (see
+# POINT_STORE), the bytes read per iteration. Per-cluster sums are always
+# accumulated in float64 with compensated summation, so only the assignments
+# of near-ties can change; verify such runs with 'verify_script.py --tolerance'.
+POINT_DTYPE=${POINT_DTYPE:-float64}
+if [ "$POINT_DTYPE" != "float64" ] && [ "$POINT_DTYPE" != "float32" ]; then
+    echo "Error: POINT_DTYPE must be float64 or float32."
+    exit 1
+fi
+if [ "$POINT_DTYPE" == "float32" ] && [ "$BLOCK_SIZE" -le 0 ]; then
+    echo "Error: POINT_DTYPE=float32 requires MAPPER_BLOCK_SIZE > 0."
+    exit 1
+fi
+
+# --- Persistent Workers ---
+# When 1, one long-lived worker.py per task loads its partition once and keeps
+# it in memory; each iteration the driver only broadcasts the centroids file
+# and runs the reduce, instead of launching a new srun step.
+PERSISTENT_WORKERS=${PERSISTENT_WORKERS:-0}
+if [ "$PERSISTENT_WORKERS" -eq 1 ] && [ "$BLOCK_SIZE" -le 0 ]; then
+    echo "Error: persistent workers require MAPPER_BLOCK_SIZE > 0."
+    exit 1
+fi
+if [ "$PERSISTENT_WORKERS" -eq 1 ] && [ "$SWEEP" -eq 1 ]; then
+    echo "Error: PERSISTENT_WORKERS=1 cannot be combined with SWEEP=1."
+    exit 1
+fi
+
+# --- Partition Queue ---
+# With PARTITIONS_PER_TASK > 1 the input is over-decomposed into
+# NUM_MAPPERS * PARTITIONS_PER_TASK partitions (chunk_XXXX.txt files, or row
+# ranges of the point store). Every map task keeps claiming the next unclaimed
+# partition from a shared queue (an atomic mkdir in tmp/queue) until none is
+# left, so fast tasks map more partitions and one slow task no longer stalls
+# the whole iteration. Every partition's map time is appended to
+# $OUTPUT_DIR/partition_times.txt. The next iteration hands out the slowest
+# partitions first (longest-processing-time order), and tasks that are much
+# slower per partition than the rest are reported as stragglers. With 1 (the
+# default), task i maps partition i.
+PARTITIONS_PER_TASK=${PARTITIONS_PER_TASK:-1}
+if ! [[ "$PARTITIONS_PER_TASK" =~ ^[1-9][0-9]*$ ]]; then
+    echo "Error: PARTITIONS_PER_TASK must be a positive integer."
+    exit 1
+fi
+NUM_PARTITIONS=$((NUM_MAPPERS * PARTITIONS_PER_TASK))
+if [ "$PARTITIONS_PER_TASK" -gt 1 ] && [ "$PERSISTENT_WORKERS" -eq 1 ]; then
+    echo "Error: PARTITIONS_PER_TASK > 1 cannot be combined with PERSISTENT_WORKERS=1 (workers keep a fixed partition in memory)."
+    exit 1
+fi
+QUEUE_DIR="$OUTPUT_DIR/tmp/queue"
+PARTITION_ORDER="$OUTPUT_DIR/tmp/partition_order.txt"
+PARTITION_TIMES="$OUTPUT_DIR/partition_times.txt"
+# A task is reported as a straggler when its mean time per partition exceeds
+# this multiple of the median partition time
+STRAGGLER_FACTOR=2
+
+# Shell functions for the srun map bodies, which set NUM_MAPPERS,
+# NUM_PARTITIONS and QUEUE_DIR before calling them
+PARTITION_QUEUE_FUNCTIONS='
+# task_partitions: the partitions this task may map, in the order to try them
+task_partitions() {
+    if [ "$NUM_PARTITIONS" -eq "$NUM_MAPPERS" ]; then
+        echo "$SLURM_PROCID"
+    else
+        cat "$QUEUE_DIR/order.txt"
+    fi
+}
+# claim_partition P: succeeds if this task may map partition P
+claim_partition() {
+    [ "$NUM_PARTITIONS" -eq "$NUM_MAPPERS" ] || mkdir "$QUEUE_DIR/claim_$1" 2>/dev/null
+}
+'
+
+# --- Input Format ---
+# A binary point store (*.bin, see point_store.py) is memory-mapped by row range
+# inside each mapper, so no chunk files are needed. With POINT_STORE=1 a CSV
+# input is converted once into a point store before the first iteration.
+# A directory written by 'generate_large_script.py --shards' is used as is:
+# points_XX.bin shards form one point store, and chunk_XX.txt shards replace
+# the split step when there is one per mapper.
+# A block-compressed CSV (*.gz or *.zst with a *.idx frame index, see
+# frame_store.py) is also read in place: every mapper seeks to its own range of
+# frames and decompresses them as a stream, so no uncompressed copy is made.
+POINT_STORE=${POINT_STORE:-0}
+POINT_STORE_FILE=""
+CHUNK_DIR=""
+if [ -d "$POINTS_FILE" ] && [ -e "$POINTS_FILE/points_00.bin" ]; then
+    POINT_STORE_FILE=$POINTS_FILE
+elif [ -d "$POINTS_FILE" ]; then
+    CHUNK_DIR=$POINTS_FILE
+    NUM_CHUNKS=$(find "$CHUNK_DIR" -maxdepth 1 -name 'chunk_*.txt' | wc -l)
+    if [ "$NUM_CHUNKS" -ne "$NUM_PARTITIONS" ] || [ "$POINT_STORE" -eq 1 ]; then
+        # Not one shard per partition: fall back to one CSV file that is split or converted below
+        POINTS_FILE="$OUTPUT_DIR/tmp/points.csv"
+    fi
+fi
+if [[ "$POINTS_FILE" == *.gz || "$POINTS_FILE" == *.zst ]]; then
+    if [ ! -f "$POINTS_FILE.idx" ]; then
+        echo "Error: $POINTS_FILE has no frame index; compress it with 'python3 frame_store.py points.csv $POINTS_FILE'."
+        exit 1
+    fi
+    if [ "$POINT_STORE" -eq 1 ]; then
+        echo "Error: POINT_STORE=1 cannot convert compressed input; it is read in place."
+        exit 1
+    fi
+    POINT_STORE_FILE=$POINTS_FILE
+    NUM_FRAMES=$(($(wc -l < "$POINTS_FILE.idx") - 1))
+    if [ "$NUM_FRAMES" -lt "$NUM_PARTITIONS" ]; then
+        echo "Warning: $POINTS_FILE has only $NUM_FRAMES frames for $NUM_PARTITIONS partitions; some tasks will be idle."
+    fi
+elif [[ "$POINTS_FILE" == *.bin ]]; then
+    POINT_STORE_FILE=$POINTS_FILE
+elif [ "$POINT_STORE" -eq 1 ] && [ -z "$POINT_STORE_FILE" ]; then
+    POINT_STORE_FILE="$OUTPUT_DIR/tmp/points.bin"
+fi
+if [ -n "$POINT_STORE_FILE" ] && [ "$BLOCK_SIZE" -le 0 ]; then
+    echo "Error: binary point stores and compressed input require MAPPER_BLOCK_SIZE > 0."
+    exit 1
+fi
+
+# --- Checkpoint / Resume ---
+# Every finished iteration is recorded in $OUTPUT_DIR/checkpoint. The file is
+# replaced atomically, and only after centroids_<i>.txt has been renamed into
+# place, so a restart never picks up a half-written centroid file. With
+# RESUME=1 (default), rerunning the same job after a preemption or time-out
+# continues after the last recorded iteration. "The same job" means the same
+# K, input, initial centers, task count, precision, sampling and reducer
+# count (mini-batch counts are kept per reducer slice). A larger
+# max_iter extends a finished run. Any other checkpoint is ignored and the run
+# starts from scratch.
+RESUME=${RESUME:-1}
+CHECKPOINT_FILE="$OUTPUT_DIR/checkpoint"
+
+# fingerprint PATH: size and modification time of a file, or of every file in a directory
+fingerprint() {
+    if [ -d "$1" ]; then
+        find -L "$1" -maxdepth 1 -type f -printf '%f %s %T@\n' | sort | cksum
+    else
+        stat -L -c '%s %Y' "$1"
+    fi
+}
+
+checkpoint_value() {
+    sed -n "s/^$1=//p" "$CHECKPOINT_FILE" 2>/dev/null
+}
+
+INPUT_POINTS=$2 # As given; POINTS_FILE may now point into tmp
+INPUT_ID=$(fingerprint "$INPUT_POINTS")
+RUN_ID=$(printf '%s\n' "$K" "$INPUT_POINTS" "$INPUT_ID" "$(cksum < "$INITIAL_CENTERS_FILE")" "$NUM_PARTITIONS" \
+    "$POINT_DTYPE" "$MINIBATCH_FRACTION" "$MINIBATCH_SEED" "$NUM_REDUCERS" | cksum | cut -d ' ' -f 1)
+# The partitions only depend on the input, how it is split or converted and the chunk file naming
+PARTITION_ID=$(printf '%s\n' "$INPUT_POINTS" "$INPUT_ID" "$NUM_PARTITIONS" "$POINT_STORE" "$POINT_DTYPE" chunk_%04d | cksum | cut -d ' ' -f 1)
+
+START_ITER=1
+LAST_ITER=$(checkpoint_value ITERATION)
+if [ "$RESUME" -eq 1 ] && [ -n "$LAST_ITER" ] && [ "$(checkpoint_value RUN_ID)" == "$RUN_ID" ] \
+    && [ -f "$OUTPUT_DIR/centroids_${LAST_ITER}.txt" ]; then
+    START_ITER=$((LAST_ITER + 1))
+fi
+
+# --- Timing Trace ---
+# With TRACE=1, every Python stage appends its wall time, CPU time and records
+# and bytes in/out per task and iteration to a JSON-lines file (see timing.py).
+# Each task writes tmp/trace/task_XX.jsonl and the driver adds its own phases,
+# including srun launch and shuffle time, to tmp/trace/driver.jsonl. They are
+# merged into $OUTPUT_DIR/trace.jsonl at the end.
+TRACE=${TRACE:-0}
+TRACE_DIR="$OUTPUT_DIR/tmp/trace"
+if [ "$TRACE" -eq 1 ]; then
+    export KMEANS_TRACE="$TRACE_DIR/driver.jsonl"
+fi
+
+now_us() {
+    date +%s%6N
+}
+
+# trace_event PHASE START_US [RECORDS_IN BYTES_IN]: records a driver-side phase
+# that started at START_US and ends now.
+trace_event() {
+    if [ "$TRACE" -ne 1 ]; then
+        return
+    fi
+    local END_US WALL_US
+    END_US=$(now_us)
+    WALL_US=$((END_US - $2))
+    printf '{"phase": "%s", "iteration": %s, "task": null, "host": "%s", "pid": %d, "start": %d.%06d, "wall_s": %d.%06d, "cpu_s": null, "records_in": %s, "records_out": null, "bytes_in": %s, "bytes_out": null}\n' \
+        "$1" "${KMEANS_ITERATION:-null}" "$(hostname)" "$$" $(($2 / 1000000)) $(($2 % 1000000)) \
+        $((WALL_US / 1000000)) $((WALL_US % 1000000)) "${3:-null}" "${4:-null}" >> "$KMEANS_TRACE"
+}
+
 # --- Setup ---
 mkdir -p "$OUTPUT_DIR/tmp" # Temporary directory for chunks and map outputs
-cp "$INITIAL_CENTERS_FILE" "$OUTPUT_DIR/centroids_0.txt"
-echo "Starting K-Means with $NUM_MAPPERS parallel mappers."
+# Leftovers of an interrupted run: per-iteration outputs and worker messages
+rm -rf "$OUTPUT_DIR/tmp/control" "$QUEUE_DIR" "$OUTPUT_DIR/tmp/combined_out_"* "$OUTPUT_DIR/tmp/merged_"* \
+    "$OUTPUT_DIR/tmp/centroids_r"* "$OUTPUT_DIR/tmp/assign_"*
+if [ "$START_ITER" -gt 1 ]; then
+    echo "Resuming from the checkpoint of iteration $LAST_ITER."
+    # Delta-mode labels and totals may be ahead of the checkpoint; the first
+    # resumed iteration rebuilds them from a full pass instead
+    rm -f "$OUTPUT_DIR/tmp/labels_"*.npy "$OUTPUT_DIR/tmp/reduce_state"*.txt
+    if [ -d "$OUTPUT_DIR/checkpoint_$LAST_ITER" ]; then
+        cp "$OUTPUT_DIR/checkpoint_$LAST_ITER/"* "$OUTPUT_DIR/tmp/"
+    fi
+else
+    rm -rf "$CHECKPOINT_FILE" "$TRACE_DIR" "$OUTPUT_DIR/checkpoint_"*/ "$OUTPUT_DIR/tmp/labels_"*.npy \
+        "$OUTPUT_DIR/tmp/bounds_"*.npz "$OUTPUT_DIR/tmp/reduce_state"*.txt "$OUTPUT_DIR/tmp/minibatch_counts"*.txt \
+        "$PARTITION_TIMES" "$PARTITION_ORDER" "$SWEEP_HISTORY"
+    cp "$INITIAL_CENTERS_FILE" "$OUTPUT_DIR/centroids_0.txt"
+fi
+mkdir -p "$TRACE_DIR"
+if [ "$NUM_PARTITIONS" -gt "$NUM_MAPPERS" ]; then
+    echo "Starting K-Means with $NUM_MAPPERS parallel mappers sharing $NUM_PARTITIONS partitions."
+else
+    echo "Starting K-Means with $NUM_MAPPERS parallel mappers."
+fi
+SETUP_START=$(now_us)
+
+# Partitions left by an earlier run on the same input are reused as they are
+PARTITION_ID_FILE="$OUTPUT_DIR/tmp/partitions.id"
+if [ "$(cat "$PARTITION_ID_FILE" 2>/dev/null)" == "$PARTITION_ID" ]; then
+    echo "Reusing the input partitions in $OUTPUT_DIR/tmp."
+else
+    rm -f "$PARTITION_ID_FILE" "$OUTPUT_DIR/tmp/chunk_"*.txt "$OUTPUT_DIR/tmp/points."* "$OUTPUT_DIR/tmp/bounds_"*.npz
+
+    if [ -n "$CHUNK_DIR" ] && [ "$POINTS_FILE" == "$OUTPUT_DIR/tmp/points.csv" ]; then
+        cat "$CHUNK_DIR"/chunk_*.txt > "$POINTS_FILE"
+    fi
+
+    if [ -n "$CHUNK_DIR" ] && [ -d "$POINTS_FILE" ]; then
+        # --- Pre-sharded input: one chunk per partition already exists ---
+        # Linked under the four-digit partition numbers the mappers expect
+        PART_NUM=0
+        for CHUNK in "$CHUNK_DIR"/chunk_*.txt; do
+            ln -s "$(cd "$(dirname "$CHUNK")" && pwd)/$(basename "$CHUNK")" "$OUTPUT_DIR/tmp/chunk_$(printf "%04d" $PART_NUM).txt"
+            PART_NUM=$((PART_NUM + 1))
+        done
+    elif [ "$POINT_STORE_FILE" == "$OUTPUT_DIR/tmp/points.bin" ]; then
+        # --- One-time conversion of the CSV input to a binary point store ---
+        python3 point_store.py "$POINTS_FILE" "$POINT_STORE_FILE" "$POINT_DTYPE" || exit 1
+    elif [ -z "$POINT_STORE_FILE" ]; then
+        # --- Split the input file for the mappers ---
+        # The 'split' command creates files like chunk_0000.txt, chunk_0001.txt, etc.
+        split -n l/$NUM_PARTITIONS -d -a 4 --additional-suffix=.txt "$POINTS_FILE" "$OUTPUT_DIR/tmp/chunk_" || exit 1
+    fi
+    echo "$PARTITION_ID" > "$PARTITION_ID_FILE.tmp"
+    mv "$PARTITION_ID_FILE.tmp" "$PARTITION_ID_FILE"
+fi
+trace_event setup "$SETUP_START"
+
+# --- Persistent Worker Control ---
+# Messages are numbered files in CONTROL_DIR (see worker.py for the protocol).
+CONTROL_DIR="$OUTPUT_DIR/tmp/control"
+MESSAGE_SEQ=0
+
+send_to_workers() {
+    MESSAGE_SEQ=$((MESSAGE_SEQ + 1))
+    echo "$*" > "$CONTROL_DIR/msg_${MESSAGE_SEQ}.tmp"
+    mv "$CONTROL_DIR/msg_${MESSAGE_SEQ}.tmp" "$CONTROL_DIR/msg_${MESSAGE_SEQ}"
+}
+
+wait_for_workers() {
+    while [ "$(find "$CONTROL_DIR" -name "done_${MESSAGE_SEQ}_*" | wc -l)" -lt "$NUM_MAPPERS" ]; do
+        for ERROR_FILE in "$CONTROL_DIR/error_${MESSAGE_SEQ}_"*; do
+            if [ -f "$ERROR_FILE" ]; then
+                echo "Error: persistent worker ${ERROR_FILE##*_} failed on message $MESSAGE_SEQ:"
+                cat "$ERROR_FILE"
+                exit 1
+            fi
+        done
+        if ! kill -0 "$WORKERS_PID" 2>/dev/null; then
+            echo "Error: persistent workers exited unexpectedly."
+            exit 1
+        fi
+        sleep 0.01
+    done
+    rm -f "$CONTROL_DIR/msg_${MESSAGE_SEQ}" "$CONTROL_DIR/done_${MESSAGE_SEQ}_"*
+}
+
+stop_workers() {
+    if [ -n "$WORKERS_PID" ] && kill -0 "$WORKERS_PID" 2>/dev/null; then
+        send_to_workers stop
+        wait "$WORKERS_PID"
+    fi
+}
+
+if [ "$PERSISTENT_WORKERS" -eq 1 ]; then
+    mkdir -p "$CONTROL_DIR"
+    WORKER_ARGS=(--num-tasks "$NUM_MAPPERS" --block-size "$BLOCK_SIZE" --index "$INDEX" --num-reducers "$NUM_REDUCERS" --dtype "$POINT_DTYPE"
+        --assignment-format "$ASSIGNMENT_FORMAT")
+    if [ "$FUSED_ASSIGNMENT" -eq 1 ]; then
+        WORKER_ARGS+=(--keep-labels)
+    fi
+    if [ "$BOUNDS" -eq 1 ]; then
+        WORKER_ARGS+=(--bounds)
+    fi
+    if [ "$DELTA" -eq 1 ]; then
+        WORKER_ARGS+=(--delta)
+    fi
+    if [ -n "$MINIBATCH_FRACTION" ]; then
+        WORKER_ARGS+=(--sample-fraction "$MINIBATCH_FRACTION" --seed "$MINIBATCH_SEED")
+    fi
+    # --kill-on-bad-exit: a worker that fails takes the whole step down instead of leaving the rest polling
+    srun --ntasks=$NUM_MAPPERS --kill-on-bad-exit=1 bash -c '
+        TASK_ID=$(printf "%02d" $SLURM_PROCID)
+        if [ -n "$KMEANS_TRACE" ]; then
+            export KMEANS_TRACE="${KMEANS_TRACE%/*}/task_${TASK_ID}.jsonl"
+        fi
+        OUTPUT_DIR=$1
+        POINT_STORE_FILE=$2
+        shift 2
+        if [ -n "$POINT_STORE_FILE" ]; then
+            INPUT=(--points "$POINT_STORE_FILE")
+        else
+            INPUT=(--chunk "$OUTPUT_DIR/tmp/chunk_$(printf "%04d" $SLURM_PROCID).txt")
+        fi
+        exec python3 worker.py "$OUTPUT_DIR/tmp/control" --task-id "$SLURM_PROCID" "${INPUT[@]}" "$@"
+    ' bash "$OUTPUT_DIR" "$POINT_STORE_FILE" "${WORKER_ARGS[@]}" &
+    WORKERS_PID=$!
+    trap stop_workers EXIT
+fi
+
+# --- Mapper Arguments ---
+# Options shared by every mapper task for the given iteration. Per-task input
+# and state paths are added inside the srun step.
+mapper_args() {
+    MAPPER_ARGS=(--block-size "$BLOCK_SIZE" --index "$INDEX" --dtype "$POINT_DTYPE")
+    if [ -n "$MINIBATCH_FRACTION" ] && [ -n "$1" ]; then
+        MAPPER_ARGS+=(--sample-fraction "$MINIBATCH_FRACTION" --seed "$((MINIBATCH_SEED + $1))")
+    fi
+    if [ "$SWEEP" -eq 1 ]; then
+        MAPPER_ARGS+=(--sweep)
+    fi
+}
+
+# --- Partition Queue Bookkeeping ---
+# start_queue: resets the queue for the next srun step, with the partitions
+# in the order they should be handed out.
+start_queue() {
+    rm -rf "$QUEUE_DIR"
+    mkdir -p "$QUEUE_DIR"
+    if [ -s "$PARTITION_ORDER" ]; then
+        cp "$PARTITION_ORDER" "$QUEUE_DIR/order.txt"
+    else
+        seq 0 $((NUM_PARTITIONS - 1)) > "$QUEUE_DIR/order.txt"
+    fi
+}
+
+# record_partition_times ITERATION: checks that every partition was mapped,
+# appends '<iteration> <partition> <task> <seconds>' lines to
+# partition_times.txt, orders the next queue slowest partition first and
+# reports straggling tasks.
+record_partition_times() {
+    cat "$QUEUE_DIR"/done_*.txt > "$QUEUE_DIR/times.txt" 2>/dev/null
+    if [ "$(wc -l < "$QUEUE_DIR/times.txt")" -ne "$NUM_PARTITIONS" ]; then
+        echo "Error: only $(wc -l < "$QUEUE_DIR/times.txt") of $NUM_PARTITIONS partitions were mapped in iteration $1."
+        exit 1
+    fi
+    awk -v I="$1" '{ printf "%d %d %d %.6f\n", I, $1, $2, $3 / 1e6 }' "$QUEUE_DIR/times.txt" >> "$PARTITION_TIMES"
+    sort -k3,3nr "$QUEUE_DIR/times.txt" | cut -d ' ' -f 1 > "$PARTITION_ORDER"
+    sort -k3,3n "$QUEUE_DIR/times.txt" | awk -v I="$1" -v F="$STRAGGLER_FACTOR" '
+        { time[NR] = $3; total[$2] += $3; parts[$2]++ }
+        END {
+            median = (NR % 2) ? time[(NR + 1) / 2] : (time[NR / 2] + time[NR / 2 + 1]) / 2
+            for (t in total) {
+                if (total[t] / parts[t] > F * median) {
+                    printf "Iteration %d: task %d is straggling (%.3f s per partition, median %.3f s, %d partition(s)).\n",
+                        I, t, total[t] / parts[t] / 1e6, median / 1e6, parts[t]
+                }
+            }
+        }'
+}
 
-# --- Split the input file for the mappers ---
-# The 'split' command creates files like chunk_aa, chunk_ab, etc.
-split -n l/$NUM_MAPPERS -d --additional-suffix=.txt "$POINTS_FILE" "$OUTPUT_DIR/tmp/chunk_"
+# --- Parallel Map -> Combine Step ---
+# Writes one combined_out_XXXX.txt per partition for the given centroids and
+# iteration. Each task maps its partition, or claims partitions from the
+# queue until none is left, and for each one either aggregates inside the
+# mapper or runs a full Map -> Sort -> Combine pipeline locally. With
+# FUSED_ASSIGNMENT=1 it also writes the partition's labels to tmp/assign_XXXX
+# (persistent workers keep them in memory instead).
+run_map_step() {
+    if [ "$PERSISTENT_WORKERS" -eq 1 ]; then
+        send_to_workers map "$1" "$OUTPUT_DIR/tmp/combined_out_" "$2"
+        wait_for_workers
+        return
+    fi
+    mapper_args "$2"
+    start_queue
+    srun --ntasks=$NUM_MAPPERS bash -c "$PARTITION_QUEUE_FUNCTIONS"'
+        set -o pipefail
+        TASK_ID=$(printf "%02d" $SLURM_PROCID)
+        if [ -n "$KMEANS_TRACE" ]; then
+            export KMEANS_TRACE="${KMEANS_TRACE%/*}/task_${TASK_ID}.jsonl"
+        fi
+        OUTPUT_DIR=$1
+        CENTROIDS=$2
+        POINT_STORE_FILE=$3
+        NUM_MAPPERS=$4
+        NUM_PARTITIONS=$5
+        AGGREGATE=$6
+        BOUNDS=$7
+        DELTA=$8
+        K=$9
+        NUM_REDUCERS=${10}
+        LABELS_SUFFIX=${11}
+        shift 11
+        QUEUE_DIR="$OUTPUT_DIR/tmp/queue"
+        while read -r PART_NUM; do
+            claim_partition "$PART_NUM" || continue
+            PART_START=$(date +%s%6N)
+            PART=$(printf "%04d" $PART_NUM)
+            ARGS=("$@" --task-id "$PART_NUM")
+            if [ -n "$LABELS_SUFFIX" ]; then
+                ARGS+=(--labels "$OUTPUT_DIR/tmp/assign_${PART}${LABELS_SUFFIX}")
+            fi
+            if [ -n "$POINT_STORE_FILE" ]; then
+                ARGS+=(--points "$POINT_STORE_FILE" --num-tasks "$NUM_PARTITIONS")
+                INPUT_CHUNK=/dev/null
+            else
+                INPUT_CHUNK="$OUTPUT_DIR/tmp/chunk_${PART}.txt"
+            fi
+            if [ "$BOUNDS" -eq 1 ]; then
+                ARGS+=(--bounds "$OUTPUT_DIR/tmp/bounds_${PART}.npz")
+            fi
+            if [ "$DELTA" -eq 1 ]; then
+                ARGS+=(--delta "$OUTPUT_DIR/tmp/labels_${PART}.npy")
+            fi
+            COMBINED_OUTPUT="$OUTPUT_DIR/tmp/combined_out_${PART}.txt"
+            if [ "$AGGREGATE" -eq 1 ]; then
+                python3 mapper.py "$CENTROIDS" --aggregate "${ARGS[@]}" < "$INPUT_CHUNK" > "$COMBINED_OUTPUT" || exit 1
+            else
+                python3 mapper.py "$CENTROIDS" "${ARGS[@]}" < "$INPUT_CHUNK" | sort -k1,1n | python3 combiner.py > "$COMBINED_OUTPUT" || exit 1
+            fi
+            if [ "$NUM_REDUCERS" -gt 1 ]; then
+                # Range-partition by cluster_id: cluster c goes to reducer ((c + 1) * R - 1) / K
+                awk -F "\t" -v K="$K" -v R="$NUM_REDUCERS" -v PREFIX="${COMBINED_OUTPUT%.txt}_r" "
+                    BEGIN { for (r = 0; r < R; r++) printf \"\" > (PREFIX sprintf(\"%04d\", r) \".txt\") }
+                    { print > (PREFIX sprintf(\"%04d\", int(((\$1 + 1) * R - 1) / K)) \".txt\") }
+                " "$COMBINED_OUTPUT" || exit 1
+                rm "$COMBINED_OUTPUT"
+            fi
+            echo "$PART_NUM $SLURM_PROCID $(( $(date +%s%6N) - PART_START ))" >> "$QUEUE_DIR/done_${TASK_ID}.txt"
+        done < <(task_partitions)
+    ' bash "$OUTPUT_DIR" "$1" "$POINT_STORE_FILE" "$NUM_MAPPERS" "$NUM_PARTITIONS" "$AGGREGATE" "$BOUNDS" "$DELTA" "$K" \
+        "$NUM_REDUCERS" "$([ "$FUSED_ASSIGNMENT" -eq 1 ] && echo "$ASSIGNMENT_SUFFIX")" "${MAPPER_ARGS[@]}" || return 1 # Pass arguments to the bash -c command
+    record_partition_times "$2"
+}
+
+# --- Final Assignment ---
+# run_final_assignment FINAL_CENTROIDS LAST_INPUT_CENTROIDS LABELS_READY
+# copies the final centroids and writes $ASSIGNMENT_FILE. Like naive_kmeans in
+# generate_script.py, the assignment is every point's label from the last
+# iteration's assignment step, i.e. against the centroids that iteration
+# started from (identical to the final ones after convergence). With
+# LABELS_READY=1 the last map step already produced those labels; otherwise
+# (ASSIGNMENT_FORMAT=points, mini-batch runs, or a resumed run that had
+# already finished) the mapper runs once more over every chunk. With
+# FINAL_ASSIGNMENT=0 only centroids_final.txt is written.
+run_final_assignment() {
+    FINAL_CENTROIDS_PATH=$1
+    ASSIGN_CENTROIDS_PATH=$2
+    cp "$FINAL_CENTROIDS_PATH" "$OUTPUT_DIR/centroids_final.txt"
+    if [ "$FINAL_ASSIGNMENT" -ne 1 ]; then
+        return
+    fi
+    ASSIGN_START=$(now_us)
+    if [ "$3" -eq 1 ]; then
+        # The last map step already labelled every point; persistent workers only need to write them out
+        if [ "$PERSISTENT_WORKERS" -eq 1 ]; then
+            send_to_workers labels "$OUTPUT_DIR/tmp/assign_" "$i"
+            wait_for_workers
+        fi
+    elif [ "$PERSISTENT_WORKERS" -eq 1 ]; then
+        send_to_workers assign "$ASSIGN_CENTROIDS_PATH" "$OUTPUT_DIR/tmp/assign_" "$i"
+        wait_for_workers
+    else
+        mapper_args ""
+        MAPPER_ARGS+=(--phase assign)
+        start_queue
+        srun --ntasks=$NUM_MAPPERS bash -c "$PARTITION_QUEUE_FUNCTIONS"'
+            set -o pipefail
+            TASK_ID=$(printf "%02d" $SLURM_PROCID)
+            if [ -n "$KMEANS_TRACE" ]; then
+                export KMEANS_TRACE="${KMEANS_TRACE%/*}/task_${TASK_ID}.jsonl"
+            fi
+            OUTPUT_DIR=$1
+            CENTROIDS=$2
+            POINT_STORE_FILE=$3
+            NUM_MAPPERS=$4
+            NUM_PARTITIONS=$5
+            ASSIGNMENT_FORMAT=$6
+            ASSIGNMENT_SUFFIX=$7
+            shift 7
+            QUEUE_DIR="$OUTPUT_DIR/tmp/queue"
+            while read -r PART_NUM; do
+                claim_partition "$PART_NUM" || continue
+                PART=$(printf "%04d" $PART_NUM)
+                ARGS=("$@" --task-id "$PART_NUM")
+                if [ -n "$POINT_STORE_FILE" ]; then
+                    ARGS+=(--points "$POINT_STORE_FILE" --num-tasks "$NUM_PARTITIONS")
+                    INPUT_CHUNK=/dev/null
+                else
+                    INPUT_CHUNK="$OUTPUT_DIR/tmp/chunk_${PART}.txt"
+                fi
+                ASSIGNMENT_OUTPUT="$OUTPUT_DIR/tmp/assign_${PART}${ASSIGNMENT_SUFFIX}"
+                if [ "$ASSIGNMENT_FORMAT" == "points" ]; then
+                    python3 mapper.py "$CENTROIDS" "${ARGS[@]}" < "$INPUT_CHUNK" > "$ASSIGNMENT_OUTPUT" || exit 1
+                else
+                    python3 mapper.py "$CENTROIDS" --aggregate --labels "$ASSIGNMENT_OUTPUT" "${ARGS[@]}" < "$INPUT_CHUNK" > /dev/null || exit 1
+                fi
+            done < <(task_partitions)
+        ' bash "$OUTPUT_DIR" "$ASSIGN_CENTROIDS_PATH" "$POINT_STORE_FILE" "$NUM_MAPPERS" "$NUM_PARTITIONS" \
+            "$ASSIGNMENT_FORMAT" "$ASSIGNMENT_SUFFIX" "${MAPPER_ARGS[@]}" || exit 1
+    fi
+    NUM_ASSIGNED=$(find "$OUTPUT_DIR/tmp" -maxdepth 1 -name "assign_[0-9][0-9][0-9][0-9]$ASSIGNMENT_SUFFIX" | wc -l)
+    if [ "$NUM_ASSIGNED" -ne "$NUM_PARTITIONS" ]; then
+        echo "Error: the final assignment wrote $NUM_ASSIGNED of $NUM_PARTITIONS partition files."
+        exit 1
+    fi
+    # Concatenated in partition order, which is input order
+    for ((p = 0; p < NUM_PARTITIONS; p++)); do
+        cat "$OUTPUT_DIR/tmp/assign_$(printf "%04d" $p)$ASSIGNMENT_SUFFIX"
+    done > "$ASSIGNMENT_FILE"
+    rm "$OUTPUT_DIR/tmp/assign_"*
+    trace_event final_assignment "$ASSIGN_START"
+}
+
+# --- Reduce Step ---
+# reduce_partition PREV_CENTROIDS OUTPUT SUFFIX REDUCER_ID: merges the
+# combined_out_XXXX${SUFFIX}.txt files (as a tree with REDUCE_FANIN > 1) and
+# writes reducer REDUCER_ID's slice of the new centroids to OUTPUT.
+reduce_partition() {
+    PARTIALS=("$OUTPUT_DIR/tmp/combined_out_"*"$3.txt")
+    LEVEL=0
+    MERGE_NODE=0 # Numbers the merge nodes of this reducer's tree for the timing trace
+    MERGE_ARGS=(--merge --reducer-id "$4" --num-reducers "$NUM_REDUCERS")
+    if [ "$SWEEP" -eq 1 ]; then
+        MERGE_ARGS+=(--sweep)
+    fi
+    SHUFFLE_START=$(now_us)
+    if [ "$TRACE" -eq 1 ]; then
+        SHUFFLE_RECORDS=$(cat "${PARTIALS[@]}" | wc -l)
+        SHUFFLE_BYTES=$(cat "${PARTIALS[@]}" | wc -c)
+    fi
+    while [ "$REDUCE_FANIN" -gt 1 ] && [ "${#PARTIALS[@]}" -gt "$REDUCE_FANIN" ]; do
+        LEVEL=$((LEVEL + 1))
+        MERGED=()
+        MERGE_PIDS=()
+        for ((g = 0; g < ${#PARTIALS[@]}; g += REDUCE_FANIN)); do
+            MERGED_FILE="$OUTPUT_DIR/tmp/merged_${LEVEL}_$(printf "%04d" $((g / REDUCE_FANIN)))$3.txt"
+            python3 reducer.py "${MERGE_ARGS[@]}" --task-id "$MERGE_NODE" --inputs "${PARTIALS[@]:g:REDUCE_FANIN}" > "$MERGED_FILE" &
+            MERGE_PIDS+=($!)
+            MERGE_NODE=$((MERGE_NODE + 1))
+            MERGED+=("$MERGED_FILE")
+        done
+        for PID in "${MERGE_PIDS[@]}"; do
+            if ! wait "$PID"; then
+                echo "Error: merging the partial sums failed at reduce level $LEVEL."
+                exit 1
+            fi
+        done
+        rm "${PARTIALS[@]}"
+        PARTIALS=("${MERGED[@]}")
+    done
+    trace_event shuffle "$SHUFFLE_START" "$SHUFFLE_RECORDS" "$SHUFFLE_BYTES"
+
+    REDUCE_START=$(now_us)
+    REDUCER_ARGS=(--reducer-id "$4" --num-reducers "$NUM_REDUCERS")
+    if [ "$DELTA" -eq 1 ]; then
+        REDUCER_ARGS+=(--delta "$OUTPUT_DIR/tmp/reduce_state$3.txt")
+    elif [ -n "$MINIBATCH_FRACTION" ]; then
+        REDUCER_ARGS+=(--minibatch "$OUTPUT_DIR/tmp/minibatch_counts$3.txt")
+    elif [ "$SWEEP" -eq 1 ]; then
+        REDUCER_ARGS+=(--sweep --report "$OUTPUT_DIR/tmp/sweep_report.txt")
+    fi
+    if ! python3 reducer.py "$1" --inputs "${PARTIALS[@]}" "${REDUCER_ARGS[@]}" > "$2"; then
+        echo "Error: the reducer failed."
+        exit 1
+    fi
+    rm "${PARTIALS[@]}"
+    trace_event reduce_step "$REDUCE_START"
+}
+
+# Computes the new centroids $2 from the previous ones $1, with one reducer or
+# NUM_REDUCERS range-partitioned ones whose slices are stitched in order.
+run_reduce_step() {
+    if [ "$NUM_REDUCERS" -eq 1 ]; then
+        reduce_partition "$1" "$2" "" 0
+        return
+    fi
+    REDUCER_PIDS=()
+    for ((r = 0; r < NUM_REDUCERS; r++)); do
+        SUFFIX="_r$(printf "%04d" $r)"
+        reduce_partition "$1" "$OUTPUT_DIR/tmp/centroids${SUFFIX}.txt" "$SUFFIX" "$r" &
+        REDUCER_PIDS+=($!)
+    done
+    for PID in "${REDUCER_PIDS[@]}"; do
+        if ! wait "$PID"; then
+            echo "Error: a range-partitioned reducer failed."
+            exit 1
+        fi
+    done
+    # Stitched in reducer order, which is cluster_id order
+    for ((r = 0; r < NUM_REDUCERS; r++)); do
+        cat "$OUTPUT_DIR/tmp/centroids_r$(printf "%04d" $r).txt"
+    done > "$2"
+    rm "$OUTPUT_DIR/tmp/centroids_r"*.txt
+}
+
+# --- Checkpoint Commit ---
+# commit_iteration I CONVERGED: records iteration I (whose centroids file is
+# already in place) as finished, with a snapshot of the mini-batch counts.
+commit_iteration() {
+    if [ -n "$MINIBATCH_FRACTION" ]; then
+        mkdir -p "$OUTPUT_DIR/checkpoint_$1"
+        cp "$OUTPUT_DIR/tmp/minibatch_counts"*.txt "$OUTPUT_DIR/checkpoint_$1/"
+    fi
+    printf 'RUN_ID=%s\nITERATION=%d\nCONVERGED=%d\n' "$RUN_ID" "$1" "$2" > "$CHECKPOINT_FILE.tmp"
+    mv "$CHECKPOINT_FILE.tmp" "$CHECKPOINT_FILE"
+    rm -rf "$OUTPUT_DIR/checkpoint_$(($1 - 1))"
+}
 
 # --- Main Iteration Loop ---
-for i in $(seq 1 $MAX_ITER)
+FINAL_CENTROIDS=""
+LABELS_READY=0
+if [ "$START_ITER" -gt 1 ] && { [ "$(checkpoint_value CONVERGED)" == "1" ] || [ "$LAST_ITER" -ge "$MAX_ITER" ]; }; then
+    echo "Iteration $LAST_ITER already finished the run; only the final output is written."
+    FINAL_CENTROIDS="$OUTPUT_DIR/centroids_${LAST_ITER}.txt"
+    LAST_INPUT_CENTROIDS="$OUTPUT_DIR/centroids_$((LAST_ITER - 1)).txt"
+    START_ITER=$((MAX_ITER + 1))
+    i=$LAST_ITER
+fi
+
+for i in $(seq $START_ITER $MAX_ITER)
 do
     # echo "--- Iteration $i ---"
     PREV_CENTROIDS="$OUTPUT_DIR/centroids_$(($i-1)).txt"
     NEW_CENTROIDS="$OUTPUT_DIR/centroids_$i.txt"
+    export KMEANS_ITERATION=$i
+    ITERATION_START=$(now_us)
     
     # --- Parallel Map -> Combine Step ---
-    # Each task now runs a full Map -> Sort -> Combine pipeline locally.
-    srun --ntasks=$NUM_MAPPERS bash -c '
-        TASK_ID=$(printf "%02d" $SLURM_PROCID)
-        INPUT_CHUNK="$1/tmp/chunk_${TASK_ID}.txt"
-        COMBINED_OUTPUT="$1/tmp/combined_out_${TASK_ID}.txt"
-        python3 mapper.py "$2" < "$INPUT_CHUNK" | sort -k1,1n | python3 combiner.py > "$COMBINED_OUTPUT"
-    ' bash "$OUTPUT_DIR" "$PREV_CENTROIDS" # Pass arguments to the bash -c command
-
-    # --- Aggregate, Sort, and Reduce Step ---
-    # Consolidate all mapper outputs
-    cat "$OUTPUT_DIR/tmp/combined_out_"*.txt > "$OUTPUT_DIR/tmp/global_combined_out.txt"
-    rm "$OUTPUT_DIR/tmp/combined_out_"*.txt
-    
-    sort -k1,1n "$OUTPUT_DIR/tmp/global_combined_out.txt" | python3 reducer.py "$PREV_CENTROIDS" > "$NEW_CENTROIDS"
-    rm "$OUTPUT_DIR/tmp/global_combined_out.txt"
+    if ! run_map_step "$PREV_CENTROIDS" "$i"; then
+        echo "Error: the map step of iteration $i failed."
+        exit 1
+    fi
+    LABELS_READY=$FUSED_ASSIGNMENT
+    LAST_INPUT_CENTROIDS=$PREV_CENTROIDS
+    trace_event map_step "$ITERATION_START"
+
+    # --- Merge and Reduce Step ---
+    # Written under a temporary name and renamed once complete
+    run_reduce_step "$PREV_CENTROIDS" "$NEW_CENTROIDS.tmp"
+    trace_event iteration "$ITERATION_START"
 
     # --- Convergence Check ---
-    if diff -q "$PREV_CENTROIDS" "$NEW_CENTROIDS" > /dev/null; then
+    CONVERGED=0
+    if diff -q "$PREV_CENTROIDS" "$NEW_CENTROIDS.tmp" > /dev/null; then
+        CONVERGED=1
+    fi
+    mv "$NEW_CENTROIDS.tmp" "$NEW_CENTROIDS"
+    if [ "$SWEEP" -eq 1 ]; then
+        awk -v I="$i" '{ print I "\t" $0 }' "$OUTPUT_DIR/tmp/sweep_report.txt" >> "$SWEEP_HISTORY"
+    fi
+    commit_iteration "$i" "$CONVERGED"
+
+    if [ "$CONVERGED" -eq 1 ]; then
         echo "Convergence reached at iteration $i."
-        # Final assignment generation for converged state
-        FINAL_CENTROIDS_PATH=$NEW_CENTROIDS
-        srun --ntasks=$NUM_MAPPERS bash -c '
-            TASK_ID=$(printf "%02d" $SLURM_PROCID)
-            INPUT_CHUNK="$1/tmp/chunk_${TASK_ID}.txt"
-            ASSIGNMENT_OUTPUT="$1/assignments_${TASK_ID}.txt"
-            python3 mapper.py "$2" < "$INPUT_CHUNK" > "$ASSIGNMENT_OUTPUT"
-        ' bash "$OUTPUT_DIR" "$FINAL_CENTROIDS_PATH"
-        cat "$OUTPUT_DIR/assignments_"*.txt > "$OUTPUT_DIR/assignments.txt"
-        cp "$FINAL_CENTROIDS_PATH" "$OUTPUT_DIR/centroids_final.txt"
-        rm "$OUTPUT_DIR/assignments_"*.txt
+        FINAL_CENTROIDS=$NEW_CENTROIDS
         break
     fi
 
     # Handle final output if max iterations is reached
     if [ "$i" -eq "$MAX_ITER" ]; then
         echo "Reached max iterations ($MAX_ITER) without convergence."
-        FINAL_CENTROIDS_PATH=$NEW_CENTROIDS
-        srun --ntasks=$NUM_MAPPERS bash -c '
-            TASK_ID=$(printf "%02d" $SLURM_PROCID)
-            INPUT_CHUNK="$1/tmp/chunk_${TASK_ID}.txt"
-            ASSIGNMENT_OUTPUT="$1/assignments_${TASK_ID}.txt"
-            python3 mapper.py "$2" < "$INPUT_CHUNK" > "$ASSIGNMENT_OUTPUT"
-        ' bash "$OUTPUT_DIR" "$FINAL_CENTROIDS_PATH"
-        cat "$OUTPUT_DIR/assignments_"*.txt > "$OUTPUT_DIR/assignments.txt"
-        cp "$FINAL_CENTROIDS_PATH" "$OUTPUT_DIR/centroids_final.txt"
-        rm "$OUTPUT_DIR/assignments_"*.txt
+        FINAL_CENTROIDS=$NEW_CENTROIDS
     fi
 done
 
-echo "K-Means finished. Final assignment is in $OUTPUT_DIR/assignments.txt"
+# Final assignment generation for the converged or last state
+run_final_assignment "$FINAL_CENTROIDS" "$LAST_INPUT_CENTROIDS" "$LABELS_READY"
+if [ "$SWEEP" -eq 1 ]; then
+    python3 sweep.py report "$OUTPUT_DIR/centroids_final.txt" "$SWEEP_HISTORY" --output-dir "$OUTPUT_DIR"
+fi
+
+stop_workers
+if [ "$TRACE" -eq 1 ]; then
+    cat "$TRACE_DIR"/*.jsonl > "$OUTPUT_DIR/trace.jsonl"
+    echo "Timing trace written to $OUTPUT_DIR/trace.jsonl"
+fi
+if [ "$FINAL_ASSIGNMENT" -eq 1 ]; then
+    echo "K-Means finished. Final assignment is in $ASSIGNMENT_FILE"
+else
+    echo "K-Means finished. Final centroids are in $OUTPUT_DIR/centroids_final.txt"
+fi
 rm -rf "$OUTPUT_DIR/tmp"
\ No newline at end of file
@@ -0,0 +1,75 @@
+"""
+Compensated summation for the per-cluster totals of the K-Means job.
+
+A cluster's coordinate sum is built from billions of points: per block in the
+mapper, across blocks, and across tasks in the reducer. Plain `+=` loses the
+low-order bits of every small term added to a large running total, so the
+error grows with the number of additions. Neumaier's variant of Kahan
+summation carries those lost bits in a separate compensation term:
+
+    t = s + x
+    c += (s - t) + x   if |s| >= |x|   else   (x - t) + s
+    s = t
+
+and s + c is accurate to a few ulps however many terms are added. Within a
+mapper block, np.bincount accumulates at most block-size points in float64;
+only the much longer sums across blocks, tasks and combiner records need the
+compensation.
+"""
+import numpy as np
+
+class CompensatedSum:
+    """Running Neumaier sum of arrays of a fixed shape, e.g. per-cluster coordinate sums (K x D)."""
+
+    def __init__(self, shape):
+        self.sum = np.zeros(shape)
+        self.compensation = np.zeros(shape)
+
+    def add(self, values, rows=None):
+        """Adds values to the whole array, or only to the given rows (which must be distinct)."""
+        values = np.asarray(values, dtype=np.float64)
+        if rows is None:
+            s = self.sum
+            t = s + values
+            self.compensation += np.where(np.abs(s) >= np.abs(values), (s - t) + values, (values - t) + s)
+            self.sum = t
+            return
+        s = self.sum[rows]
+        t = s + values
+        self.compensation[rows] += np.where(np.abs(s) >= np.abs(values), (s - t) + values, (values - t) + s)
+        self.sum[rows] = t
+
+    @property
+    def total(self):
+        """The compensated sum."""
+        return self.sum + self.compensation
+
+def grouped_sum(groups, values, n_groups):
+    """
+    Compensated sum of the rows of values per group (rows with groups[i] == g
+    are added to row g of the result, in input order). Each step adds the
+    j-th row of every group at once, so the loop runs as many times as the
+    largest group has rows, e.g. the number of map tasks in the reducer.
+    """
+    totals = CompensatedSum((n_groups,) + values.shape[1:])
+    if len(groups) == 0:
+        return totals.total
+    order = np.argsort(groups, kind='stable')
+    sorted_groups = groups[order]
+    starts = np.searchsorted(sorted_groups, np.arange(n_groups))
+    rank = np.arange(len(order)) - starts[sorted_groups]
+    by_rank = order[np.argsort(rank, kind='stable')]
+    bounds = np.cumsum(np.bincount(rank))
+    for start, stop in zip(np.concatenate([[0], bounds[:-1]]), bounds):
+        step = by_rank[start:stop]
+        totals.add(values[step], groups[step])
+    return totals.total
+
+def neumaier_add(total, compensation, value):
+    """One scalar Neumaier step; returns the new (total, compensation)."""
+    t = total + value
+    if abs(total) >= abs(value):
+        compensation += (total - t) + value
+    else:
+        compensation += (value - t) + total
+    return t, compensation
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Multi-run K-Means sweeps: several K values or random restarts in one data scan.
+
+A sweep file holds the centers of every run, one per line, prefixed with the
+run they belong to:
+
+    <run_id>\t<x,y,...>
+
+Each run's centers are listed together, in cluster_id order, so run r with
+K_r centers owns K_r consecutive lines. With SWEEP=1, run_mapreduce.sh uses a
+sweep file in place of the centers file: every mapper block is scored against
+all runs at once, and the partial records are keyed by (run_id, cluster_id)
+and carry each cluster's sum of squared distances (SSE):
+
+    <run_id>\t<cluster_id>\t<sum_x,sum_y,...>\t<count>\t<sse>
+
+'reducer.py --sweep' keeps the runs apart, writes the next sweep file and
+reports every run's total SSE ('<run_id>\t<k>\t<points>\t<sse>' lines). The
+SSE is measured against the centers the iteration started from; once a run
+has converged, those are its final centers. Reading and parsing the data is
+paid once per iteration for the whole sweep instead of once per run.
+
+Usage:
+    python3 sweep.py init sweep_centers.txt --points points.csv --k 4 8 16 --restarts 3
+    python3 sweep.py init sweep_centers.txt --centers a.csv b.csv
+    python3 sweep.py report centroids_final.txt sweep_sse.txt --output-dir output
+"""
+import os
+import argparse
+
+import numpy as np
+
+import frame_store
+
+MAX_PICK_ATTEMPTS = 100 # Random draws per requested center before giving up on distinct ones
+
+# --- Sweep files ---
+
+def read_sweep_centers(file_path):
+    """
+    Reads a sweep file into one (total K, D) array of centers and a list of
+    (run_id, start, stop) row ranges, one per run, in file order.
+    """
+    run_ids, rows = [], []
+    with open(file_path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            run_str, point_str = line.strip().split('\t')
+            run_ids.append(int(run_str))
+            rows.append(list(map(float, point_str.split(','))))
+    runs = []
+    for row, run_id in enumerate(run_ids):
+        if runs and runs[-1][0] == run_id:
+            runs[-1][2] = row + 1
+        elif any(run[0] == run_id for run in runs):
+            raise ValueError(f"The centers of run {run_id} in {file_path} are not on consecutive lines")
+        else:
+            runs.append([run_id, row, row + 1])
+    return np.array(rows, dtype=np.float64), [tuple(run) for run in runs]
+
+def format_sweep_centers(centers, runs):
+    """Formats the centers of every run as sweep file lines."""
+    return "".join(
+        f"{run_id}\t{','.join(map(str, point))}\n"
+        for run_id, start, stop in runs
+        for point in centers[start:stop].tolist()
+    )
+
+# --- Partial records ---
+
+def format_sweep_partials(run_id, sums, counts, sse):
+    """Formats one run's non-empty clusters as '<run_id>\t<cluster_id>\t<sums>\t<count>\t<sse>' records."""
+    return "".join(
+        f"{run_id}\t{cid}\t{','.join(map(str, point_sum))}\t{count}\t{cluster_sse}\n"
+        for cid, (point_sum, count, cluster_sse) in enumerate(zip(sums.tolist(), counts.tolist(), sse.tolist()))
+        if count > 0
+    )
+
+def parse_sweep_partials(lines):
+    """Parses sweep records into (run_ids, cluster_ids, sums, counts, sse) arrays."""
+    records = [line.split('\t') for line in lines if line.strip()]
+    if not records:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty((0, 0)), empty, np.empty(0)
+    run_ids = np.array([int(record[0]) for record in records], dtype=np.int64)
+    cluster_ids = np.array([int(record[1]) for record in records], dtype=np.int64)
+    counts = np.array([int(record[3]) for record in records], dtype=np.int64)
+    sse = np.array([float(record[4]) for record in records])
+    sums = np.fromstring(",".join(record[2] for record in records), sep=',').reshape(len(records), -1)
+    return run_ids, cluster_ids, sums, counts, sse
+
+def format_run_report(runs, points, sse):
+    """Formats the per-run totals as '<run_id>\t<k>\t<points>\t<sse>' lines."""
+    return "".join(
+        f"{run_id}\t{stop - start}\t{n}\t{run_sse}\n"
+        for (run_id, start, stop), n, run_sse in zip(runs, points, sse)
+    )
+
+# --- Initial centers ---
+
+def pick_random_centers(points_file, k, rng):
+    """
+    Draws k distinct input points as the initial centers of one restart, with
+    the same sampling as the first k-means|| candidate (see
+    frame_store.pick_random_point).
+    """
+    centers = []
+    for _ in range(MAX_PICK_ATTEMPTS * k):
+        point = frame_store.pick_random_point(points_file, rng)
+        if not any(np.array_equal(point, center) for center in centers):
+            centers.append(point)
+            if len(centers) == k:
+                return np.array(centers)
+    raise ValueError(f"Could not draw {k} distinct points from {points_file}")
+
+def init_sweep(args):
+    """Writes the sweep file: the given center files first, then K x restarts random starts."""
+    center_sets = []
+    for file_path in args.centers or []:
+        center_sets.append((np.loadtxt(file_path, delimiter=',', ndmin=2), file_path))
+    if args.k:
+        if args.points is None:
+            raise SystemExit("Error: --k needs --points to draw the initial centers from.")
+        rng = np.random.default_rng(args.seed)
+        for k in args.k:
+            for restart in range(args.restarts):
+                center_sets.append((pick_random_centers(args.points, k, rng), f"K={k}, restart {restart}"))
+    if not center_sets:
+        raise SystemExit("Error: give --k with --points, or --centers.")
+    if len({centers.shape[1] for centers, _ in center_sets}) > 1:
+        raise SystemExit("Error: every run must have the same number of dimensions.")
+
+    centers = np.concatenate([centers for centers, _ in center_sets])
+    bounds = np.cumsum([0] + [len(centers) for centers, _ in center_sets])
+    runs = [(run_id, start, stop) for run_id, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:]))]
+    with open(args.output, 'w') as f:
+        f.write(format_sweep_centers(centers, runs))
+    for (run_id, start, stop), (_, source) in zip(runs, center_sets):
+        print(f"Run {run_id}: K={stop - start} ({source})")
+    print(f"Wrote {len(runs)} runs with {len(centers)} centers in total to '{args.output}'.")
+    print(f"Run them with: SWEEP=1 ./run_mapreduce.sh {len(centers)} <points> {args.output} <max_iter> <output_dir>")
+
+# --- Report ---
+
+def read_sse_history(file_path):
+    """Reads '<iteration>\t<run_id>\t<k>\t<points>\t<sse>' lines into {run_id: (iteration, k, points, sse)} for the last iteration of every run."""
+    last = {}
+    with open(file_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                iteration, run_id, k, n, sse = line.strip().split('\t')
+                last[int(run_id)] = (int(iteration), int(k), int(n), float(sse))
+    return last
+
+def report_sweep(args):
+    """Writes every run's final centers to its own file and prints the runs ranked by SSE within each K."""
+    centers, runs = read_sweep_centers(args.sweep_file)
+    history = read_sse_history(args.sse_history)
+    os.makedirs(args.output_dir, exist_ok=True)
+    best = {}
+    for run_id, start, stop in runs:
+        with open(os.path.join(args.output_dir, f"centroids_final_run{run_id}.txt"), 'w') as f:
+            f.write("".join(",".join(map(str, point)) + "\n" for point in centers[start:stop].tolist()))
+        sse = history[run_id][3]
+        if stop - start not in best or sse < best[stop - start][1]:
+            best[stop - start] = (run_id, sse)
+
+    lines = ["run_id\tk\tpoints\tsse\tbest_for_k\n"]
+    for run_id, start, stop in sorted(runs, key=lambda run: (run[2] - run[1], history[run[0]][3])):
+        _, k, n, sse = history[run_id]
+        lines.append(f"{run_id}\t{k}\t{n}\t{sse}\t{int(best[k][0] == run_id)}\n")
+    report_path = os.path.join(args.output_dir, 'sweep_report.txt')
+    with open(report_path, 'w') as f:
+        f.writelines(lines)
+    print("".join(lines), end="")
+    for k, (run_id, sse) in sorted(best.items()):
+        print(f"Best run for K={k}: {run_id} (SSE {sse:.6g}), centers in centroids_final_run{run_id}.txt")
+    print(f"-> Report saved to '{report_path}'.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and summarize multi-run K-Means sweeps.")
+    steps = parser.add_subparsers(dest="step", required=True)
+
+    init = steps.add_parser("init", help="Write a sweep file of initial centers.")
+    init.add_argument("output")
+    init.add_argument("--points", help="Input points (CSV, chunk directory or point store) to draw random centers from.")
+    init.add_argument("--k", type=int, nargs="+", help="K of the random-restart runs.")
+    init.add_argument("--restarts", type=int, default=1, help="Random restarts per K.")
+    init.add_argument("--seed", type=int, default=0)
+    init.add_argument("--centers", nargs="+", metavar="CENTERS",
+                      help="Also add one run per existing centers file (e.g. from run_kmeans_init.sh).")
+
+    report = steps.add_parser("report", help="Split the final sweep file per run and rank the runs by SSE.")
+    report.add_argument("sweep_file")
+    report.add_argument("sse_history", help="The driver's sweep_sse.txt.")
+    report.add_argument("--output-dir", default=".")
+    args = parser.parse_args()
+
+    if args.step == "init":
+        if args.restarts < 1 or (args.k and min(args.k) < 1):
+            parser.error("--k and --restarts must be positive")
+        init_sweep(args)
+    else:
+        report_sweep(args)
+
+if __name__ == "__main__":
+    main()
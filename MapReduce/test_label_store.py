@@ -0,0 +1,52 @@
+"""
+Tests for the assignment file formats in label_store.py.
+
+Run from this directory with:
+    python3 -m pytest test_label_store.py
+"""
+import numpy as np
+import pytest
+
+from label_store import LabelWriter, iter_assignment_blocks, read_labels
+
+LABELS = np.array([3, 0, 2, 2, 1, 0, 3], dtype=np.int32)
+
+def write_labels(path, labels, blocks=((0, 4), (4, None))):
+    with LabelWriter(str(path)) as writer:
+        for start, stop in blocks:
+            writer.write(labels[start:stop])
+    return str(path)
+
+@pytest.mark.parametrize("name", ["assign.labels", "assign.txt"])
+def test_label_files_round_trip_in_blocks(tmp_path, name):
+    path = write_labels(tmp_path / name, LABELS)
+    blocks = list(iter_assignment_blocks(path, block_rows=3))
+    assert [len(labels) for labels, _ in blocks] == [3, 3, 1]
+    assert all(points is None for _, points in blocks)
+    assert (np.concatenate([labels for labels, _ in blocks]) == LABELS).all()
+    assert (read_labels(path) == LABELS).all()
+
+def test_binary_labels_are_little_endian_int32(tmp_path):
+    path = write_labels(tmp_path / "assign.labels", LABELS)
+    assert (tmp_path / "assign.labels").read_bytes() == LABELS.astype('<i4').tobytes()
+
+def test_point_lines_yield_labels_and_coordinates(tmp_path):
+    path = tmp_path / "assignments.txt"
+    path.write_text("1\t0.5,1.5\n0\t-2.0,3.0\n1\t4.0,5.0\n")
+    blocks = list(iter_assignment_blocks(str(path), block_rows=2))
+    assert [labels.tolist() for labels, _ in blocks] == [[1, 0], [1]]
+    assert np.array_equal(blocks[0][1], [[0.5, 1.5], [-2.0, 3.0]])
+    assert np.array_equal(blocks[1][1], [[4.0, 5.0]])
+
+def test_blank_lines_are_skipped_without_shortening_blocks(tmp_path):
+    path = tmp_path / "assign.txt"
+    path.write_text("3\n0\n\n2\n2\n1\n0\n3\n\n")
+    blocks = list(iter_assignment_blocks(str(path), block_rows=3))
+    assert [len(labels) for labels, _ in blocks] == [3, 3, 1]
+    assert (read_labels(str(path)) == LABELS).all()
+
+def test_empty_files_have_no_rows(tmp_path):
+    for name in ("empty.labels", "empty.txt"):
+        (tmp_path / name).write_bytes(b"")
+        assert list(iter_assignment_blocks(str(tmp_path / name))) == []
+        assert len(read_labels(str(tmp_path / name))) == 0
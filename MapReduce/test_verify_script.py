@@ -0,0 +1,139 @@
+"""
+Tests for the centroid matching and the assignment check in verify_script.py.
+
+Run from this directory with:
+    python3 -m pytest test_verify_script.py
+"""
+from itertools import permutations
+
+import numpy as np
+import pytest
+
+from label_store import LabelWriter
+from verify_script import MAX_REPORTED_MISMATCHES, compare_assignments, hungarian, match_centroids
+
+def brute_force_cost(cost):
+    """Lowest total cost over every permutation of the columns."""
+    rows = np.arange(len(cost))
+    return min(cost[rows, list(columns)].sum() for columns in permutations(range(len(cost))))
+
+def assert_is_assignment(columns, n):
+    assert sorted(columns.tolist()) == list(range(n))
+
+@pytest.mark.parametrize("n", range(1, 8))
+def test_hungarian_matches_brute_force(n):
+    rng = np.random.default_rng(n)
+    for _ in range(20):
+        cost = rng.random((n, n))
+        columns = hungarian(cost)
+        assert_is_assignment(columns, n)
+        assert cost[np.arange(n), columns].sum() == pytest.approx(brute_force_cost(cost))
+
+def test_hungarian_handles_ties_and_integer_costs():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        cost = rng.integers(0, 3, size=(6, 6)).astype(float)
+        columns = hungarian(cost)
+        assert_is_assignment(columns, 6)
+        assert cost[np.arange(6), columns].sum() == pytest.approx(brute_force_cost(cost))
+
+def test_hungarian_matches_scipy():
+    optimize = pytest.importorskip("scipy.optimize")
+    rng = np.random.default_rng(1)
+    for n in (10, 50, 120):
+        cost = rng.random((n, n)) * 100
+        rows, columns = optimize.linear_sum_assignment(cost)
+        assert cost[np.arange(n), hungarian(cost)].sum() == pytest.approx(cost[rows, columns].sum())
+
+def test_match_centroids_recovers_permutation():
+    rng = np.random.default_rng(2)
+    expected = rng.normal(size=(300, 4)) * 10
+    order = rng.permutation(300)
+    actual = expected[order] + rng.normal(size=(300, 4)) * 1e-9
+    mapping, distances = match_centroids(expected, actual, 1e-6)
+    assert (order[mapping] == np.arange(300)).all()
+    assert distances.max() <= 1e-6
+
+def test_match_centroids_matches_optimal_cost_when_far_apart():
+    optimize = pytest.importorskip("scipy.optimize")
+    rng = np.random.default_rng(3)
+    expected = rng.normal(size=(80, 3))
+    actual = rng.normal(size=(80, 3))
+    mapping, distances = match_centroids(expected, actual, 1e-6)
+    assert_is_assignment(mapping, 80)
+    cost = np.linalg.norm(expected[:, np.newaxis] - actual, axis=2)
+    rows, columns = optimize.linear_sum_assignment(cost)
+    assert distances.sum() == pytest.approx(cost[rows, columns].sum())
+
+# --- Assignment check ---
+
+CENTERS = np.array([[0.0, 0.0], [10.0, 0.0], [0.0, 10.0]])
+MAPPING = np.array([2, 0, 1]) # expected cluster -> actual cluster
+POINTS = np.array([[0.5, 0.0], [9.0, 1.0], [0.0, 9.5], [5.0, 0.0], [1.0, 1.0]])
+EXPECTED = np.array([0, 1, 2, 0, 0]) # (5, 0) is equally far from clusters 0 and 1
+
+def write_points_file(path, labels, points):
+    path.write_text("".join(f"{label}\t{x},{y}\n" for label, (x, y) in zip(labels, points.tolist())))
+    return str(path)
+
+def write_label_file(path, labels):
+    with LabelWriter(str(path)) as writer:
+        writer.write(np.asarray(labels, dtype=np.int32))
+    return str(path)
+
+def test_compare_assignments_accepts_relabelled_output(tmp_path):
+    expected = write_points_file(tmp_path / "expected.csv", EXPECTED, POINTS)
+    for name in ("actual.labels", "actual.txt"):
+        actual = write_label_file(tmp_path / name, MAPPING[EXPECTED])
+        result = compare_assignments(expected, actual, MAPPING, CENTERS, 1e-6, block_rows=2)
+        assert result == (5, 0, 0, [], True)
+
+def test_compare_assignments_counts_ties_and_reports_real_mismatches(tmp_path):
+    expected = write_points_file(tmp_path / "expected.csv", EXPECTED, POINTS)
+    actual_labels = MAPPING[EXPECTED].copy()
+    actual_labels[3] = MAPPING[1] # The tied point went to the other cluster
+    actual_labels[4] = MAPPING[2] # A real mismatch
+    actual = write_label_file(tmp_path / "actual.labels", actual_labels)
+    rows, mismatches, ties, examples, ties_checked = compare_assignments(expected, actual, MAPPING, CENTERS, 1e-6,
+                                                                        block_rows=2)
+    assert (rows, mismatches, ties, ties_checked) == (5, 2, 1, True)
+    assert examples == [(4, 0, int(MAPPING[2]))]
+
+def test_compare_assignments_uses_points_file_for_label_only_files(tmp_path):
+    expected = write_label_file(tmp_path / "expected.txt", EXPECTED)
+    actual_labels = MAPPING[EXPECTED].copy()
+    actual_labels[3] = MAPPING[1]
+    actual = write_label_file(tmp_path / "actual.labels", actual_labels)
+    points = tmp_path / "points.csv"
+    points.write_text("".join(f"{x},{y}\n" for x, y in POINTS.tolist()))
+
+    _, mismatches, ties, examples, ties_checked = compare_assignments(expected, actual, MAPPING, CENTERS, 1e-6,
+                                                                      block_rows=2)
+    assert (mismatches, ties, examples, ties_checked) == (1, 0, [(3, 0, int(MAPPING[1]))], False)
+    _, mismatches, ties, examples, ties_checked = compare_assignments(expected, actual, MAPPING, CENTERS, 1e-6,
+                                                                      str(points), block_rows=2)
+    assert (mismatches, ties, examples, ties_checked) == (1, 1, [], True)
+
+def test_compare_assignments_limits_reported_examples(tmp_path):
+    n = MAX_REPORTED_MISMATCHES + 3
+    expected = write_label_file(tmp_path / "expected.txt", np.zeros(n, dtype=np.int32))
+    actual = write_label_file(tmp_path / "actual.labels", np.full(n, MAPPING[1]))
+    _, mismatches, _, examples, _ = compare_assignments(expected, actual, MAPPING, CENTERS, 1e-6, block_rows=4)
+    assert mismatches == n
+    assert [row for row, _, _ in examples] == list(range(MAX_REPORTED_MISMATCHES))
+
+@pytest.mark.parametrize("actual_labels", [EXPECTED[:4], np.append(EXPECTED, 0)])
+def test_compare_assignments_rejects_a_different_number_of_points(tmp_path, actual_labels):
+    expected = write_points_file(tmp_path / "expected.csv", EXPECTED, POINTS)
+    actual = write_label_file(tmp_path / "actual.labels", MAPPING[actual_labels])
+    with pytest.raises(ValueError, match="different number of points"):
+        compare_assignments(expected, actual, MAPPING, CENTERS, 1e-6, block_rows=2)
+
+@pytest.mark.parametrize("bad_label", [-1, 3])
+def test_compare_assignments_rejects_out_of_range_labels(tmp_path, bad_label):
+    expected = write_points_file(tmp_path / "expected.csv", EXPECTED, POINTS)
+    actual_labels = MAPPING[EXPECTED].copy()
+    actual_labels[2] = bad_label
+    actual = write_label_file(tmp_path / "actual.labels", actual_labels)
+    with pytest.raises(ValueError, match="outside 0..2"):
+        compare_assignments(expected, actual, MAPPING, CENTERS, 1e-6, block_rows=2)
@@ -0,0 +1,131 @@
+"""
+Per-phase timing trace for the K-Means job.
+
+When the KMEANS_TRACE environment variable names a file, every traced phase
+appends one JSON object per line to it:
+
+    {"phase": "map", "iteration": 3, "task": 0, "host": "node01", "pid": 4242,
+     "start": 1700000000.5, "wall_s": 1.84, "cpu_s": 1.79,
+     "records_in": 250000, "records_out": 8, "bytes_in": 13750000, "bytes_out": 612}
+
+iteration and task default to the KMEANS_ITERATION and SLURM_PROCID
+environment variables, which run_mapreduce.sh sets for every step. Each line
+is appended with a single write, so tasks sharing a local file do not
+interleave; run_mapreduce.sh still gives every task its own file and merges
+them into <output_dir>/trace.jsonl at the end. Without KMEANS_TRACE, phases
+cost two clock reads and write nothing.
+"""
+import os
+import sys
+import json
+import time
+import socket
+
+TRACE_ENV = 'KMEANS_TRACE'
+
+def trace_path():
+    """Returns the trace file of this process, or None when tracing is off."""
+    return os.environ.get(TRACE_ENV) or None
+
+def _env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else None
+
+def write_event(event, path=None):
+    """Appends one event to the trace file with a single write."""
+    path = path or trace_path()
+    if path is None:
+        return
+    line = (json.dumps(event) + "\n").encode()
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+class CountingStream:
+    """Wraps a text stream and counts the lines and characters read from or written to it."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lines_read = 0
+        self.chars_read = 0
+        self.lines_written = 0
+        self.chars_written = 0
+
+    def __iter__(self):
+        for line in self.stream:
+            self.lines_read += 1
+            self.chars_read += len(line)
+            yield line
+
+    def readline(self, *args):
+        line = self.stream.readline(*args)
+        if line:
+            self.lines_read += 1
+            self.chars_read += len(line)
+        return line
+
+    def write(self, text):
+        self.lines_written += text.count("\n")
+        self.chars_written += len(text)
+        return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class Phase:
+    """
+    Context manager that times one phase of one task and writes it to the
+    trace on exit. records_in/out and bytes_in/out can be added to while it
+    runs; with stdio=True the lines and characters passing through
+    sys.stdin and sys.stdout are counted as well.
+    """
+
+    def __init__(self, name, iteration=None, task=None, stdio=False, path=None, **fields):
+        self.path = path or trace_path()
+        self.event = {
+            'phase': name,
+            'iteration': iteration if iteration is not None else _env_int('KMEANS_ITERATION'),
+            'task': task if task is not None else _env_int('SLURM_PROCID'),
+        }
+        self.event.update(fields)
+        self.stdio = stdio and self.path is not None
+        self.records_in = self.records_out = self.bytes_in = self.bytes_out = 0
+
+    def count_blocks(self, blocks):
+        """Passes point blocks through, counting their rows and bytes as input."""
+        for block in blocks:
+            self.records_in += len(block)
+            self.bytes_in += block.nbytes
+            yield block
+
+    def __enter__(self):
+        if self.stdio:
+            self._stdin, self._stdout = sys.stdin, sys.stdout
+            sys.stdin, sys.stdout = CountingStream(sys.stdin), CountingStream(sys.stdout)
+        self._start = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        if self.stdio:
+            stdin, stdout = sys.stdin, sys.stdout
+            sys.stdin, sys.stdout = self._stdin, self._stdout
+            self.records_in += stdin.lines_read
+            self.bytes_in += stdin.chars_read
+            self.records_out += stdout.lines_written
+            self.bytes_out += stdout.chars_written
+        if self.path is None or exc_type is not None:
+            return False
+        self.event.update({
+            'host': socket.gethostname(), 'pid': os.getpid(), 'start': round(self._start, 6),
+            'wall_s': round(wall, 6), 'cpu_s': round(cpu, 6),
+            'records_in': self.records_in, 'records_out': self.records_out,
+            'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+        })
+        write_event(self.event, self.path)
+        return False
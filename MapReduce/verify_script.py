@@ -1,9 +1,45 @@
+"""
+Compares a K-Means run against the ground truth written by generate_script.py.
+
+1. Centroids: expected and actual centroids that are mutual nearest
+   neighbours within --tolerance are paired directly, the rest by an
+   optimal one-to-one matching (Hungarian algorithm), and every pair must
+   lie within --tolerance.
+2. Assignments: the expected and actual assignment files are streamed in
+   lockstep, block by block in row order, so memory stays constant however
+   many points there are. Every row's expected label is mapped through the
+   centroid matching and compared with the actual label. A differing row
+   counts as a tie when the point is equally far, within --tie-tolerance,
+   from both centroids; such points may legitimately go either way. Ties
+   need the point coordinates, which come from '<cluster_id>\t<point>'
+   assignment files or from --points.
+
+Usage:
+    python3 verify_script.py expected_centers.csv centroids_final.txt expected_assignments.csv assignments.labels
+"""
 import sys
 import csv
+import argparse
+from itertools import zip_longest
+
 import numpy as np
 
-# A small tolerance for comparing floating-point numbers
+import frame_store
+import point_store
+from bounds import pairwise_squared_distances
+from label_store import READ_BLOCK_ROWS, iter_assignment_blocks
+from point_store import read_point_blocks
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+# Default tolerance for comparing floating-point numbers. Runs with float32
+# points (POINT_DTYPE=float32) need a looser one, e.g. --tolerance 1e-3.
 TOLERANCE = 1e-6
+MAX_REPORTED_MISMATCHES = 5
+MATCH_CHUNK_ROWS = 1024 # Centroids scored per matrix product while matching
 
 # ANSI color codes for pretty printing
 class bcolors:
@@ -28,41 +64,184 @@ def read_csv_to_numpy(filepath):
         print(f"{bcolors.FAIL}Error reading or parsing {filepath}: {e}{bcolors.ENDC}")
         sys.exit(1)
 
-def read_assignments(filepath):
-    """Reads an assignment file (id\tpoint_str) into a dictionary."""
-    assignments = {}
-    try:
-        with open(filepath, 'r') as f:
-            for line in f:
-                parts = line.strip().split('\t')
-                if len(parts) == 2:
-                    cluster_id, point_str = parts
-                    # We use the point string as a key for easy lookup
-                    assignments[point_str] = int(cluster_id)
-    except FileNotFoundError:
-        print(f"{bcolors.FAIL}Error: File not found at '{filepath}'{bcolors.ENDC}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"{bcolors.FAIL}Error reading or parsing {filepath}: {e}{bcolors.ENDC}")
-        sys.exit(1)
-    return assignments
+def hungarian(cost):
+    """
+    Minimum-cost perfect matching of a square cost matrix (Hungarian
+    algorithm with potentials, O(K^3)); returns the column of every row.
+    Used when SciPy's linear_sum_assignment is not available.
+    """
+    n = len(cost)
+    u = np.zeros(n + 1)
+    v = np.zeros(n + 1)
+    row_of = np.zeros(n + 1, dtype=np.int64) # row_of[j]: 1-based row matched to column j, 0 if free
+    way = np.zeros(n + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        row_of[0] = i
+        j0 = 0
+        min_slack = np.full(n + 1, np.inf)
+        used = np.zeros(n + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = row_of[j0]
+            free = ~used[1:]
+            slack = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            way[1:][better] = j0
+            candidates = np.where(free, min_slack[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[row_of[used]] += delta
+            v[used] -= delta
+            min_slack[1:][free] -= delta
+            j0 = j1
+            if row_of[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            row_of[j0] = row_of[j1]
+            j0 = j1
+    columns = np.empty(n, dtype=np.int64)
+    columns[row_of[1:] - 1] = np.arange(n)
+    return columns
 
-def main():
-    if len(sys.argv) != 5:
-        print(f"{bcolors.BOLD}Usage:{bcolors.ENDC}")
-        print("  python3 verify_output.py <expected_centers.csv> <actual_centers.csv> <expected_assignments.csv> <actual_assignments.csv>")
-        sys.exit(1)
+def nearest_rows(a, b):
+    """
+    Index of the nearest row of b for every row of a. Distances come from
+    the |a|^2 - 2ab + |b|^2 matrix product, MATCH_CHUNK_ROWS rows of a at a
+    time, so memory stays at a chunk of the K x K matrix.
+    """
+    nearest = np.empty(len(a), dtype=np.int64)
+    for start in range(0, len(a), MATCH_CHUNK_ROWS):
+        chunk = a[start:start + MATCH_CHUNK_ROWS]
+        nearest[start:start + len(chunk)] = pairwise_squared_distances(chunk, b).argmin(axis=1)
+    return nearest
+
+def match_centroids(expected_centers, actual_centers, tolerance):
+    """
+    Pairs every expected centroid with a distinct actual centroid. Returns
+    (mapping, distances): the actual index and the distance of every
+    expected centroid's match.
 
-    expected_centers_file, actual_centers_file, expected_assignments_file, actual_assignments_file = sys.argv[1:]
+    Expected and actual centroids that are each other's nearest neighbour
+    and lie within tolerance are paired directly; in a passing run that is
+    nearly all of them. Only the rest is matched by minimal summed distance
+    (Hungarian algorithm), on a cost matrix of just those rows and columns.
+    """
+    mapping = nearest_rows(expected_centers, actual_centers)
+    nearest_expected = nearest_rows(actual_centers, expected_centers)
+    rows = np.arange(len(expected_centers))
+    distances = np.linalg.norm(expected_centers - actual_centers[mapping], axis=1)
+    paired = (nearest_expected[mapping] == rows) & (distances <= tolerance)
+
+    left_rows = rows[~paired]
+    if len(left_rows):
+        taken = np.zeros(len(actual_centers), dtype=bool)
+        taken[mapping[paired]] = True
+        left_columns = np.nonzero(~taken)[0]
+        cost = np.sqrt(np.maximum(pairwise_squared_distances(expected_centers[left_rows],
+                                                             actual_centers[left_columns]), 0.0))
+        if linear_sum_assignment is not None:
+            _, columns = linear_sum_assignment(cost)
+        else:
+            columns = hungarian(cost)
+        mapping[left_rows] = left_columns[columns]
+        distances[left_rows] = np.linalg.norm(expected_centers[left_rows] - actual_centers[mapping[left_rows]], axis=1)
+    return mapping, distances
+
+def iter_points(file_path, block_rows, n_dim):
+    """Streams the input points (CSV, point store, block-compressed CSV or shard directory) in blocks of block_rows rows."""
+    if frame_store.is_frame_store(file_path):
+        yield from frame_store.read_partition_blocks(file_path, 0, 1, block_rows)
+        return
+    if point_store.is_point_store(file_path):
+        n_points, _, _ = point_store.read_header(file_path)
+        for start in range(0, n_points, block_rows):
+            yield np.asarray(point_store.open_points(file_path, start, min(start + block_rows, n_points)),
+                             dtype=np.float64)
+        return
+    with open(file_path, 'r') as f:
+        yield from read_point_blocks(f, block_rows, n_dim)
+
+def compare_assignments(expected_file, actual_file, mapping, expected_centers, tie_tolerance,
+                        points_file=None, block_rows=READ_BLOCK_ROWS):
+    """
+    Streams both assignment files in lockstep and returns (rows, mismatches,
+    ties, examples, ties_checked). examples lists up to MAX_REPORTED_MISMATCHES
+    (row, expected label, actual label) tuples of differing rows that are
+    not ties; ties_checked is False when no point coordinates were available.
+    """
+    k = len(expected_centers)
+    inverse = np.argsort(mapping) # actual centroid -> expected centroid
+    points_blocks = iter_points(points_file, block_rows, expected_centers.shape[1]) if points_file else None
+    rows = mismatches = ties = 0
+    examples = []
+    ties_checked = True
+    for expected, actual in zip_longest(iter_assignment_blocks(expected_file, block_rows),
+                                        iter_assignment_blocks(actual_file, block_rows)):
+        if expected is None or actual is None or len(expected[0]) != len(actual[0]):
+            raise ValueError("the assignment files have a different number of points")
+        (expected_labels, points), (actual_labels, actual_points) = expected, actual
+        if actual_labels.min() < 0 or actual_labels.max() >= k:
+            raise ValueError(f"'{actual_file}' holds labels outside 0..{k - 1} after row {rows}")
+        if points_blocks is not None:
+            points = next(points_blocks, None)
+            if points is None or len(points) != len(expected_labels):
+                raise ValueError(f"'{points_file}' and the assignment files have a different number of points")
+        elif points is None:
+            points = actual_points
+
+        differ = np.nonzero(mapping[expected_labels] != actual_labels)[0]
+        if len(differ):
+            tied = np.zeros(len(differ), dtype=bool)
+            if points is None:
+                ties_checked = False
+            else:
+                # Distances to the expected centroid and to the one the actual label stands for
+                moved = points[differ]
+                to_expected = np.linalg.norm(moved - expected_centers[expected_labels[differ]], axis=1)
+                to_actual = np.linalg.norm(moved - expected_centers[inverse[actual_labels[differ]]], axis=1)
+                tied = np.abs(to_expected - to_actual) <= tie_tolerance
+            mismatches += len(differ)
+            ties += int(tied.sum())
+            for row in differ[~tied][:MAX_REPORTED_MISMATCHES - len(examples)]:
+                examples.append((rows + int(row), int(expected_labels[row]), int(actual_labels[row])))
+        rows += len(expected_labels)
+    return rows, mismatches, ties, examples, ties_checked
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the MapReduce output against the ground truth.")
+    parser.add_argument("expected_centers_file")
+    parser.add_argument("actual_centers_file")
+    parser.add_argument("expected_assignments_file")
+    parser.add_argument("actual_assignments_file")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help=f"Largest distance between matching centroids (default: {TOLERANCE}).")
+    parser.add_argument("--tie-tolerance", type=float,
+                        help="Largest difference between a point's distances to two centroids that still counts "
+                             "as a tie (default: twice --tolerance).")
+    parser.add_argument("--max-mismatches", type=int, default=0,
+                        help="Number of points, ties excluded, allowed in a different cluster than expected (default: 0).")
+    parser.add_argument("--points", metavar="FILE",
+                        help="Input points (CSV, *.bin, *.gz/*.zst frame store or shard directory), used to detect ties when neither "
+                             "assignment file holds the point coordinates.")
+    parser.add_argument("--block-rows", type=int, default=READ_BLOCK_ROWS,
+                        help=f"Rows of each file held in memory at a time (default: {READ_BLOCK_ROWS}).")
+    args = parser.parse_args()
+    if args.tolerance < 0:
+        parser.error("--tolerance must be non-negative")
+    if args.tie_tolerance is None:
+        # Each distance may be off by up to the centroid tolerance
+        args.tie_tolerance = 2 * args.tolerance
+    if args.block_rows < 1:
+        parser.error("--block-rows must be positive")
 
     print(f"{bcolors.HEADER}--- K-Means Verification Script ---{bcolors.ENDC}")
 
-    # --- 1. Load all data ---
-    print("Loading data files...")
-    expected_centers = read_csv_to_numpy(expected_centers_file)
-    actual_centers = read_csv_to_numpy(actual_centers_file)
-    expected_assignments = read_assignments(expected_assignments_file)
-    actual_assignments = read_assignments(actual_assignments_file)
+    # --- 1. Load the centroids ---
+    print("Loading centroid files...")
+    expected_centers = read_csv_to_numpy(args.expected_centers_file)
+    actual_centers = read_csv_to_numpy(args.actual_centers_file)
 
     # --- 2. Verify Centroids ---
     print("\nVerifying final centroids...")
@@ -70,59 +249,47 @@ def main():
         print(f"{bcolors.FAIL}Failure: Centroid files have different shapes! Expected {expected_centers.shape}, got {actual_centers.shape}{bcolors.ENDC}")
         sys.exit(1)
 
-    # This map will store {expected_id -> actual_id}
-    centroid_map = {}
-    used_actual_indices = set()
-
-    for i, exp_center in enumerate(expected_centers):
-        # Find the closest actual center to this expected center
-        distances = np.linalg.norm(actual_centers - exp_center, axis=1)
-        best_match_idx = np.argmin(distances)
-        min_dist = distances[best_match_idx]
-
-        if min_dist > TOLERANCE:
-            print(f"{bcolors.FAIL}Failure: No matching actual centroid found for expected centroid #{i} {exp_center}{bcolors.ENDC}")
-            sys.exit(1)
-        
-        if best_match_idx in used_actual_indices:
-            print(f"{bcolors.FAIL}Failure: Actual centroid #{best_match_idx} was matched to multiple expected centroids. This indicates a problem.{bcolors.ENDC}")
-            sys.exit(1)
-            
-        centroid_map[i] = best_match_idx
-        used_actual_indices.add(best_match_idx)
-
-    print(f"{bcolors.OKGREEN}Success: All {len(expected_centers)} centroids matched perfectly.{bcolors.ENDC}")
-    # print(f"  > Centroid ID mapping: {centroid_map}")
+    mapping, distances = match_centroids(expected_centers, actual_centers, args.tolerance)
+    worst = int(np.argmax(distances))
+    if distances[worst] > args.tolerance:
+        far = int((distances > args.tolerance).sum())
+        print(f"{bcolors.FAIL}Failure: {far} expected centroid(s) have no actual centroid within {args.tolerance:g}; "
+              f"the worst is #{worst} {expected_centers[worst]}, matched to actual #{mapping[worst]} "
+              f"{distances[worst]:.3g} away.{bcolors.ENDC}")
+        sys.exit(1)
+
+    print(f"{bcolors.OKGREEN}Success: All {len(expected_centers)} centroids matched within {args.tolerance:g} "
+          f"(largest distance {distances[worst]:.3g}).{bcolors.ENDC}")
 
     # --- 3. Verify Assignments ---
-    # REMOVED, points can be assigned to clusters arbitrarily if equal distance? Either way as long as centroids are same should be fine.
-    # print("\nVerifying point assignments...")
-    # if len(expected_assignments) != len(actual_assignments):
-    #     print(f"{bcolors.FAIL}Failure: Assignment files have a different number of points! Expected {len(expected_assignments)}, got {len(actual_assignments)}{bcolors.ENDC}")
-    #     sys.exit(1)
-
-    # mismatch_count = 0
-    # for point_str, expected_id in expected_assignments.items():
-    #     if point_str not in actual_assignments:
-    #         print(f"{bcolors.FAIL}Failure: Point '{point_str}' is in the expected assignments but not in the actual output.{bcolors.ENDC}")
-    #         mismatch_count += 1
-    #         continue
-
-    #     actual_id = actual_assignments[point_str]
-        
-    #     # Use the map to check for correctness
-    #     if centroid_map[expected_id] != actual_id:
-    #         mismatch_count += 1
-    #         if mismatch_count < 5: # Print first few mismatches for debugging
-    #             print(f"{bcolors.WARNING}  - Mismatch for point {point_str}: Expected cluster {expected_id} (maps to actual id {centroid_map[expected_id]}), but got actual id {actual_id}{bcolors.ENDC}")
-
-    # if mismatch_count == 0:
-    #     print(f"{bcolors.OKGREEN}Success: All {len(expected_assignments)} point assignments are correct.{bcolors.ENDC}")
-    # else:
-    #     print(f"{bcolors.FAIL}Failure: Found {mismatch_count} incorrect point assignments.{bcolors.ENDC}")
-    #     sys.exit(1)
-        
+    print("\nVerifying point assignments...")
+    try:
+        rows, mismatches, ties, examples, ties_checked = compare_assignments(
+            args.expected_assignments_file, args.actual_assignments_file, mapping, expected_centers,
+            args.tie_tolerance, args.points, args.block_rows)
+    except FileNotFoundError as e:
+        print(f"{bcolors.FAIL}Error: File not found at '{e.filename}'{bcolors.ENDC}")
+        sys.exit(1)
+    except ValueError as e:
+        print(f"{bcolors.FAIL}Failure: {e}{bcolors.ENDC}")
+        sys.exit(1)
+
+    for row, expected_id, actual_id in examples: # Print first few mismatches for debugging
+        print(f"{bcolors.WARNING}  - Mismatch for row {row}: Expected cluster {expected_id} (maps to actual id {mapping[expected_id]}), but got actual id {actual_id}{bcolors.ENDC}")
+    if not ties_checked:
+        print(f"{bcolors.WARNING}  Ties were not checked: no point coordinates (pass --points).{bcolors.ENDC}")
+
+    wrong = mismatches - ties
+    summary = f"{mismatches} of {rows} points differ, {ties} of them ties within {args.tie_tolerance:g}"
+    if mismatches == 0:
+        print(f"{bcolors.OKGREEN}Success: All {rows} point assignments are correct.{bcolors.ENDC}")
+    elif wrong <= args.max_mismatches:
+        print(f"{bcolors.OKGREEN}Success: {summary}; {wrong} allowed by --max-mismatches {args.max_mismatches}.{bcolors.ENDC}")
+    else:
+        print(f"{bcolors.FAIL}Failure: {summary}; {wrong} incorrect point assignments.{bcolors.ENDC}")
+        sys.exit(1)
+
     print(f"\n{bcolors.BOLD}{bcolors.OKGREEN}Verification Complete: The MapReduce output matches the expected output!{bcolors.ENDC}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Persistent K-Means mapper task.
+
+Started once per SLURM task by run_mapreduce.sh (PERSISTENT_WORKERS=1). The
+worker loads its partition into memory a single time and then serves
+commands from the driver for the rest of the job, so each iteration costs no
+process launch, no imports and no re-read of the chunk.
+
+Protocol (seq counts messages from 1, XX is the two-digit task id and XXXX
+the four-digit one used for partition files):
+    <control_dir>/msg_<seq>      written atomically by the driver, one line:
+                                     map    <centroids_file> <output_prefix> [iteration]
+                                     assign <centroids_file> <output_prefix> [iteration]
+                                     labels <output_prefix> [iteration]
+                                     stop
+                                 (the iteration is only used for the timing trace)
+    <output_prefix>XXXX.txt      this task's result: combiner records for
+                                 'map' (signed changes with --delta),
+                                 '<cluster_id>\t<point>' lines for 'assign'
+    <output_prefix>XXXX.labels   with --assignment-format labels or text
+    (or .txt)                    (see label_store.py), the labels written by
+                                 'assign', and by 'labels', which writes the
+                                 labels of the last 'map' (--keep-labels)
+                                 without assigning the points again
+    <output_prefix>XXXX_rYYYY.txt
+                                 with --num-reducers > 1, the 'map' records of
+                                 reducer YYYY's cluster_id range
+    <control_dir>/done_<seq>_XX  created once the result is complete
+    <control_dir>/error_<seq>_XX the traceback, if the message (or, for seq 1,
+                                 loading the partition) failed; the worker
+                                 then exits
+"""
+import os
+import time
+import traceback
+import argparse
+
+import numpy as np
+
+import frame_store
+import point_store
+import timing
+from bounds import HamerlyAssigner
+from centroid_index import INDEX_MODES, build_centroid_index
+from label_store import ASSIGNMENT_FORMATS, LabelWriter, assignment_suffix
+from mapper import (read_centroids, read_store_blocks, sample_blocks, assign_blocks, aggregate_blocks,
+                    aggregate_delta_blocks, format_partial_sums, format_assignments)
+from point_store import read_point_blocks
+from reducer import partition_records
+
+POLL_INTERVAL = 0.01 # Seconds between checks for the next driver message
+
+def load_partition(args):
+    """Reads this task's points into one in-memory (rows, D) array of --dtype, or None if the chunk is empty."""
+    if args.points and frame_store.is_frame_store(args.points):
+        blocks = list(read_store_blocks(args.points, args.task_id, args.num_tasks, args.block_size, args.dtype))
+        return np.concatenate(blocks) if blocks else None
+    if args.points:
+        return np.array(point_store.open_partition(args.points, args.task_id, args.num_tasks), dtype=args.dtype)
+    with open(args.chunk, 'r') as f:
+        first_line = f.readline().strip()
+        if not first_line:
+            return None
+        n_dim = len(first_line.split(','))
+        f.seek(0)
+        return np.concatenate(list(read_point_blocks(f, args.block_size, n_dim, args.dtype)))
+
+def iter_blocks(points, block_size):
+    """Yields views of the resident partition in blocks of at most block_size rows."""
+    for start in range(0, len(points), block_size):
+        yield points[start:start + block_size]
+
+def wait_for_message(msg_path):
+    """Blocks until the driver has published msg_path and returns its fields."""
+    while not os.path.exists(msg_path):
+        time.sleep(POLL_INTERVAL)
+    with open(msg_path, 'r') as f:
+        return f.read().split()
+
+def report_error(control_dir, seq, task_id):
+    """Publishes the traceback of a failed message as error_<seq>_XX so that the driver stops waiting for it."""
+    path = os.path.join(control_dir, f"error_{seq}_{task_id:02d}")
+    with open(f"{path}.tmp", 'w') as f:
+        f.write(traceback.format_exc())
+    os.replace(f"{path}.tmp", path)
+
+def write_atomically(path, pieces, phase=None):
+    """
+    Writes an iterable of text pieces to path so that readers never observe a
+    partial file. The lines and characters written are added to phase's output.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        for piece in pieces:
+            f.write(piece)
+            if phase is not None:
+                phase.records_out += piece.count("\n")
+                phase.bytes_out += len(piece)
+    os.replace(tmp_path, path)
+
+def write_labels_atomically(path, label_blocks, phase):
+    """Writes blocks of labels to path (see label_store.py) so that readers never observe a partial file."""
+    tmp_path = f"{path}.tmp{os.path.splitext(path)[1]}"
+    with LabelWriter(tmp_path) as writer:
+        for labels in label_blocks:
+            writer.write(labels)
+    phase.records_out, phase.bytes_out = writer.count, writer.bytes
+    os.replace(tmp_path, path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent K-Means mapper task driven by run_mapreduce.sh.")
+    parser.add_argument("control_dir", help="Directory the driver publishes messages in.")
+    parser.add_argument("--task-id", type=int, required=True)
+    parser.add_argument("--num-tasks", type=int, required=True)
+    parser.add_argument("--block-size", type=int, default=100000)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--chunk", help="Text chunk holding this task's points.")
+    source.add_argument("--points", metavar="STORE", help="Binary point store or block-compressed CSV; this task's rows are loaded.")
+    parser.add_argument("--bounds", action="store_true",
+                        help="Keep Hamerly distance bounds in memory to skip most distance computations.")
+    parser.add_argument("--index", choices=INDEX_MODES, default='auto',
+                        help="Nearest-centroid search strategy (see centroid_index.py).")
+    parser.add_argument("--delta", action="store_true",
+                        help="Answer 'map' with only the changes from points that switched cluster (for reducer.py --delta).")
+    parser.add_argument("--sample-fraction", type=float, default=1.0,
+                        help="Mini-batch mode: answer 'map' from a fresh random sample of this fraction of the points.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for --sample-fraction; combined with the task id and message number.")
+    parser.add_argument("--dtype", choices=point_store.DTYPES, default='float64',
+                        help="Precision the resident points are kept and compared in (float32 halves the memory).")
+    parser.add_argument("--num-reducers", type=int, default=1,
+                        help="Split 'map' results by cluster_id range into one file per range-partitioned reducer.")
+    parser.add_argument("--assignment-format", choices=ASSIGNMENT_FORMATS, default='points',
+                        help="What 'assign' and 'labels' write: binary labels, one label per line, or point lines.")
+    parser.add_argument("--keep-labels", action="store_true",
+                        help="Keep the labels of every 'map' in memory so that 'labels' can write them.")
+    args = parser.parse_args()
+    if not 0.0 < args.sample_fraction <= 1.0:
+        parser.error("--sample-fraction must be in (0, 1]")
+    if args.sample_fraction < 1.0 and (args.bounds or args.delta or args.keep_labels):
+        parser.error("--sample-fraction cannot be combined with --bounds, --delta or --keep-labels")
+
+    assigner = None
+    previous = None
+    last_labels = [] # Label blocks of the last 'map' with --keep-labels
+    seq = 1
+    try:
+        with timing.Phase('load', task=args.task_id) as phase:
+            points = load_partition(args)
+            if points is not None:
+                phase.records_in, phase.bytes_in = len(points), points.nbytes
+        while True:
+            message = wait_for_message(os.path.join(args.control_dir, f"msg_{seq}"))
+            command = message[0]
+            if command == 'stop':
+                break
+            if command == 'labels':
+                message.insert(1, None) # No centroids: the labels of the last 'map' are written as they are
+            centroids_file, output_prefix = message[1:3]
+            iteration = int(message[3]) if len(message) > 3 else None
+            labels_path = f"{output_prefix}{args.task_id:04d}{assignment_suffix(args.assignment_format)}"
+            with timing.Phase('assign' if command == 'labels' else command, iteration=iteration, task=args.task_id) as phase:
+                if command == 'labels':
+                    write_labels_atomically(labels_path, last_labels, phase)
+                    output = None
+                else:
+                    centroids = np.array(read_centroids(centroids_file), dtype=np.float64)
+                    if points is None:
+                        points = np.empty((0, centroids.shape[1]), dtype=args.dtype)
+                    if args.bounds and assigner is None:
+                        assigner = HamerlyAssigner.empty(len(points))
+                    if args.delta and previous is None:
+                        previous = np.full(len(points), -1, dtype=np.int32)
+                    index = build_centroid_index(centroids, args.index)
+                    blocks = phase.count_blocks(iter_blocks(points, args.block_size))
+
+                if command == 'map':
+                    on_labels = None
+                    if args.keep_labels:
+                        last_labels = []
+                        on_labels = last_labels.append
+                    if assigner is not None:
+                        assigner.set_centroids(centroids, index)
+                    if args.sample_fraction < 1.0:
+                        blocks = sample_blocks(blocks, args.sample_fraction,
+                                               np.random.default_rng([args.seed, args.task_id, seq]))
+                    if args.delta:
+                        sums, counts, touched, previous = aggregate_delta_blocks(centroids, blocks, previous, assigner,
+                                                                                 index, on_labels)
+                        output = [format_partial_sums(sums, counts, touched)]
+                    else:
+                        sums, counts = aggregate_blocks(centroids, blocks, assigner, index, on_labels)
+                        output = [format_partial_sums(sums, counts)]
+                elif command == 'assign' and args.assignment_format != 'points':
+                    write_labels_atomically(labels_path, (labels for _, labels in assign_blocks(centroids, blocks, index=index)),
+                                            phase)
+                    output = None
+                elif command == 'assign':
+                    output = (
+                        format_assignments(block, labels)
+                        for block, labels in assign_blocks(centroids, blocks, index=index)
+                    )
+                elif command != 'labels':
+                    raise ValueError(f"unknown command '{command}' in message {seq}")
+
+                if command == 'map' and args.num_reducers > 1:
+                    records = "".join(output).splitlines(keepends=True)
+                    for r, lines in enumerate(partition_records(records, len(centroids), args.num_reducers)):
+                        write_atomically(f"{output_prefix}{args.task_id:04d}_r{r:04d}.txt", lines, phase)
+                elif output is not None:
+                    write_atomically(f"{output_prefix}{args.task_id:04d}.txt", output, phase)
+            open(os.path.join(args.control_dir, f"done_{seq}_{args.task_id:02d}"), 'w').close()
+            seq += 1
+    except Exception:
+        report_error(args.control_dir, seq, args.task_id)
+        raise
+
+if __name__ == "__main__":
+    main()